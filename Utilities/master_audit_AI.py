@@ -1,23 +1,13 @@
 import pandas as pd
 import re
+from code_matcher import NORMALIZATION_MAP as normalization_map
 
 # 1. Load your master file
 df = pd.read_csv('/content/drive/MyDrive/Colab_Outputs/Adjudicated_April.csv')
 
 # --- NORMALIZATION & CLEANING LOGIC ---
-# Define the mapping of common "drifts" to the "Gold Standard"
-normalization_map = {
-    "Patron Accounts": "Patron Account",
-    "Borrow Techs": "Borrow Tech",
-    "Faculty Instruction Support": "Faculty Instructional Support",
-    "Finding Relevant Sources": "Finding Relevant Resources",
-    "Evaluation Information": "Evaluating Information",
-    "Known Item: Audiovisual": "Known Item: AV",
-    "Find Item by Author": "Find by Author",
-    "Finding relevant sources": "Finding Relevant Resources",
-    "Research Strategies": "Research Strategy",
-    "Final Content: Known Item: Book" : "Known Item: Book"
-}
+# normalization_map (common "drifts" -> "Gold Standard") is code_matcher.NORMALIZATION_MAP,
+# shared with the tiered audit's code-name matcher
 
 def split_and_normalize(val):
     if pd.isna(val): return []
@@ -0,0 +1,155 @@
+import asyncio
+import threading
+from gemini_gateway import agenerate_content
+from prompt_cache import prepare_request, prompt_hash, is_stale_cache_error, inline_after_stale_cache
+from retry_policy import DEFAULT_POLICY
+from response_cache import RESPONSE_CACHE
+from dead_letter import check_blocked, ParseFailure
+from shutdown import ShutdownRequested, shutdown_requested
+from preprocessing_util import clean_raw_text, parse_model_response, AI_CONFIG, MODEL_NAME
+
+# --- CONFIGURATION ---
+# How many generate_content requests may be in flight at once.
+MAX_IN_FLIGHT = 8
+
+
+async def acode_transcript(client, system_prompt, transcript, semaphore,
+                           coffee_reminder="", insufficient_label="Abandoned Chat | Insufficient data",
+                           base_config=AI_CONFIG, answer_formatter=None,
+                           policy=DEFAULT_POLICY, cache=RESPONSE_CACHE, on_error=None, precleaned=False):
+    """
+    Async twin of code_transcript(): same prompt layout, same gateway retry
+    policy and the same (clean_code, mental_process) return contract.
+    `answer_formatter` turns a structured (JSON schema) answer back into that contract.
+    `on_error(exc)` receives the final exception of a failed row (for the dead-letter queue).
+    `precleaned=True` means the transcript already comes from the cleaned corpus (corpus.py).
+    """
+    cleaned_input = transcript if precleaned else clean_raw_text(transcript)
+    if len(str(cleaned_input)) < 10:
+        return insufficient_label, ""
+
+    try:
+        # caches.get/create/update block (and back off) under a thread lock: keep them off the loop
+        contents, config = await asyncio.to_thread(prepare_request, client, system_prompt, cleaned_input,
+                                                   coffee_reminder, base_config=base_config)
+        try:
+            response = await agenerate_content(client, model=MODEL_NAME, contents=contents, config=config,
+                                               policy=policy, semaphore=semaphore, cache=cache)
+        except ShutdownRequested:
+            raise
+        except Exception as e:
+            # A cached prompt that was deleted or belongs to another project: resend this row inline
+            if not is_stale_cache_error(e, config):
+                raise
+            contents, config = await asyncio.to_thread(inline_after_stale_cache, system_prompt, contents, config)
+            response = await agenerate_content(client, model=MODEL_NAME, contents=contents, config=config,
+                                               policy=policy, semaphore=semaphore, cache=cache)
+        check_blocked(response)
+
+        clean_code, mental_process = parse_model_response(response)
+        if answer_formatter:
+            clean_code = answer_formatter(clean_code)
+            if clean_code.startswith("ERROR"):
+                raise ParseFailure(clean_code)
+        return clean_code, mental_process
+
+    except ShutdownRequested:
+        raise
+    except Exception as e:
+        # The gateway has already retried transient errors; this is the final failure
+        if on_error:
+            on_error(e)
+        return f"ERROR | {str(e)[:50]}", ""
+
+
+async def code_batch_async(records, client, system_prompt, coffee_reminder="",
+                           concurrency=MAX_IN_FLIGHT, on_result=None,
+                           dead_letter=None, source='', dead_letter_keys=None, **coder_kwargs):
+    """
+    Codes an iterable of (StudyID, transcript) pairs with at most `concurrency`
+    requests in flight.
+
+    Returns {StudyID: (clean_code, mental_process)}. If `on_result` is given it is
+    called as on_result(study_id, clean_code, mental_process) as each row finishes,
+    so orchestrators can checkpoint without waiting for the whole batch.
+    With a `dead_letter` queue, failed rows are recorded there (tagged with
+    `source`, usually the output file) and rows that succeed are resolved.
+    `dead_letter_keys(study_id)` lists the StudyIDs a sent row answers for
+    (its dedup group), so each of them is recorded or resolved.
+    During a graceful shutdown rows that were not sent yet are skipped and
+    ShutdownRequested is raised once the in-flight ones have finished.
+    """
+    semaphore = asyncio.BoundedSemaphore(concurrency)
+    results = {}
+    current_prompt = prompt_hash(MODEL_NAME, system_prompt)
+
+    async def worker(study_id, transcript):
+        failures = []
+        try:
+            clean_code, mental_process = await acode_transcript(
+                client, system_prompt, transcript, semaphore, coffee_reminder,
+                on_error=failures.append, **coder_kwargs
+            )
+        except ShutdownRequested:
+            return   # never sent; stays pending for the next run
+        except Exception as e:
+            failures.append(e)
+            clean_code, mental_process = f"ERROR | {str(e)[:50]}", ""
+
+        if dead_letter is not None:
+            record_dead_letter(dead_letter, study_id, failures[-1] if failures else None, source,
+                               current_prompt, dead_letter_keys)
+
+        results[study_id] = (clean_code, mental_process)
+        if on_result:
+            on_result(study_id, clean_code, mental_process)
+
+    await asyncio.gather(*(worker(study_id, transcript) for study_id, transcript in records))
+    if shutdown_requested():
+        raise ShutdownRequested("stopped before every row was sent")
+    return results
+
+
+def record_dead_letter(dead_letter, study_id, failure, source, current_prompt, dead_letter_keys=None):
+    """Records (failure) or resolves (None) the DLQ entry of a sent row and every row it answers for."""
+    for key in dead_letter_keys(study_id) if dead_letter_keys else [study_id]:
+        if failure is not None:
+            dead_letter.record(key, failure, source, current_prompt, MODEL_NAME)
+        else:
+            dead_letter.resolve(key)
+
+
+def run_blocking(coro):
+    """
+    Runs a coroutine to completion from synchronous code.
+
+    Colab/Jupyter already run an event loop in the main thread, so in that case
+    the coroutine gets its own loop on a worker thread instead of asyncio.run().
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    outcome = {}
+
+    def runner():
+        try:
+            outcome['results'] = asyncio.run(coro)
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=runner, daemon=True)
+    thread.start()
+    thread.join()
+
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['results']
+
+
+def code_batch(records, client, system_prompt, coffee_reminder="",
+               concurrency=MAX_IN_FLIGHT, on_result=None, **kwargs):
+    """Blocking entry point for scripts and notebooks (see code_batch_async)."""
+    return run_blocking(code_batch_async(records, client, system_prompt, coffee_reminder,
+                                         concurrency, on_result, **kwargs))
@@ -0,0 +1,66 @@
+import contextlib
+import json
+import os
+import threading
+
+# --- CONFIGURATION ---
+# Every pipeline output goes through atomic_write(): the data is written to a
+# temp file next to the target, fsynced, then renamed over it. A runtime killed
+# mid-write leaves the previous complete file (plus a stray *.tmp), never a
+# truncated CSV that the resume logic would misread.
+
+
+def _fsync_dir(directory):
+    """Makes the rename itself durable. Some mounts (e.g. Drive's FUSE) don't allow it; that's fine."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w', encoding='utf-8'):
+    """
+    Yields a file object for `path` that only replaces the target once the
+    block finishes without an exception. Use mode='wb' for binary writers.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # Unique per process and thread so concurrent writers never share a temp file
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    binary = 'b' in mode
+    try:
+        with open(tmp_path, mode, encoding=None if binary else encoding, newline=None if binary else '') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    _fsync_dir(directory)
+
+
+def write_csv(df, path, **kwargs):
+    """df.to_csv(path, ...) via a temp file and rename."""
+    with atomic_write(path) as f:
+        df.to_csv(f, **kwargs)
+
+
+def write_parquet(df, path, **kwargs):
+    """df.to_parquet(path, ...) via a temp file and rename."""
+    with atomic_write(path, 'wb') as f:
+        df.to_parquet(f, **kwargs)
+
+
+def write_json(obj, path, **kwargs):
+    """json.dump(obj, ...) via a temp file and rename."""
+    with atomic_write(path) as f:
+        json.dump(obj, f, **kwargs)
@@ -1,29 +1,40 @@
 import json
 import os
-import time
 import pandas as pd
-from google import genai
-from google.genai import types
-from google.colab import userdata
-from preprocessing_util import clean_raw_text, AI_CONFIG, MODEL_NAME
+from gemini_gateway import generate_content
+from model_backend import get_client
+from preprocessing_util import clean_raw_text, AI_CONFIG, MODEL_NAME, REDACT_PII
+from async_engine import code_batch
+from retry_policy import DEFAULT_POLICY, print_retry_report
+from response_cache import RESPONSE_CACHE, print_cache_report
+from telemetry import TELEMETRY, print_telemetry_report
+from journal import ResultJournal, journal_path_for
+from dead_letter import DeadLetterQueue, REPROCESS_CONCURRENCY, REPROCESS_POLICY, print_dead_letter_report
+from atomic_io import write_csv
+from corpus import corpus_path_for, cleaned_records
+from compaction import compact_records, COMPACT
+from shutdown import ShutdownRequested, graceful_shutdown
+from budget import GOVERNOR, print_budget_report
+from redaction import print_redaction_report
 
 # --- INITIALIZATION ---
-client = genai.Client(
-    api_key=userdata.get('GEMINI_API_KEY'),
-    # This correctly forces the SDK to use the Developer branch (not Vertex)
-    vertexai=False,
-    # This ensures you're hitting the Beta endpoint for the latest 3.1 features
-    http_options=types.HttpOptions(api_version='v1beta')
-)
+client = get_client()
 
 with open('codebook_theme.json', 'r') as f:
     CODEBOOK_DICT = json.load(f)
 
 INPUT_FILE = "TestSet_Round10b.csv"
+CORPUS_FILE = corpus_path_for(INPUT_FILE)   # cleaned text from `python corpus.py INPUT_FILE`, if built
 OUTPUT_FILE = "/content/drive/MyDrive/Colab_Outputs/Complete1746.csv"
+JOURNAL_FILE = journal_path_for(OUTPUT_FILE)   # per-row results, appended as they finish
+DEAD_LETTER_FILE = os.path.splitext(OUTPUT_FILE)[0] + '.dead_letters.jsonl'
+# compaction (compaction.py) follows VR_COMPACT, like batch mode and the pipeline's clean stage
+REPROCESS_CLASSES = None   # e.g. {'rate_limit', 'server'}: retry only these dead letters instead of a normal pass
+# Hard spend caps for this run (None = no cap); see budget.py
+BUDGET = dict(max_cost_usd=None, max_tokens=None, max_thought_tokens=None)
 MAX_ROWS = 21
-SAVE_INTERVAL = 5
 TOTAL_EXPECTED = 20
+CONCURRENCY = 8
 
 # --- THE SYSTEM PROMPT ---
 SYSTEM_PROMPT = f"""
@@ -93,65 +104,57 @@ Code, Code | [Reasoning: Brief justification for inclusion/exclusion]
 ### CODEBOOK JSON:
 {json.dumps(CODEBOOK_DICT, indent=2)}
 """
+# THE AI COFFEE: Prevent analytical fatigue
+COFFEE_REMINDER = "\n\n### PRECISION CHECK: Identify all distinct categories from the codebook. Do not drift. Do not invent codes."
+INSUFFICIENT_DATA = "Abandoned Chat | Insufficient data for classification"
+
 def code_transcript(transcript):
     """
     Orchestrates the API call with the new March 2026 'Thinking' extraction.
     """
     cleaned_input = clean_raw_text(transcript)
     if len(str(cleaned_input)) < 10:
-        return "Abandoned Chat | Insufficient data for classification", ""
-
-    # THE AI COFFEE: Prevent analytical fatigue
-    coffee_reminder = "\n\n### PRECISION CHECK: Identify all distinct categories from the codebook. Do not drift. Do not invent codes."
-    last_error = "Unknown Error"
-
-    for attempt in range(3):
-        try:
-            # The model call remains the same, but the response handling changes
-            response = client.models.generate_content(
-                model=MODEL_NAME,
-                contents=f"{SYSTEM_PROMPT}\n\nTranscript: {cleaned_input}{coffee_reminder}",
-                config=AI_CONFIG
-            )
-
-            thoughts = []
-            final_answer_parts = []
-
-            # MARCH 2026 UPDATED EXTRACTION:
-            # We iterate through the 'parts' of the first candidate.
-            # 'Thoughts' are distinct from 'Text'.
-            if response.candidates and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
-                    # In the new SDK, parts that are thoughts are identified specifically
-                    if hasattr(part, 'thought') and part.thought:
-                        thoughts.append(part.text)
-                    elif hasattr(part, 'text') and part.text:
-                        final_answer_parts.append(part.text)
-
-            # Join and clean up formatting
-            clean_code = " ".join(final_answer_parts).replace("**", "").replace("\n", " ").strip()
-            mental_process = " ".join(thoughts).replace("\n", " ").strip()
-
-            # Fallback if thoughts were missed but text exists (sometimes happens in v1beta)
-            if not mental_process and "THOUGHT:" in clean_code:
-                # Handle cases where the model puts the thought in the main text body
-                parts = clean_code.split("THOUGHT:", 1)
-                clean_code = parts[0].strip()
-                mental_process = parts[1].strip() if len(parts) > 1 else ""
-
-            return clean_code, mental_process
-
-        except Exception as e:
-            last_error = str(e)
-            if "503" in last_error or "429" in last_error:
-                wait = (attempt + 1) * 10
-                print(f"⚠️ Rate limited or Busy. Retrying in {wait}s...")
-                time.sleep(wait)
-            else:
-                print(f"❌ API Error: {last_error}")
-                time.sleep(5)
-                
-    return f"ERROR | {last_error[:50]}", ""
+        return INSUFFICIENT_DATA, ""
+
+    try:
+        # The model call remains the same, but the response handling changes
+        response = generate_content(
+            client,
+            model=MODEL_NAME,
+            contents=f"{SYSTEM_PROMPT}\n\nTranscript: {cleaned_input}{COFFEE_REMINDER}",
+            config=AI_CONFIG
+        )
+
+        thoughts = []
+        final_answer_parts = []
+
+        # MARCH 2026 UPDATED EXTRACTION:
+        # We iterate through the 'parts' of the first candidate.
+        # 'Thoughts' are distinct from 'Text'.
+        if response.candidates and response.candidates[0].content.parts:
+            for part in response.candidates[0].content.parts:
+                # In the new SDK, parts that are thoughts are identified specifically
+                if hasattr(part, 'thought') and part.thought:
+                    thoughts.append(part.text)
+                elif hasattr(part, 'text') and part.text:
+                    final_answer_parts.append(part.text)
+
+        # Join and clean up formatting
+        clean_code = " ".join(final_answer_parts).replace("**", "").replace("\n", " ").strip()
+        mental_process = " ".join(thoughts).replace("\n", " ").strip()
+
+        # Fallback if thoughts were missed but text exists (sometimes happens in v1beta)
+        if not mental_process and "THOUGHT:" in clean_code:
+            # Handle cases where the model puts the thought in the main text body
+            parts = clean_code.split("THOUGHT:", 1)
+            clean_code = parts[0].strip()
+            mental_process = parts[1].strip() if len(parts) > 1 else ""
+
+        return clean_code, mental_process
+
+    except Exception as e:
+        # The gateway has already retried transient errors; this is the final failure
+        return f"ERROR | {str(e)[:50]}", ""
 
 def main():
     # 1. Load the Data
@@ -167,41 +170,74 @@ def main():
         if col not in df.columns:
             df[col] = ""
         df[col] = df[col].fillna("").astype(str)
+
+    # Results journaled by an interrupted session take precedence over the CSV
+    journal = ResultJournal(JOURNAL_FILE)
+    journal.overlay(df, ['Applied_Code_Reasoning', 'AI_Thoughts'])
    
     processed_this_session = 0
     TOTAL_ROWS = len(df)
     
-    try:
+    dead_letter = DeadLetterQueue(DEAD_LETTER_FILE)
+    row_key = lambda i: df.at[i, 'StudyID'] if 'StudyID' in df.columns else i
+
+    if REPROCESS_CLASSES:
+        # Targeted pass: only rows dead-lettered with one of the chosen error classes
+        retry_ids = set(dead_letter.failed_ids(REPROCESS_CLASSES, source=OUTPUT_FILE))
+        pending = [i for i in df.index if row_key(i) in retry_ids]
+        concurrency, policy, cache = REPROCESS_CONCURRENCY, REPROCESS_POLICY, None
+    else:
+        # Skip rows already processed and not an error
+        pending = []
         for i, row in df.iterrows():
-            # Skip if already processed and not an error
             current_val = str(df.at[i, 'Applied_Code_Reasoning']).strip()
             if current_val != "" and "ERROR" not in current_val:
                 continue
+            pending.append(i)
+        concurrency, policy, cache = CONCURRENCY, DEFAULT_POLICY, RESPONSE_CACHE
 
-            print(f"📝 [{i+1}/{TOTAL_ROWS}] Coding StudyID: {row.get('StudyID', 'N/A')}...")
-            
-            # Run the AI Coding
-            clean_code, mental_process = code_transcript(row['Transcript'])
-            
-            # Update the DataFrame
-            df.at[i, 'Applied_Code_Reasoning'] = clean_code
-            df.at[i, 'AI_Thoughts'] = mental_process
-            processed_this_session += 1
-
-            # Checkpoint Save
-            if processed_this_session % SAVE_INTERVAL == 0:
-                df.to_csv(OUTPUT_FILE, index=False)
-                progress = ((i + 1) / TOTAL_ROWS) * 100
-                print(f"💾 Checkpoint Saved. Total Progress: {progress:.1f}%")
-            
-            # Active wait to respect rate limits
-            time.sleep(1.5)
-                      
-    except KeyboardInterrupt:
-        print("\n🛑 Manual stop. Saving current progress...")
+    print(f"📝 {len(pending)} of {TOTAL_ROWS} rows to code ({concurrency} in flight)...")
+
+    TELEMETRY.start_run(OUTPUT_FILE, len(pending))
+    GOVERNOR.start_run(len(pending), **BUDGET)
+
+    # Results come back tagged by StudyID; map them to their DataFrame rows
+    index_by_id = {row_key(i): i for i in pending}
+
+    def record_result(study_id, clean_code, mental_process):
+        nonlocal processed_this_session
+        # Committed to the journal immediately; the CSV is only written once at the end
+        journal.record(study_id, {'Applied_Code_Reasoning': clean_code, 'AI_Thoughts': mental_process},
+                       failed=clean_code.startswith("ERROR"))
+        processed_this_session += 1
+        print(f"📝 [{processed_this_session}/{len(pending)}] Coded StudyID: {study_id}")
+
+    try:
+        # SIGTERM (preemption) or a stop drains in-flight requests before we get here
+        with graceful_shutdown():
+            records = cleaned_records([(study_id, df.at[i, 'Transcript']) for study_id, i in index_by_id.items()],
+                                      CORPUS_FILE)
+            if COMPACT:
+                records = compact_records(records)
+            code_batch(records, client, SYSTEM_PROMPT, COFFEE_REMINDER,
+                       concurrency=concurrency, on_result=record_result,
+                       dead_letter=dead_letter, source=OUTPUT_FILE, policy=policy, cache=cache,
+                       insufficient_label=INSUFFICIENT_DATA, precleaned=True)
+
+    except (KeyboardInterrupt, ShutdownRequested):
+        print("\n🛑 Stopped early. Saving current progress...")
     finally:
-        df.to_csv(OUTPUT_FILE, index=False)
+        # Compaction: fold the journal into the full table and write it once
+        journal.overlay(df, ['Applied_Code_Reasoning', 'AI_Thoughts'])
+        write_csv(df, OUTPUT_FILE, index=False)
         print(f"🏁 Final Save Complete. Session Total: {processed_this_session}")
+        print_retry_report()
+        print_cache_report()
+        print_telemetry_report()
+        print_dead_letter_report(dead_letter)
+        print_budget_report()
+        if REDACT_PII:
+            print_redaction_report()
 
 if __name__ == "__main__":
     main()
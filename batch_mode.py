@@ -0,0 +1,299 @@
+import json
+import os
+import time
+import uuid
+from types import SimpleNamespace
+import pandas as pd
+from google.genai import types
+from preprocessing_util import clean_raw_text, parse_model_response, AI_CONFIG, MODEL_NAME
+from compaction import compact_transcript, COMPACT
+from atomic_io import write_csv, write_json
+
+# --- CONFIGURATION ---
+INPUT_FILE = '/content/drive/MyDrive/34BatchNew/UATranscripts_All.csv'
+BATCH_DIR = '/content/drive/MyDrive/34BatchNew/batch_requests'
+OUTPUT_FILE = '/content/drive/MyDrive/34BatchNew/Coded_Batch_API.csv'
+
+SHARD_SIZE = 5000        # Keyed requests per JSONL shard / batch job
+POLL_INTERVAL = 60       # Seconds between job status checks
+MANIFEST_NAME = 'batch_manifest.json'
+
+DONE_STATES = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+
+# Same column layout as run_34k.py so downstream scripts need no changes
+# (every row is its own request: 'representative', or 'local' when resolved without one)
+OUTPUT_COLUMNS = ['StudyID', 'Transcript', 'New_AI_Final_Code', 'AI_Thoughts', 'Timestamp',
+                  'Referrer', 'Wait Time (seconds)', 'Duration (seconds)"', 'Processed_At', 'Dedup_Provenance']
+
+
+def to_rest_config(config):
+    """Converts a snake_case config (AI_CONFIG, CODING_CONFIG) into the camelCase generationConfig the batch file expects."""
+    def camel(key):
+        head, *rest = key.split('_')
+        return head + ''.join(word.title() for word in rest)
+
+    return {camel(k): to_rest_config(v) if isinstance(v, dict) else v for k, v in config.items()}
+
+
+def build_request_files(input_csv, batch_dir, system_prompt, coffee_reminder="",
+                        shard_size=SHARD_SIZE, insufficient_label="Abandoned Chat | Insufficient data",
+                        base_config=AI_CONFIG):
+    """
+    Writes one keyed JSONL line per StudyID, sharded into files of `shard_size` lines.
+    `base_config` is the live path's generation config (CODING_CONFIG for structured output).
+
+    Transcripts too short to code are resolved locally (same rule as code_transcript)
+    and returned so they can be merged without spending a request on them.
+    Returns (shard_paths, local_results).
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    generation_config = to_rest_config(base_config)
+
+    shard_paths = []
+    local_results = {}
+    handle = None
+    written = 0
+
+    for chunk in pd.read_csv(input_csv, chunksize=shard_size):
+        for study_id, transcript in zip(chunk['StudyID'], chunk['Transcript']):
+            cleaned_input = clean_raw_text(transcript)
+            if COMPACT:
+                cleaned_input = compact_transcript(cleaned_input)
+            if len(str(cleaned_input)) < 10:
+                local_results[str(study_id)] = (insufficient_label, "")
+                continue
+
+            if written % shard_size == 0:
+                if handle:
+                    handle.close()
+                path = os.path.join(batch_dir, f"requests_shard_{len(shard_paths):04d}.jsonl")
+                shard_paths.append(path)
+                handle = open(path, 'w', encoding='utf-8')
+
+            line = {
+                'key': str(study_id),
+                'request': {
+                    'contents': [{'role': 'user', 'parts': [
+                        {'text': f"{system_prompt}\n\nTranscript: {cleaned_input}{coffee_reminder}"}
+                    ]}],
+                    'generationConfig': generation_config,
+                }
+            }
+            handle.write(json.dumps(line) + '\n')
+            written += 1
+
+    if handle:
+        handle.close()
+
+    print(f"📦 Wrote {written} requests into {len(shard_paths)} shard(s); "
+          f"{len(local_results)} resolved locally.")
+    return shard_paths, local_results
+
+
+def _load_manifest(batch_dir):
+    path = os.path.join(batch_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_manifest(batch_dir, manifest):
+    write_json(manifest, os.path.join(batch_dir, MANIFEST_NAME), indent=2)
+
+
+def submit_shards(client, shard_paths, batch_dir, model=MODEL_NAME):
+    """Uploads each shard and creates a batch job. Shards already in the manifest are not resubmitted."""
+    manifest = _load_manifest(batch_dir)
+
+    for path in shard_paths:
+        shard = os.path.basename(path)
+        if shard in manifest:
+            print(f"⏩ {shard} already submitted as {manifest[shard]['job']}")
+            continue
+
+        uploaded = client.files.upload(
+            file=path,
+            config=types.UploadFileConfig(display_name=shard, mime_type='jsonl')
+        )
+        job = client.batches.create(
+            model=model,
+            src=uploaded.name,
+            config={'display_name': f"vr-coding-{shard}"}
+        )
+        manifest[shard] = {'job': job.name, 'state': job.state.name, 'result_file': None}
+        _save_manifest(batch_dir, manifest)
+        print(f"🚀 Submitted {shard} as {job.name}")
+
+    return manifest
+
+
+def poll_jobs(client, batch_dir, poll_interval=POLL_INTERVAL):
+    """Polls until every job in the manifest reaches a terminal state."""
+    manifest = _load_manifest(batch_dir)
+
+    while True:
+        pending = 0
+        for shard, entry in manifest.items():
+            if entry['state'] in DONE_STATES and (entry['result_file'] or entry['state'] != 'JOB_STATE_SUCCEEDED'):
+                continue
+            job = client.batches.get(name=entry['job'])
+            entry['state'] = job.state.name
+            if entry['state'] == 'JOB_STATE_SUCCEEDED':
+                entry['result_file'] = job.dest.file_name
+            elif entry['state'] not in DONE_STATES:
+                pending += 1
+        _save_manifest(batch_dir, manifest)
+
+        states = pd.Series([e['state'] for e in manifest.values()]).value_counts().to_dict()
+        print(f"⏳ Batch jobs: {states}")
+        if pending == 0:
+            return manifest
+        time.sleep(poll_interval)
+
+
+def parse_result_line(line, answer_formatter=None):
+    """
+    Returns (StudyID, clean_code, mental_process) for one line of a batch result file.
+    `answer_formatter` renders structured answers like the live path (ANSWER_FORMATTER).
+    """
+    record = json.loads(line)
+    study_id = record.get('key')
+
+    if 'error' in record:
+        return study_id, f"ERROR | {str(record['error'])[:50]}", ""
+
+    response = types.GenerateContentResponse.model_validate(record.get('response', {}))
+    clean_code, mental_process = parse_model_response(response)
+    if answer_formatter:
+        clean_code = answer_formatter(clean_code)
+    return study_id, clean_code, mental_process
+
+
+def collect_results(client, batch_dir, answer_formatter=None):
+    """Downloads every succeeded job's result file and parses it into {StudyID: (code, thoughts)}."""
+    manifest = _load_manifest(batch_dir)
+    results = {}
+
+    for shard, entry in manifest.items():
+        if entry['state'] != 'JOB_STATE_SUCCEEDED':
+            print(f"⚠️ {shard} ended in {entry['state']}; its rows will be marked ERROR.")
+            continue
+        content = client.files.download(file=entry['result_file'])
+        for line in content.decode('utf-8').splitlines():
+            if line.strip():
+                study_id, clean_code, mental_process = parse_result_line(line, answer_formatter)
+                results[study_id] = (clean_code, mental_process)
+
+    return results
+
+
+def merge_results(input_csv, results, output_file, local_ids=()):
+    """
+    Joins batch answers back onto the input rows using run_34k.py's output schema.
+    `local_ids` are the StudyIDs resolved without a request (too short to code).
+    """
+    df = pd.read_csv(input_csv)
+    processed_at = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    rows = []
+    for _, row in df.iterrows():
+        clean_code, mental_process = results.get(str(row['StudyID']), ("ERROR | Missing from batch output", ""))
+        rows.append({
+            'StudyID': row['StudyID'],
+            'Transcript': row['Transcript'],
+            'New_AI_Final_Code': clean_code,
+            'AI_Thoughts': mental_process,
+            'Timestamp': row.get('Timestamp'),
+            'Referrer': row.get('Referrer'),
+            'Wait Time (seconds)': row.get('Wait Time (seconds)'),
+            'Duration (seconds)"': row.get('Duration (seconds)'),
+            'Processed_At': None if clean_code.startswith("ERROR") else processed_at,
+            'Dedup_Provenance': 'local' if str(row['StudyID']) in local_ids else 'representative'
+        })
+
+    out = pd.DataFrame(rows, columns=OUTPUT_COLUMNS)
+    write_csv(out, output_file, index=False)
+    print(f"🏁 Merged {len(out)} rows into {output_file}")
+    return out
+
+
+# --- OFFLINE FAKE BATCH ENDPOINT ---
+class FakeBatchClient:
+    """
+    Local stand-in for client.files / client.batches. Jobs "run" the moment they
+    are created by passing each request's prompt text to `responder`, and results
+    are written in the same JSONL layout the real Batch API returns.
+    """
+
+    def __init__(self, workdir, responder=None):
+        self.workdir = workdir
+        os.makedirs(workdir, exist_ok=True)
+        self.responder = responder
+        self._jobs = {}
+        self.files = SimpleNamespace(upload=self._upload, download=self._download)
+        self.batches = SimpleNamespace(create=self._create, get=self._get)
+
+    def _upload(self, file, config=None):
+        return SimpleNamespace(name=os.path.abspath(file))
+
+    def _download(self, file):
+        with open(file, 'rb') as f:
+            return f.read()
+
+    def _create(self, model, src, config=None):
+        name = f"batches/fake-{uuid.uuid4().hex[:8]}"
+        result_path = os.path.join(self.workdir, f"{name.split('/')[-1]}_results.jsonl")
+
+        with open(src, encoding='utf-8') as f_in, open(result_path, 'w', encoding='utf-8') as f_out:
+            for line in f_in:
+                request = json.loads(line)
+                prompt = request['request']['contents'][0]['parts'][0]['text']
+                if self.responder:
+                    answer = self.responder(prompt)
+                elif request['request']['generationConfig'].get('responseMimeType') == 'application/json':
+                    answer = json.dumps({'codes': ['Other'], 'reasoning': 'offline fake batch response'})
+                else:
+                    answer = "Other | [Reasoning: offline fake batch response]"
+                response = {
+                    'candidates': [{'content': {'role': 'model', 'parts': [
+                        {'text': 'Offline fake batch reasoning.', 'thought': True},
+                        {'text': answer},
+                    ]}, 'finishReason': 'STOP'}],
+                    'usageMetadata': {'promptTokenCount': len(prompt) // 4},
+                }
+                f_out.write(json.dumps({'key': request['key'], 'response': response}) + '\n')
+
+        self._jobs[name] = SimpleNamespace(
+            name=name,
+            state=SimpleNamespace(name='JOB_STATE_SUCCEEDED'),
+            dest=SimpleNamespace(file_name=result_path)
+        )
+        return self._jobs[name]
+
+    def _get(self, name):
+        return self._jobs[name]
+
+
+def run_batch_mode(client, system_prompt, coffee_reminder="", input_csv=INPUT_FILE,
+                   batch_dir=BATCH_DIR, output_file=OUTPUT_FILE, shard_size=SHARD_SIZE,
+                   poll_interval=POLL_INTERVAL, base_config=AI_CONFIG, answer_formatter=None):
+    """
+    Shard -> submit -> poll -> merge. Safe to re-run: submitted shards are tracked in the manifest.
+    Pass the live path's CODING_CONFIG and ANSWER_FORMATTER for the same enum-constrained answers.
+    """
+    shard_paths, local_results = build_request_files(
+        input_csv, batch_dir, system_prompt, coffee_reminder, shard_size, base_config=base_config
+    )
+    submit_shards(client, shard_paths, batch_dir)
+    poll_jobs(client, batch_dir, poll_interval)
+
+    results = collect_results(client, batch_dir, answer_formatter)
+    results.update(local_results)
+    return merge_results(input_csv, results, output_file, local_ids=set(local_results))
+
+
+if __name__ == "__main__":
+    from coding_logic_34 import client, SYSTEM_PROMPT, COFFEE_REMINDER, CODING_CONFIG, ANSWER_FORMATTER
+    run_batch_mode(client, SYSTEM_PROMPT, COFFEE_REMINDER,
+                   base_config=CODING_CONFIG, answer_formatter=ANSWER_FORMATTER)
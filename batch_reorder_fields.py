@@ -1,4 +1,5 @@
 import pandas as pd
+from atomic_io import write_csv
 
 # 1. Load the large CSV file
 df = pd.read_csv("your_file.csv")
@@ -22,4 +23,4 @@ desired_columns = [
 df_reordered = df[desired_columns]
 
 # 4. Save the processed data to a new CSV file
-df_reordered.to_csv("reordered_file.csv", index=False)
+write_csv(df_reordered, "reordered_file.csv", index=False)
@@ -0,0 +1,159 @@
+import contextlib
+import threading
+from collections import Counter
+from preprocessing_util import PRICING
+from shutdown import SHUTDOWN, ShutdownRequested
+
+# --- CONFIGURATION ---
+# The gateway reports the usage metadata of every live call here. The governor
+# projects the run's total from the spend per transcript so far and:
+#   * paces requests (THROTTLE_SECONDS before each one) while the projection
+#     overshoots a cap, so a runaway prompt change is visible before it is billed;
+#   * refuses new requests once a cap is actually reached (BudgetExceeded, which
+#     stops the run like a graceful shutdown: in-flight rows finish and are journaled).
+# Caps are per process and set by each orchestrator's start_run(); None = no cap.
+THROTTLE_SECONDS = 5.0
+MIN_PROJECTION_ITEMS = 20   # transcripts coded before the projection is trusted
+CAPS = ('tokens', 'cost_usd', 'thought_tokens')
+
+
+class BudgetExceeded(ShutdownRequested):
+    """Raised instead of sending a request once a hard budget cap has been reached."""
+
+
+def _usage(response, name):
+    usage = getattr(response, 'usage_metadata', None)
+    return getattr(usage, name, None) or 0
+
+
+def response_spend(model, response):
+    """{'tokens', 'cost_usd', 'thought_tokens'} billed for one response (thoughts bill as output)."""
+    prompt = _usage(response, 'prompt_token_count')
+    cached = _usage(response, 'cached_content_token_count')
+    output = _usage(response, 'candidates_token_count')
+    thoughts = _usage(response, 'thoughts_token_count')
+    price = PRICING.get(model, PRICING['default'])
+    cost = (max(prompt - cached, 0) * price['input'] + cached * price['cached_input']
+            + (output + thoughts) * price['output']) / 1e6
+    return {'tokens': prompt + output + thoughts, 'cost_usd': cost, 'thought_tokens': thoughts}
+
+
+class BudgetGovernor:
+    """Running spend, projection and hard caps for one run, optionally split into shards (scopes)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._set_shutdown = False   # whether the stop in effect is this governor's own
+        self.start_run(0)
+
+    def start_run(self, total_items, max_tokens=None, max_cost_usd=None, max_thought_tokens=None):
+        """
+        Declares the queue size and the caps; resets the running spend. A stop
+        the previous run's cap caused is lifted too: outside graceful_shutdown()
+        nothing else would clear it and every later run would stop at once.
+        """
+        with self._lock:
+            if self._set_shutdown:
+                SHUTDOWN.clear()
+                self._set_shutdown = False
+            self.total_items = int(total_items)
+            self.caps = {'tokens': max_tokens, 'cost_usd': max_cost_usd, 'thought_tokens': max_thought_tokens}
+            self.spent = Counter()
+            self.items = 0
+            self.scopes = {}
+            self._scope = None
+            self._throttling = set()
+            self.tripped = None
+
+    @contextlib.contextmanager
+    def scope(self, name, items):
+        """Attributes spend inside the block to `name` (a shard or output file of `items` transcripts)."""
+        with self._lock:
+            self.scopes.setdefault(name, {'items': int(items), 'spent': Counter(), 'done': 0})
+            previous, self._scope = self._scope, name
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._scope = previous
+
+    def record(self, model, response, items=1):
+        spend = response_spend(model, response)
+        with self._lock:
+            self.spent.update(spend)
+            self.items += items
+            if self._scope is not None:
+                self.scopes[self._scope]['spent'].update(spend)
+                self.scopes[self._scope]['done'] += items
+
+    def projected(self):
+        """Projected end-of-run spend per cap, or None until MIN_PROJECTION_ITEMS are in."""
+        with self._lock:
+            if self.items < MIN_PROJECTION_ITEMS:
+                return None
+            remaining = max(self.total_items - self.items, 0)
+            return {cap: self.spent[cap] + self.spent[cap] / self.items * remaining for cap in CAPS}
+
+    def pause(self):
+        """Seconds to wait before the next request: THROTTLE_SECONDS while a projection overshoots."""
+        projection = self.projected()
+        if not projection:
+            return 0.0
+        over = {cap for cap, limit in self.caps.items() if limit is not None and projection[cap] > limit}
+        with self._lock:
+            new, self._throttling = over - self._throttling, over
+        for cap in sorted(new):
+            print(f"💸 Projected {cap} {projection[cap]:,.2f} exceeds the cap of {self.caps[cap]:,}; "
+                  f"pacing requests ({THROTTLE_SECONDS:.0f}s each).")
+        return THROTTLE_SECONDS if over else 0.0
+
+    def check(self):
+        """Raises BudgetExceeded (and stops the run) once any cap has been reached."""
+        if self.tripped is None:
+            for cap, limit in self.caps.items():
+                if limit is not None and self.spent[cap] >= limit:
+                    self.tripped = f"{cap} reached {self.spent[cap]:,.2f} (cap {limit:,})"
+                    print(f"🧾 Budget cap hit: {self.tripped}. No new requests will be sent.")
+                    self._set_shutdown = not SHUTDOWN.is_set()
+                    SHUTDOWN.set()
+                    break
+        if self.tripped is not None:
+            raise BudgetExceeded(self.tripped)
+
+    def over_budget_scopes(self):
+        """Scopes whose spend per transcript exceeds their pro-rata share of any cap."""
+        over = {}
+        with self._lock:
+            for name, scope in self.scopes.items():
+                if not scope['done']:
+                    continue
+                for cap, limit in self.caps.items():
+                    if limit is None or not self.total_items:
+                        continue
+                    share = limit * scope['items'] / self.total_items
+                    projected = scope['spent'][cap] / scope['done'] * scope['items']
+                    if projected > share:
+                        over.setdefault(name, []).append(f"{cap} {projected:,.2f} > {share:,.2f}")
+        return over
+
+
+GOVERNOR = BudgetGovernor()
+
+
+def print_budget_report(governor=GOVERNOR):
+    print("\nBUDGET REPORT\n" + "=" * 30)
+    print(f"transcripts: {governor.items}/{governor.total_items}")
+    projection = governor.projected()
+    for cap in CAPS:
+        limit = governor.caps[cap]
+        line = f"{cap}: {governor.spent[cap]:,.2f}"
+        if projection:
+            line += f" (projected {projection[cap]:,.2f})"
+        if limit is not None:
+            line += f" / cap {limit:,}"
+        print(line)
+    if governor.tripped:
+        print(f"STOPPED: {governor.tripped}")
+    for name, reasons in governor.over_budget_scopes().items():
+        print(f"over budget: {name}: {'; '.join(reasons)}")
+    print("=" * 30)
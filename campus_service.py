@@ -2,15 +2,12 @@ import pandas as pd
 import time
 import os
 import re
-from google.colab import userdata  # Assuming you are running this in Google Colab
-from google import genai
+from gemini_gateway import generate_content
+from model_backend import get_client
+from atomic_io import write_csv
 
 # Initialize the GenAI client
-client = genai.Client(
-    api_key=userdata.get('My_Key'),
-    vertexai=False,
-    http_options=types.HttpOptions(api_version='v1beta')
-)
+client = get_client('My_Key')
 
 # --- 1. SETUP ---
 MODEL_ID = "gemini-2.0-flash-lite"
@@ -73,9 +70,8 @@ Reasoning: [Reasoning in 2 brief sentences]
 """
     
     try:
-        # Generate content with 5-second delay
-        time.sleep(5)
-        response = client.models.generate_content(model=MODEL_ID, contents=prompt)
+        # Pacing comes from the shared RPM/TPM limiter in the gateway
+        response = generate_content(client, model=MODEL_ID, contents=prompt)
         full_text = response.text
 
         # --- UNPACKING LOGIC: Row-by-Row Mapping ---
@@ -95,7 +91,7 @@ Reasoning: [Reasoning in 2 brief sentences]
                 df.at[idx, 'AI_Qualitative_Analysis'] = f"No direct match found in response for {study_id}. Full Response:\n {full_text}"
 
         # --- FORCE SAVE TO DRIVE ---
-        df.to_csv(OUTPUT_PATH, index=False)
+        write_csv(df, OUTPUT_PATH, index=False)
         print(f"💾 Checkpoint Saved for Batch {i}.")
 
     except Exception as e:
@@ -0,0 +1,74 @@
+import argparse
+import os
+import random
+import time
+import pandas as pd
+from preprocessing_util import clean_raw_text, clean_series
+
+# --- CONFIGURATION ---
+# Times the row-by-row clean_raw_text against the batch cleaner on the same
+# column and checks the outputs are identical. Uses the Transcript column of
+# --input (resampled to each size) or synthetic chat transcripts.
+SIZES = [35_000, 350_000]
+
+SAMPLE_TURNS = [
+    "Patron: Hi, how do I renew a book I checked out last week?",
+    "Librarian: You can renew it from your library account under Checked Out Items.",
+    "Patron: Also, is the main library open on Sunday?",
+    "Librarian: Yes, Sunday hours are noon to 8pm.",
+    "Patron: Can you find the article 'Climate policy and   adaptation' for me?",
+    "Librarian: I found it in JSTOR; here is the permalink.",
+]
+
+
+def synthetic_transcripts(n, seed=0):
+    """Chat-log shaped text with clock times, <DATE_TIME> tags, staff hashes and ragged whitespace."""
+    rng = random.Random(seed)
+    transcripts = []
+    for i in range(n):
+        lines = []
+        for _ in range(rng.randint(4, 30)):
+            stamp = f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}"
+            speaker = f"{rng.getrandbits(128):032x}" if rng.random() < 0.3 else rng.choice(SAMPLE_TURNS)
+            lines.append(f"<DATE_TIME> {stamp}  {speaker}\t{rng.choice(SAMPLE_TURNS)}")
+        transcripts.append("\n".join(lines) + f"\n(ticket {i})")
+    return transcripts
+
+
+def load_column(input_file, n):
+    transcripts = pd.read_csv(input_file, usecols=['Transcript'])['Transcript']
+    return transcripts.sample(n, replace=len(transcripts) < n, random_state=0).reset_index(drop=True)
+
+
+def run_size(series, processes):
+    start = time.perf_counter()
+    expected = series.map(clean_raw_text)
+    row_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = clean_series(series)
+    batch_s = time.perf_counter() - start
+    assert batch.equals(expected), "batch cleaner output differs from clean_raw_text"
+    del batch
+
+    line = (f"{len(series):>9,} rows | clean_raw_text {row_s:7.2f}s | batch {batch_s:7.2f}s "
+            f"({row_s / batch_s:4.1f}x)")
+    if processes > 1:
+        start = time.perf_counter()
+        parallel = clean_series(series, processes=processes)
+        parallel_s = time.perf_counter() - start
+        assert parallel.equals(expected), "parallel batch cleaner output differs from clean_raw_text"
+        line += f" | {processes} processes {parallel_s:7.2f}s ({row_s / parallel_s:4.1f}x)"
+    print(line + " | identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark clean_raw_text against the batch cleaner.")
+    parser.add_argument('--input', help="CSV with a Transcript column (default: synthetic transcripts).")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        series = load_column(args.input, n) if args.input else pd.Series(synthetic_transcripts(n))
+        run_size(series, args.processes)
@@ -0,0 +1,129 @@
+import json
+import os
+import re
+from collections import deque
+
+# --- CONFIGURATION ---
+# Code-name matching for the audits. Every alias of a code (CODE_MAP short
+# and long names, the drift spellings below, the codebook code_name values) is
+# compiled once into an Aho-Corasick automaton, so one pass over a cell finds
+# every alias it contains, instead of a substring test per alias per cell.
+# Results are memoized per distinct raw string: a column of 35k cells costs
+# as many scans as it has distinct values.
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Common "drifts" in model and coder output, mapped to the gold-standard name
+NORMALIZATION_MAP = {
+    "Patron Accounts": "Patron Account",
+    "Borrow Techs": "Borrow Tech",
+    "Faculty Instruction Support": "Faculty Instructional Support",
+    "Finding Relevant Sources": "Finding Relevant Resources",
+    "Evaluation Information": "Evaluating Information",
+    "Known Item: Audiovisual": "Known Item: AV",
+    "Find Item by Author": "Find by Author",
+    "Finding relevant sources": "Finding Relevant Resources",
+    "Research Strategies": "Research Strategy",
+    "Final Content: Known Item: Book" : "Known Item: Book"
+}
+
+# Codebooks whose code_name values are aliases too (missing files are skipped)
+CODEBOOK_FILES = ['codebook2.json', 'codebook.json']
+
+
+def code_id(name):
+    """'Known Item: Books' -> 'knownitembook', the ID the audits compare."""
+    return re.sub(r'[^a-zA-Z0-9]', '', name.lower().strip()).rstrip('s')
+
+
+class AhoCorasick:
+    """Finds every keyword occurring in a text (overlaps included) in one pass."""
+
+    def __init__(self, keywords):
+        # keywords: {keyword: value}; a text matching several keywords yields all their values
+        self.goto, self.fail, self.out = [{}], [0], [set()]
+        for keyword, value in keywords.items():
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.out[state].add(value)
+
+        # Breadth first, so a state's failure target is finished before the state itself
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.out[child] |= self.out[self.fail[child]]
+                queue.append(child)
+        self.out = [frozenset(values) for values in self.out]
+
+    def find(self, text):
+        """Set of the values of every keyword found in text."""
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+def load_codebook_names(paths=CODEBOOK_FILES):
+    names = []
+    for path in paths:
+        path = os.path.join(MODULE_DIR, path)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                names.extend(code['code_name'] for code in json.load(f)['codes'])
+    return names
+
+
+def build_aliases(code_map, normalization_map=NORMALIZATION_MAP, codebook_names=()):
+    """{lowercased alias: code ID}. CODE_MAP decides first; other aliases resolve through it."""
+    aliases = {}
+    for short_key, long_description in code_map.items():
+        for alias in (short_key, long_description):
+            aliases.setdefault(alias.lower().strip(), code_id(short_key))
+
+    def resolve(name):
+        return aliases.get(name.lower().strip(), code_id(name))
+
+    for drift, gold in normalization_map.items():
+        aliases.setdefault(drift.lower().strip(), resolve(gold))
+    for name in codebook_names:
+        aliases.setdefault(name.lower().strip(), resolve(name))
+    return {alias: cid for alias, cid in aliases.items() if alias}
+
+
+class CodeMatcher:
+    """Raw code cell -> set of code IDs, memoized per distinct string."""
+
+    def __init__(self, code_map, normalization_map=NORMALIZATION_MAP, codebook_files=CODEBOOK_FILES):
+        self.aliases = build_aliases(code_map, normalization_map, load_codebook_names(codebook_files))
+        self.automaton = AhoCorasick(self.aliases)
+        self._memo = {}
+
+    def _normalize(self, full_string):
+        normalized = self.automaton.find(full_string)
+        if not normalized:
+            # No known alias anywhere: each comma-separated entry becomes its own ID
+            normalized = {code_id(entry) for entry in full_string.split(',')}
+        return frozenset(normalized)
+
+    def normalize(self, val):
+        raw = str(val)
+        normalized = self._memo.get(raw)
+        if normalized is None:
+            normalized = self._memo[raw] = self._normalize(raw.lower().strip())
+        return set(normalized)
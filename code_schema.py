@@ -0,0 +1,68 @@
+import functools
+import json
+from preprocessing_util import AI_CONFIG
+
+# --- CONFIGURATION ---
+# The coder asks for JSON whose codes are an enum of the codebook's code_name
+# values, so invented names, plurals and merged codes can't come back.
+CODEBOOK_FILE = 'codebook2.json'
+
+
+def load_code_names(path=CODEBOOK_FILE):
+    """Returns the code_name values of a codebook file, in codebook order."""
+    with open(path, 'r') as f:
+        codebook = json.load(f)
+    return [code['code_name'] for code in codebook['codes']]
+
+
+def build_response_schema(code_names):
+    return {
+        'type': 'OBJECT',
+        'properties': {
+            'codes': {'type': 'ARRAY', 'items': {'type': 'STRING', 'enum': list(code_names)}},
+            'reasoning': {'type': 'STRING'},
+        },
+        'required': ['codes', 'reasoning'],
+    }
+
+
+def structured_config(code_names, base_config=AI_CONFIG):
+    """AI_CONFIG plus the JSON mime type and the enum-constrained schema."""
+    return dict(
+        base_config,
+        response_mime_type='application/json',
+        response_schema=build_response_schema(code_names),
+    )
+
+
+def format_structured_answer(answer_text, code_names=None):
+    """
+    Renders a schema answer back into the 'Code, Code | [Reasoning: ...]' string
+    every downstream script already splits, so output columns don't change.
+    `codes` must be a non-empty list of strings, all in `code_names` when given;
+    anything else comes back as an ERROR string.
+    """
+    try:
+        answer = json.loads(answer_text)
+    except (json.JSONDecodeError, TypeError):
+        return f"ERROR | Unparseable structured answer: {str(answer_text)[:50]}"
+    if not isinstance(answer, dict):
+        # Valid JSON but not the schema's object ([] or "Hours")
+        return f"ERROR | Unparseable structured answer: {str(answer_text)[:50]}"
+
+    codes = answer.get('codes')
+    if not isinstance(codes, list) or not codes or not all(isinstance(code, str) for code in codes):
+        return f"ERROR | Invalid codes in structured answer: {str(codes)[:50]}"
+    if code_names is not None:
+        unknown = [code for code in codes if code not in code_names]
+        if unknown:
+            return f"ERROR | Codes outside the codebook: {', '.join(unknown)[:50]}"
+
+    # dict.fromkeys drops repeats ("Hours, Hours") but keeps the model's order
+    codes = list(dict.fromkeys(codes))
+    return f"{', '.join(codes)} | [Reasoning: {str(answer.get('reasoning', '')).strip()}]"
+
+
+def answer_formatter(code_names):
+    """format_structured_answer bound to a codebook's code names (picklable for process pools)."""
+    return functools.partial(format_structured_answer, code_names=frozenset(code_names))
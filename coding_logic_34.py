@@ -1,22 +1,32 @@
 import json
 import os
-import time
 import pandas as pd
-from google import genai
-from google.genai import types
-from google.colab import userdata
-from preprocessing_util import clean_raw_text, AI_CONFIG, MODEL_NAME
+from gemini_gateway import generate_content
+from model_backend import get_client
+from prompt_cache import prepare_request, is_stale_cache_error, inline_after_stale_cache
+from code_schema import load_code_names, structured_config, answer_formatter
+from preprocessing_util import clean_raw_text, parse_model_response, AI_CONFIG, MODEL_NAME
 
 # --- INITIALIZATION ---
-client = genai.Client(
-    api_key=userdata.get('GEMINI_API_KEY'),
-    vertexai=False,
-    http_options=types.HttpOptions(api_version='v1beta')
-)
+client = get_client()
 
 with open('codebook2.json', 'r') as f:
     CODEBOOK_DICT = json.load(f)
 
+# Constrain answers to a JSON schema whose codes are an enum of codebook code names
+STRUCTURED_OUTPUT = True
+CODE_NAMES = load_code_names('codebook2.json')
+CODING_CONFIG = structured_config(CODE_NAMES) if STRUCTURED_OUTPUT else AI_CONFIG
+ANSWER_FORMATTER = answer_formatter(CODE_NAMES) if STRUCTURED_OUTPUT else None
+
+# The answer layout the prompt asks for must match the response schema
+if STRUCTURED_OUTPUT:
+    RESPONSE_FORMAT = ('Return only a JSON object: {"codes": ["Code", "Code"], '
+                       '"reasoning": "Brief justification for inclusion/exclusion"}. '
+                       'The examples above show the codes and reasoning to give, not the layout.')
+else:
+    RESPONSE_FORMAT = "Code, Code | [Reasoning: Brief justification for inclusion/exclusion]"
+
 # --- THE SYSTEM PROMPT ---
 SYSTEM_PROMPT = f"""
 You are a deterministic qualitative coding assistant. Your task is to apply exact codes from the provided `CODEBOOK_DICT` to library transcripts.
@@ -77,58 +87,40 @@ Transcript: "nese lanterns ... Hello. ... What may we help you with?" is Code: A
 Transcript: "I'm in the library catalog looking for books on history, but there are too many. How do I see only the ones in the main stacks?" Code: Database Search Skills, Finding Relevant Sources Reasoning: Even though the user is on the library's URL, the labor is 'Database Search Skills' because it involves applying a location filter within the catalog's search engine. Do NOT code as 'Website'.
 
 ### RESPONSE FORMAT
-Code, Code | [Reasoning: Brief justification for inclusion/exclusion]
+{RESPONSE_FORMAT}
 
 ### CODEBOOK JSON:
 {json.dumps(CODEBOOK_DICT, indent=2)}
 """
 
+# THE AI COFFEE: Prevent analytical fatigue
+COFFEE_REMINDER = "\n\n### PRECISION CHECK: Identify all distinct categories. Do not drift."
+INSUFFICIENT_DATA = "Abandoned Chat | Insufficient data"
+
 def code_transcript(transcript):
     """Orchestrates API call with March 2026 Thinking extraction."""
     cleaned_input = clean_raw_text(transcript)
     if len(str(cleaned_input)) < 10:
-        return "Abandoned Chat | Insufficient data", ""
+        return INSUFFICIENT_DATA, ""
 
-    coffee_reminder = "\n\n### PRECISION CHECK: Identify all distinct categories. Do not drift."
-    last_error = "Unknown Error"
-
-    for attempt in range(3):
+    try:
+        contents, config = prepare_request(client, SYSTEM_PROMPT, cleaned_input, COFFEE_REMINDER,
+                                           base_config=CODING_CONFIG)
         try:
-            response = client.models.generate_content(
-                model=MODEL_NAME,
-                contents=f"{SYSTEM_PROMPT}\n\nTranscript: {cleaned_input}{coffee_reminder}",
-                config=AI_CONFIG
-            )
-
-            thoughts = []
-            final_answer_parts = []
-
-            if response.candidates and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
-                    if hasattr(part, 'thought') and part.thought:
-                        thoughts.append(part.text)
-                    elif hasattr(part, 'text') and part.text:
-                        final_answer_parts.append(part.text)
-
-            clean_code = " ".join(final_answer_parts).replace("**", "").replace("\n", " ").strip()
-            mental_process = " ".join(thoughts).replace("\n", " ").strip()
-
-            # Fallback if thoughts were embedded in text (v1beta quirk)
-            if not mental_process and "THOUGHT:" in clean_code:
-                parts = clean_code.split("THOUGHT:", 1)
-                clean_code = parts[0].strip()
-                mental_process = parts[1].strip() if len(parts) > 1 else ""
-
-            return clean_code, mental_process
-
+            response = generate_content(client, model=MODEL_NAME, contents=contents, config=config)
         except Exception as e:
-            last_error = str(e)
-            if any(err in last_error for err in ["503", "429"]):
-                wait = (attempt + 1) * 10
-                time.sleep(wait)
-            else:
-                time.sleep(5)
-                
-    return f"ERROR | {last_error[:50]}", ""
+            if not is_stale_cache_error(e, config):
+                raise
+            contents, config = inline_after_stale_cache(SYSTEM_PROMPT, contents, config)
+            response = generate_content(client, model=MODEL_NAME, contents=contents, config=config)
+
+        clean_code, mental_process = parse_model_response(response)
+        if ANSWER_FORMATTER:
+            clean_code = ANSWER_FORMATTER(clean_code)
+        return clean_code, mental_process
+
+    except Exception as e:
+        # The gateway has already retried transient errors; this is the final failure
+        return f"ERROR | {str(e)[:50]}", ""
 
 # Note: The main() function and batch logic have been moved to the Orchestrator script (run_34k_audit.py)
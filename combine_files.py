@@ -1,26 +1,32 @@
 import pandas as pd
 import glob
 import os
+from atomic_io import write_csv
 
 # 1. Define the path where your CSV files are located
 path = '/content/drive/MyDrive/34Batch/Cleaned/' # Update this to your folder path
 
-# 2. Use glob to find all files ending in .csv
-all_files = glob.glob(os.path.join(path, "*.csv"))
-
 # 3. Read each CSV and drop any column that doesn't have a name
-def read_and_clean(file):
-    df = pd.read_csv(file)
+def drop_unnamed(df):
     # This drops any column where the header starts with "Unnamed"
     return df.loc[:, ~df.columns.str.contains('^Unnamed')]
 
-dataframes = [read_and_clean(file) for file in all_files]
+def read_and_clean(file):
+    return drop_unnamed(pd.read_csv(file))
 
 # 4. Concatenate all DataFrames into one master DataFrame
 # ignore_index=True resets the row numbers so they are sequential
-master_df = pd.concat(dataframes, ignore_index=True)
+def combine_frames(dataframes):
+    return pd.concat([drop_unnamed(df) for df in dataframes], ignore_index=True)
+
+if __name__ == "__main__":
+    # 2. Use glob to find all files ending in .csv
+    all_files = glob.glob(os.path.join(path, "*.csv"))
+
+    dataframes = [read_and_clean(file) for file in all_files]
+    master_df = combine_frames(dataframes)
 
-# 5. Output the combined data to a new master CSV file
-master_df.to_csv("/content/drive/MyDrive/34Batch/Theme/master_output_test.csv", index=False)
+    # 5. Output the combined data to a new master CSV file
+    write_csv(master_df, "/content/drive/MyDrive/34Batch/Theme/master_output_test.csv", index=False)
 
-print(f"Successfully merged {len(all_files)} files into 'master_output_test.csv'.")
+    print(f"Successfully merged {len(all_files)} files into 'master_output_test.csv'.")
@@ -1,6 +1,7 @@
 import os
 import glob
 import pandas as pd
+from atomic_io import write_csv
 
 # 1. Mount Drive
 drive.mount('/content/drive')
@@ -35,6 +36,6 @@ master_df = pd.concat(all_dataframes, ignore_index=True)
 
 # 4. Export the combined data to a new master CSV file
 output_file = "master_combined.csv"
-master_df.to_csv(output_file, index=False)
+write_csv(master_df, output_file, index=False)
 
 print(f"Success! All files combined into '{output_file}'. Total rows: {len(master_df)}")
@@ -0,0 +1,161 @@
+import argparse
+import html
+import os
+import re
+from collections import Counter
+import pandas as pd
+from atomic_io import write_csv
+
+# --- CONFIGURATION ---
+# Runs after clean_raw_text, on text that is billed on every call. Turns are
+# split on the speaker labels clean_raw_text leaves behind ("- UA : ..." once
+# the clock time is gone, or "Patron: ..."); known labels become the role
+# words the system prompt already uses, consecutive turns by the same role are
+# merged and repeated turns dropped. HTML markup and institution boilerplate
+# are stripped inside each turn. Semantic anchors (<PERSON>, <URL>,
+# [REDACTED], STAFF) are never removed: a turn whose anchors would change is
+# kept as it was.
+SPEAKER_LABEL = re.compile(r'(?:^|(?<= ))(?:- ((?:(?! - )[^:<>]){1,40}?) : |(Librarian|Patron|Staff|Guest|Visitor): )')
+STAFF_SPEAKERS = re.compile(r'UA|STAFF|Staff|Librarian|Operator|Agent', re.IGNORECASE)
+PATRON_SPEAKERS = re.compile(r'\[REDACTED NAME\]|\[REDACTED\]|Patron|Guest|Visitor|User|Student', re.IGNORECASE)
+ROLE_TAGS = {'staff': 'Librarian:', 'patron': 'Patron:'}
+
+HTML_TAG = re.compile(r'</?(?:br|p|div|span|font|b|i|u|em|strong|a|ul|ol|li|hr|img|table|tr|td)\b[^<>]*>',
+                      re.IGNORECASE)
+HTML_ENTITY = re.compile(r'&(?:[a-zA-Z]+|#\d+|#x[0-9a-fA-F]+);')
+
+# Canned greetings/sign-offs with no intent in them, removed wherever they appear
+# in a turn (case-insensitive). Add each library system's own lines here.
+BOILERPLATE = [
+    r'Hi\s*-\s*this is UA\b\.?',
+]
+_BOILERPLATE = re.compile('|'.join(f'(?:{pattern})' for pattern in BOILERPLATE), re.IGNORECASE)
+
+ANCHORS = re.compile(r'<[A-Z_]+>|\[REDACTED[^\]]*\]|\bSTAFF\b')
+
+# Off until the savings report and an audit sample have been reviewed. Set
+# VR_COMPACT=1 to compact in run_34k, coding_logic, auditor, batch mode and the
+# pipeline alike, so they all send (and cache) the same prompt text.
+COMPACT = os.environ.get('VR_COMPACT', '') not in ('', '0', 'false', 'False')
+
+
+def speaker_role(speaker):
+    """'staff', 'patron' or None (unknown labels are kept verbatim)."""
+    if STAFF_SPEAKERS.fullmatch(speaker):
+        return 'staff'
+    if PATRON_SPEAKERS.fullmatch(speaker):
+        return 'patron'
+    return None
+
+
+def split_turns(cleaned):
+    """[(speaker, text)] of a cleaned transcript; text before the first label has speaker None."""
+    turns, start, speaker = [], 0, None
+    for match in SPEAKER_LABEL.finditer(cleaned):
+        turns.append((speaker, cleaned[start:match.start()].strip()))
+        speaker, start = (match.group(1) or match.group(2)).strip(), match.end()
+    turns.append((speaker, cleaned[start:].strip()))
+    return [(speaker, text) for speaker, text in turns if speaker is not None or text]
+
+
+def compact_text(text):
+    """Markup and boilerplate out of one turn, unless that would change its anchors."""
+    compacted = HTML_TAG.sub(' ', text)
+    compacted = HTML_ENTITY.sub(lambda m: html.unescape(m.group(0)), compacted)
+    compacted = _BOILERPLATE.sub(' ', compacted)
+    compacted = re.sub(r'\s+', ' ', compacted).strip()
+    if Counter(ANCHORS.findall(compacted)) != Counter(ANCHORS.findall(text)):
+        return text
+    return compacted
+
+
+def compact_transcript(cleaned):
+    """One cleaned transcript -> its compacted form (empty if nothing but boilerplate is left)."""
+    if not isinstance(cleaned, str) or not cleaned:
+        return ""
+    merged = []   # [tag, role, text]
+    previous = None
+    for speaker, text in split_turns(cleaned):
+        text = compact_text(text)
+        role = speaker_role(speaker) if speaker else None
+        tag = ROLE_TAGS[role] if role else (f"- {speaker} :" if speaker else "")
+        if not text and speaker is not None:
+            continue
+        if (tag, text) == previous:
+            continue   # the same line sent twice
+        previous = (tag, text)
+        if merged and role and merged[-1][1] == role:
+            merged[-1][2] = f"{merged[-1][2]} {text}"
+        else:
+            merged.append([tag, role, text])
+    return " ".join(f"{tag} {text}".strip() for tag, _, text in merged if tag or text)
+
+
+def compact_records(records):
+    """(StudyID, cleaned transcript) pairs -> (StudyID, compacted transcript) pairs."""
+    return [(study_id, compact_transcript(cleaned)) for study_id, cleaned in records]
+
+
+def compact_series(cleaned):
+    """Series of cleaned transcripts -> compacted, same index."""
+    return cleaned.map(compact_transcript)
+
+
+def savings_report(records, counter=None, sample=None):
+    """
+    Per-row prompt tokens of each cleaned transcript before and after compaction.
+    `sample` defaults to run_planner.COUNT_SAMPLE; 0 counts every transcript.
+    """
+    # Imported here: the coders and preclassify.py import this module for
+    # compact_text alone and shouldn't pull in the planner and its backends
+    from run_planner import TokenCounter, count_transcripts, COUNT_SAMPLE
+
+    counter = counter or TokenCounter()
+    sample = COUNT_SAMPLE if sample is None else sample or None
+    before = [cleaned if isinstance(cleaned, str) else "" for _, cleaned in records]
+    after = [compact_transcript(cleaned) for cleaned in before]
+    before_tokens, _ = count_transcripts(before, counter, sample)
+    after_tokens, _ = count_transcripts(after, counter, sample)
+    report = pd.DataFrame({
+        'StudyID': [study_id for study_id, _ in records],
+        'Before_Tokens': before_tokens,
+        'After_Tokens': after_tokens,
+    })
+    report['Saved_Tokens'] = report['Before_Tokens'] - report['After_Tokens']
+    report['Saved_Pct'] = (report['Saved_Tokens'] / report['Before_Tokens'].where(report['Before_Tokens'] > 0)
+                           * 100).round(1).fillna(0.0)
+    return report
+
+
+def print_savings_report(report):
+    before, after = int(report['Before_Tokens'].sum()), int(report['After_Tokens'].sum())
+    print("\nCOMPACTION REPORT\n" + "=" * 30)
+    print(f"transcripts: {len(report):,}")
+    print(f"tokens: {before:,} -> {after:,} (saved {before - after:,}, {(before - after) / max(before, 1):.1%})")
+    print(f"saved per row: p50 {report['Saved_Pct'].quantile(0.5):.1f}% | "
+          f"p95 {report['Saved_Pct'].quantile(0.95):.1f}% | max {report['Saved_Pct'].max():.1f}%")
+    print(f"rows unchanged: {int((report['Saved_Tokens'] == 0).sum()):,}")
+    print("=" * 30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the token savings of transcript compaction.")
+    parser.add_argument('input', help="Master CSV (its corpus.parquet is used when built).")
+    parser.add_argument('--report', help="Write the per-row before/after token report to this CSV.")
+    parser.add_argument('--offline', action='store_true', help="Estimate tokens locally instead of count_tokens.")
+    parser.add_argument('--sample', type=int, default=None,
+                        help="Transcripts counted by the API (default: run_planner.COUNT_SAMPLE, 0 = all of them).")
+    parser.add_argument('--show', type=int, default=0, help="Print this many before/after examples.")
+    args = parser.parse_args()
+
+    from model_backend import get_client
+    from run_planner import TokenCounter, load_cleaned
+
+    records = load_cleaned(args.input)
+    for study_id, cleaned in records[:args.show]:
+        print(f"\n--- {study_id}\nBEFORE: {cleaned}\nAFTER:  {compact_transcript(cleaned)}")
+    report = savings_report(records, TokenCounter(None if args.offline else get_client()), args.sample)
+    print_savings_report(report)
+    if args.report:
+        write_csv(report, args.report, index=False)
+        print(f"📄 Per-row report: {args.report}")
@@ -0,0 +1,168 @@
+import argparse
+import collections
+import hashlib
+import inspect
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from atomic_io import atomic_write
+from preprocessing_util import clean_raw_text, clean_text_array, arrow_cleaning_rules, redaction_version
+from rate_limiter import CHARS_PER_TOKEN
+
+# --- CONFIGURATION ---
+# One preprocessing job instead of every coder, audit and verification pass
+# re-cleaning the raw transcript right before its API call. The master CSV is
+# streamed in chunks through a process pool into a Parquet corpus keyed by
+# StudyID. Rows whose raw text hash (and the cleaner itself) are unchanged are
+# carried over from the previous corpus instead of being cleaned again.
+CHUNK_ROWS = 20_000
+PROCESSES = os.cpu_count() or 1
+ID_COLUMN = 'StudyID'
+TEXT_COLUMN = 'Transcript'
+COLUMNS = ['StudyID', 'Raw_Hash', 'Cleaned_Transcript', 'Char_Count', 'Word_Count', 'Est_Tokens']
+
+
+def corpus_path_for(input_file):
+    """UATranscripts_All.csv -> UATranscripts_All.corpus.parquet"""
+    return os.path.splitext(input_file)[0] + '.corpus.parquet'
+
+
+def raw_hash(text):
+    """Content hash of one raw transcript (missing/non-string text hashes like "")."""
+    return hashlib.sha1((text if isinstance(text, str) else '').encode('utf-8')).hexdigest()
+
+
+def cleaner_version():
+    """Changes whenever the cleaning rules do, so a corpus built by an older cleaner is redone."""
+    digest = hashlib.sha256(inspect.getsource(clean_raw_text).encode('utf-8'))
+    digest.update(repr(arrow_cleaning_rules()).encode('utf-8'))
+    digest.update(redaction_version().encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def clean_chunk(chunk):
+    """One CSV chunk (StudyID, Transcript) -> corpus rows. Runs in a worker process."""
+    cleaned = pa.array(clean_text_array(chunk[TEXT_COLUMN]), type=pa.large_string())
+    chars = pc.utf8_length(cleaned)
+    # Cleaned text has single spaces between words and none at the ends
+    words = pc.if_else(pc.equal(chars, 0), 0, pc.add(pc.count_substring(cleaned, ' '), 1))
+    return pa.table({
+        'StudyID': pa.array(chunk[ID_COLUMN].to_numpy(dtype=object), from_pandas=True),
+        'Raw_Hash': pa.array([raw_hash(text) for text in chunk[TEXT_COLUMN]], type=pa.string()),
+        'Cleaned_Transcript': cleaned,
+        'Char_Count': chars.cast(pa.int64()),
+        'Word_Count': words.cast(pa.int64()),
+        'Est_Tokens': pc.ceil(pc.divide(chars.cast(pa.float64()), CHARS_PER_TOKEN)).cast(pa.int64()),
+    })
+
+
+def load_corpus(corpus_path, columns=None):
+    """The existing corpus table, or None if there is none or it came from a different cleaner."""
+    if not os.path.exists(corpus_path):
+        return None
+    parquet_file = pq.ParquetFile(corpus_path)
+    metadata = parquet_file.schema_arrow.metadata or {}
+    if metadata.get(b'cleaner_version', b'').decode() != cleaner_version():
+        return None
+    return parquet_file.read(columns=columns)
+
+
+def build_corpus(input_file, corpus_path=None, processes=PROCESSES, chunk_rows=CHUNK_ROWS):
+    """
+    Streams input_file through the cleaner and writes the corpus. Only rows
+    whose raw hash changed since the last build are cleaned. Returns the path.
+    """
+    corpus_path = corpus_path or corpus_path_for(input_file)
+    previous = load_corpus(corpus_path)
+    if previous is not None:
+        previous = previous.to_pandas().drop_duplicates(ID_COLUMN, keep='last').set_index(ID_COLUMN)
+
+    counts = collections.Counter()
+    version = cleaner_version()
+    schema = None
+    # spawn, not fork: a forked worker would inherit Arrow's thread pool and the parent's heap
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool, \
+            atomic_write(corpus_path, 'wb') as f:
+        writer = None
+        in_flight = collections.deque()
+
+        def write(table):
+            nonlocal writer, schema
+            if writer is None:
+                schema = table.schema.with_metadata({'cleaner_version': version})
+                writer = pq.ParquetWriter(f, schema)
+            writer.write_table(table.cast(schema))
+
+        def drain(limit):
+            # Chunks are written in CSV order; at most `limit` of them stay in flight
+            while len(in_flight) > limit:
+                kept, future = in_flight.popleft()
+                parts = [kept] if kept is not None else []
+                if future is not None:
+                    parts.append(future.result())
+                # Carried-over rows come back from pandas as plain strings; promote to the worker's types
+                write(pa.concat_tables(parts, promote_options='permissive') if len(parts) > 1 else parts[0])
+
+        for chunk in pd.read_csv(input_file, usecols=[ID_COLUMN, TEXT_COLUMN], chunksize=chunk_rows):
+            counts['rows'] += len(chunk)
+            kept = None
+            if previous is not None:
+                hashes = chunk[TEXT_COLUMN].map(raw_hash)
+                prior = previous['Raw_Hash'].reindex(chunk[ID_COLUMN])
+                unchanged = (prior.to_numpy() == hashes.to_numpy())
+                if unchanged.any():
+                    carried = previous.loc[chunk[ID_COLUMN][unchanged]].reset_index()[COLUMNS]
+                    kept = pa.Table.from_pandas(carried, preserve_index=False)
+                    chunk = chunk[~unchanged]
+            counts['cleaned'] += len(chunk)
+            future = pool.submit(clean_chunk, chunk) if len(chunk) else None
+            in_flight.append((kept, future))
+            drain(processes * 2)
+        drain(0)
+
+        if writer is None:
+            write(clean_chunk(pd.DataFrame({ID_COLUMN: [], TEXT_COLUMN: []})))
+        writer.close()
+
+    print(f"🧹 Corpus {corpus_path}: {counts['rows']} rows, {counts['cleaned']} cleaned, "
+          f"{counts['rows'] - counts['cleaned']} unchanged.")
+    return corpus_path
+
+
+def cleaned_records(records, corpus_path):
+    """
+    (StudyID, raw transcript) pairs -> (StudyID, cleaned transcript) pairs,
+    taking the text from the corpus. Rows missing from it, or whose raw text
+    no longer matches its hash, are cleaned on the spot.
+    """
+    records = list(records)
+    if not records:
+        return []
+    corpus = load_corpus(corpus_path, columns=['StudyID', 'Raw_Hash', 'Cleaned_Transcript']) \
+        if corpus_path else None
+    if corpus is None:
+        return [(study_id, clean_raw_text(transcript)) for study_id, transcript in records]
+
+    wanted = pc.is_in(corpus['StudyID'], value_set=pa.array([study_id for study_id, _ in records]))
+    rows = corpus.filter(wanted).to_pandas().drop_duplicates('StudyID', keep='last').set_index('StudyID')
+    cleaned = []
+    for study_id, transcript in records:
+        if study_id in rows.index and rows.at[study_id, 'Raw_Hash'] == raw_hash(transcript):
+            cleaned.append((study_id, rows.at[study_id, 'Cleaned_Transcript']))
+        else:
+            cleaned.append((study_id, clean_raw_text(transcript)))
+    return cleaned
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or refresh the cleaned, token-counted corpus.")
+    parser.add_argument('input', help="Master CSV with StudyID and Transcript columns.")
+    parser.add_argument('--out', help="Corpus path (default: <input>.corpus.parquet).")
+    parser.add_argument('--processes', type=int, default=PROCESSES)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+    build_corpus(args.input, args.out, args.processes, args.chunk_rows)
@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+from collections import Counter
+from retry_policy import RetryPolicy, classify_error
+
+# --- CONFIGURATION ---
+# Rows that still fail after the gateway's retries land here with the full
+# exception, error class, attempt count and prompt hash, instead of only a
+# 50-character "ERROR | ..." string in the output. Append-only JSONL like the
+# result journal (safe on the Drive mount); the latest line per StudyID wins.
+REPROCESS_CONCURRENCY = 2
+# Slower, more patient retries for a reprocess pass than the batch default
+REPROCESS_POLICY = RetryPolicy(max_attempts=10, base_delay=10, max_delay=300)
+
+# Finish reasons that mean the model refused rather than failed
+SAFETY_FINISH_REASONS = {'SAFETY', 'PROHIBITED_CONTENT', 'BLOCKLIST', 'SPII', 'RECITATION', 'IMAGE_SAFETY'}
+
+
+class SafetyBlocked(Exception):
+    """The response was blocked (prompt feedback or a safety finish reason)."""
+
+
+class ParseFailure(Exception):
+    """The answer came back but could not be turned into 'Code, Code | [Reasoning: ...]'."""
+
+
+def check_blocked(response):
+    """Raises SafetyBlocked when the response carries a block reason or a safety finish reason."""
+    feedback = getattr(response, 'prompt_feedback', None)
+    block_reason = getattr(feedback, 'block_reason', None)
+    if block_reason:
+        raise SafetyBlocked(f"Prompt blocked: {getattr(block_reason, 'name', block_reason)}")
+
+    candidates = getattr(response, 'candidates', None) or []
+    reason = getattr(candidates[0], 'finish_reason', None) if candidates else None
+    # Cached responses store the enum as text, e.g. 'FinishReason.SAFETY'
+    reason = str(getattr(reason, 'name', reason)).split('.')[-1] if reason is not None else None
+    if reason in SAFETY_FINISH_REASONS:
+        raise SafetyBlocked(f"Response blocked: finish_reason={reason}")
+
+
+def classify_failure(exc):
+    """retry_policy.classify_error plus the two failure kinds that are not transport errors."""
+    if isinstance(exc, SafetyBlocked):
+        return 'safety'
+    if isinstance(exc, ParseFailure):
+        return 'parse'
+    return classify_error(exc)
+
+
+class DeadLetterQueue:
+    """Append-only store of failed rows, keyed by StudyID."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._latest = {}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            for line in text.splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue   # torn last line from a killed runtime
+                self._latest[entry['key']] = entry
+            if text and not text.endswith("\n"):
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write("\n")
+
+    def _append(self, entry):
+        # numpy scalars (StudyIDs from DataFrames) become plain ints/floats, everything else text
+        line = json.dumps(entry, default=lambda v: v.item() if hasattr(v, 'item') else str(v)) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._latest[entry['key']] = json.loads(line)
+
+    def record(self, key, exc, source='', prompt_hash=None, model=None):
+        """Stores one failure with everything needed to decide whether and how to retry it."""
+        previous = self._latest.get(key, {})
+        self._append({
+            'key': key,
+            'status': 'failed',
+            'source': source,
+            'error_class': classify_failure(exc),
+            'exception_type': type(exc).__name__,
+            'message': str(exc),
+            'traceback': "".join(traceback.format_exception(type(exc), exc, exc.__traceback__)),
+            'attempts': getattr(exc, 'gateway_attempts', None),
+            'failures': previous.get('failures', 0) + 1,
+            'prompt_hash': prompt_hash,
+            'model': model,
+            'ts': time.time(),
+        })
+
+    def resolve(self, key):
+        """Marks a previously failed key as fixed (no-op for keys that never failed)."""
+        entry = self._latest.get(key)
+        if entry and entry['status'] == 'failed':
+            self._append(dict(entry, status='resolved', ts=time.time()))
+
+    def failed(self, classes=None, source=None):
+        """Latest failed entries, optionally limited to error classes and/or one source file."""
+        return [entry for entry in self._latest.values()
+                if entry['status'] == 'failed'
+                and (classes is None or entry['error_class'] in classes)
+                and (source is None or entry['source'] == source)]
+
+    def failed_ids(self, classes=None, source=None):
+        return [entry['key'] for entry in self.failed(classes, source)]
+
+    def summary(self):
+        return {
+            'failed': dict(Counter(entry['error_class'] for entry in self.failed())),
+            'resolved': sum(1 for entry in self._latest.values() if entry['status'] == 'resolved'),
+        }
+
+
+def print_dead_letter_report(dead_letter):
+    summary = dead_letter.summary()
+    print("\nDEAD LETTER REPORT\n" + "=" * 30)
+    for error_class, count in sorted(summary['failed'].items()):
+        print(f"failed/{error_class}: {count}")
+    print(f"resolved: {summary['resolved']}")
+    print("=" * 30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect a dead-letter file.")
+    parser.add_argument('path')
+    parser.add_argument('--classes', nargs='+', help="Only list these error classes.")
+    parser.add_argument('--show', action='store_true', help="Print each failed entry.")
+    args = parser.parse_args()
+
+    queue = DeadLetterQueue(args.path)
+    print_dead_letter_report(queue)
+    if args.show:
+        for entry in queue.failed(args.classes):
+            print(f"{entry['key']} [{entry['error_class']}] x{entry['failures']} "
+                  f"({entry['source']}): {entry['message'][:200]}")
@@ -0,0 +1,153 @@
+import hashlib
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from preprocessing_util import clean_series
+
+# --- CONFIGURATION ---
+NEAR_DUP_THRESHOLD = 0.9   # estimated Jaccard similarity to treat two chats as the same; None = exact only
+NUM_PERM = 64              # MinHash signature length
+SHINGLE_SIZE = 3           # word n-grams (short chats fall back to the whole text)
+_PRIME = (1 << 31) - 1     # keeps a*x+b inside uint64 for numpy
+
+_rng = np.random.default_rng(1746)   # fixed seed: same groups on every run
+_PERM_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def exact_key(cleaned):
+    return hashlib.sha1(cleaned.encode('utf-8')).hexdigest()
+
+
+def _shingle_hashes(cleaned):
+    words = cleaned.lower().split()
+    if len(words) <= SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') & _PRIME
+         for s in shingles],
+        dtype=np.uint64
+    )
+
+
+def minhash(cleaned):
+    hashes = _shingle_hashes(cleaned)
+    return ((_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _PRIME).min(axis=1)
+
+
+def _lsh_shape(threshold, num_perm=NUM_PERM):
+    """Picks (bands, rows) whose S-curve midpoint (1/b)^(1/r) sits just below the threshold."""
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        midpoint = (1 / bands) ** (1 / rows)
+        if midpoint <= threshold and (best is None or midpoint > best[2]):
+            best = (bands, rows, midpoint)
+    return best[:2] if best else (num_perm, 1)
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # the earlier record stays the representative
+            if root_b < root_a:
+                root_a, root_b = root_b, root_a
+            self.parent[root_b] = root_a
+
+
+def collapse_duplicates(records, threshold=NEAR_DUP_THRESHOLD, precleaned=False):
+    """
+    Groups (StudyID, transcript) pairs whose cleaned text is identical, or
+    near-identical by MinHash/LSH when `threshold` is set. With `precleaned=True`
+    the transcripts are already cleaned (corpus.cleaned_records, compaction) and
+    are keyed as given instead of being cleaned (and redacted) a second time.
+
+    Returns (representatives, provenance):
+      representatives - the (StudyID, transcript) pairs to actually send
+      provenance      - {StudyID: (representative StudyID, 'representative' | 'exact' | 'near')}
+    """
+    records = list(records)
+    if precleaned:
+        cleaned = [transcript if isinstance(transcript, str) else "" for _, transcript in records]
+    else:
+        cleaned = clean_series(pd.Series([transcript for _, transcript in records], dtype=object)).tolist()
+
+    # 1. Exact duplicates on the cleaned text
+    first_by_hash = {}
+    exact_of = {}
+    for pos, text in enumerate(cleaned):
+        key = exact_key(text)
+        if key in first_by_hash:
+            exact_of[pos] = first_by_hash[key]
+        else:
+            first_by_hash[key] = pos
+
+    uf = _UnionFind()
+    unique_positions = sorted(first_by_hash.values())
+
+    # 2. Near duplicates among the exact-unique texts
+    if threshold is not None:
+        bands, rows = _lsh_shape(threshold)
+        signatures = {pos: minhash(cleaned[pos]) for pos in unique_positions if cleaned[pos]}
+        buckets = defaultdict(list)
+        for pos, sig in signatures.items():
+            for band in range(bands):
+                buckets[(band, sig[band * rows:(band + 1) * rows].tobytes())].append(pos)
+
+        for members in buckets.values():
+            # Compare each member against the bucket's cluster leaders, not every pair
+            leaders = []
+            for pos in members:
+                for leader in leaders:
+                    if float(np.mean(signatures[leader] == signatures[pos])) >= threshold:
+                        uf.union(leader, pos)
+                        break
+                else:
+                    leaders.append(pos)
+
+    provenance = {}
+    representatives = []
+    for pos, (study_id, transcript) in enumerate(records):
+        if pos in exact_of:
+            rep = uf.find(exact_of[pos])
+            kind = 'exact' if rep == exact_of[pos] else 'near'
+        else:
+            rep = uf.find(pos)
+            kind = 'representative' if rep == pos else 'near'
+
+        provenance[study_id] = (records[rep][0], kind)
+        if kind == 'representative':
+            representatives.append((study_id, transcript))
+
+    saved = len(records) - len(representatives)
+    print(f"🧬 Dedup: {len(records)} transcripts -> {len(representatives)} API calls "
+          f"({saved} collapsed, {saved / max(len(records), 1) * 100:.1f}%).")
+    return representatives, provenance
+
+
+def members_by_representative(provenance):
+    """Inverts provenance into {representative StudyID: [(member StudyID, kind), ...]}."""
+    groups = defaultdict(list)
+    for study_id, (rep_id, kind) in provenance.items():
+        groups[rep_id].append((study_id, kind))
+    return groups
+
+
+def provenance_label(rep_id, kind):
+    """Value for the Dedup_Provenance output column."""
+    return kind if kind == 'representative' else f"{kind}:{rep_id}"
@@ -1,20 +1,9 @@
 import pandas as pd
-
-# 1. Load your Adjusted Audit file
-# (Ensure this matches your actual file name)
-AUDIT_FILE = "/content/drive/MyDrive/Colab_Outputs/Adjudication_Complete.csv"
-df = pd.read_csv(AUDIT_FILE)
+from atomic_io import write_csv
 
 # 2. Filter for the "Edge Cases" (Tier 1 and Tier 4)
 # This captures the 181 Mismatches and 100 Complex Overlaps
 triage_tiers = ['Tier 1: Total Mismatch', 'Tier 4: Complex Overlap']
-df_triage = df[df['Audit_Tier'].isin(triage_tiers)].copy()
-
-# 3. Add the Expert Decision Columns
-# We leave these blank for your human experts to fill in
-df_triage['Expert_Final_Code'] = ""
-df_triage['Expert_Reasoning'] = ""
-df_triage['Decision_Category'] = "" # e.g., "AI was right", "Human was right", "Both valid"
 
 # 4. Reorder columns for easier reading
 # Placing AI_Thoughts next to the Expert Decision columns is key
@@ -33,12 +22,30 @@ final_columns = [
     'Decision_Category'
 ]
 
-# Ensure only existing columns are used to avoid errors
-df_triage = df_triage[[col for col in final_columns if col in df_triage.columns]]
+def triage_frame(df):
+    """Tier 1 / Tier 4 rows of an adjudication frame, with blank expert decision columns."""
+    df_triage = df[df['Audit_Tier'].isin(triage_tiers)].copy()
+
+    # 3. Add the Expert Decision Columns
+    # We leave these blank for your human experts to fill in
+    df_triage['Expert_Final_Code'] = ""
+    df_triage['Expert_Reasoning'] = ""
+    df_triage['Decision_Category'] = "" # e.g., "AI was right", "Human was right", "Both valid"
+
+    # Ensure only existing columns are used to avoid errors
+    return df_triage[[col for col in final_columns if col in df_triage.columns]]
+
+if __name__ == "__main__":
+    # 1. Load your Adjusted Audit file
+    # (Ensure this matches your actual file name)
+    AUDIT_FILE = "/content/drive/MyDrive/Colab_Outputs/Adjudication_Complete.csv"
+    df = pd.read_csv(AUDIT_FILE)
+
+    df_triage = triage_frame(df)
 
-# 5. Save the Triage File
-output_path = "/content/drive/MyDrive/Colab_Outputs/Expert_Triage_281.csv"
-df_triage.to_csv(output_path, index=False)
+    # 5. Save the Triage File
+    output_path = "/content/drive/MyDrive/Colab_Outputs/Expert_Triage_281.csv"
+    write_csv(df_triage, output_path, index=False)
 
-print(f"✅ Success! Created triage file with {len(df_triage)} rows.")
-print(f"📂 Location: {output_path}")
+    print(f"✅ Success! Created triage file with {len(df_triage)} rows.")
+    print(f"📂 Location: {output_path}")
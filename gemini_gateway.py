@@ -0,0 +1,153 @@
+import asyncio
+import time
+from rate_limiter import get_limiter, estimate_tokens
+from retry_policy import DEFAULT_POLICY, classify_error
+from response_cache import RESPONSE_CACHE, cache_key
+from telemetry import TELEMETRY
+from shutdown import ShutdownRequested, shutdown_requested
+from budget import GOVERNOR
+
+# Single choke point for every Gemini generate_content call in the pipeline.
+# Coders, auditors and verifiers call these instead of client.models directly,
+# so the response cache, quota metering, the retry/circuit-breaker policy and
+# per-call telemetry apply to all of them. Once a graceful shutdown has started
+# no new request leaves; ShutdownRequested is raised instead. The budget governor
+# sees every live response and can pace or stop requests (BudgetExceeded).
+# Telemetry latency is the final HTTP call alone; limiter, slot, pacing and
+# back-off time before it is recorded separately as the call's wait.
+
+
+def estimate_request_tokens(contents, config=None):
+    """Estimates input tokens for a request, including any system_instruction."""
+    if isinstance(contents, (list, tuple)):
+        total = sum(estimate_tokens(c) for c in contents)
+    else:
+        total = estimate_tokens(contents)
+
+    system_instruction = None
+    if isinstance(config, dict):
+        system_instruction = config.get('system_instruction')
+    elif config is not None:
+        system_instruction = getattr(config, 'system_instruction', None)
+
+    return total + estimate_tokens(system_instruction)
+
+
+def generate_content(client, model, contents, config=None, policy=DEFAULT_POLICY, cache=RESPONSE_CACHE,
+                     telemetry=TELEMETRY, items=1, governor=GOVERNOR):
+    """
+    Cached, rate-limited, retried client.models.generate_content. Raises after
+    the final attempt. Pass cache=None to skip the response cache for one call.
+    `items` is how many transcripts the call codes (packed requests), for telemetry.
+    """
+    start = time.perf_counter()
+    key = cache_key(model, contents, config) if cache else None
+    if key:
+        hit = cache.get(key)
+        if hit is not None:
+            if telemetry:
+                telemetry.record(model, time.perf_counter() - start, hit, attempts=0, items=items)
+            return hit
+
+    tokens = estimate_request_tokens(contents, config)
+    limiter = get_limiter(model)
+    attempts = 0
+    latency = 0.0
+
+    def attempt():
+        nonlocal attempts, latency
+        limiter.acquire(tokens)
+        if governor:
+            time.sleep(governor.pause())
+            governor.check()
+        if shutdown_requested():
+            raise ShutdownRequested("shutting down; request not sent")
+        attempts += 1
+        sent = time.perf_counter()
+        try:
+            return client.models.generate_content(model=model, contents=contents, config=config)
+        finally:
+            latency = time.perf_counter() - sent
+
+    try:
+        response = policy.call(attempt)
+    except ShutdownRequested:
+        raise
+    except Exception as e:
+        e.gateway_attempts = attempts   # read by the dead-letter queue
+        if telemetry:
+            telemetry.record(model, latency, attempts=attempts, error_class=classify_error(e), items=items,
+                             wait=time.perf_counter() - start - latency)
+        raise
+    if telemetry:
+        telemetry.record(model, latency, response, attempts=attempts, items=items,
+                         wait=time.perf_counter() - start - latency)
+    if governor:
+        governor.record(model, response, items)
+    if key:
+        cache.put(key, model, response)
+    return response
+
+
+async def agenerate_content(client, model, contents, config=None, policy=DEFAULT_POLICY,
+                            semaphore=None, cache=RESPONSE_CACHE, telemetry=TELEMETRY, items=1,
+                            governor=GOVERNOR):
+    """
+    Async twin of generate_content(). If a semaphore is given only the HTTP
+    request holds a slot; quota waits and back-off sleeps do not.
+    """
+    start = time.perf_counter()
+    key = cache_key(model, contents, config) if cache else None
+    if key:
+        hit = cache.get(key)
+        if hit is not None:
+            if telemetry:
+                telemetry.record(model, time.perf_counter() - start, hit, attempts=0, items=items)
+            return hit
+
+    tokens = estimate_request_tokens(contents, config)
+    limiter = get_limiter(model)
+    attempts = 0
+    latency = 0.0
+
+    async def send():
+        nonlocal attempts, latency
+        # Checked after any semaphore wait, right before the request would leave.
+        # Pacing holds the slot on purpose: that is what slows the spend down.
+        if governor:
+            await asyncio.sleep(governor.pause())
+            governor.check()
+        if shutdown_requested():
+            raise ShutdownRequested("shutting down; request not sent")
+        attempts += 1
+        sent = time.perf_counter()
+        try:
+            return await client.aio.models.generate_content(model=model, contents=contents, config=config)
+        finally:
+            latency = time.perf_counter() - sent
+
+    async def attempt():
+        await limiter.acquire_async(tokens)
+        if semaphore is None:
+            return await send()
+        async with semaphore:
+            return await send()
+
+    try:
+        response = await policy.acall(attempt)
+    except ShutdownRequested:
+        raise
+    except Exception as e:
+        e.gateway_attempts = attempts   # read by the dead-letter queue
+        if telemetry:
+            telemetry.record(model, latency, attempts=attempts, error_class=classify_error(e), items=items,
+                             wait=time.perf_counter() - start - latency)
+        raise
+    if telemetry:
+        telemetry.record(model, latency, response, attempts=attempts, items=items,
+                         wait=time.perf_counter() - start - latency)
+    if governor:
+        governor.record(model, response, items)
+    if key:
+        cache.put(key, model, response)
+    return response
@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+import pandas as pd
+from atomic_io import write_csv, write_parquet
+
+# --- CONFIGURATION ---
+# One JSON line per finished StudyID, appended and fsynced as it completes.
+# Appends are O(1) on the Drive mount, unlike rewriting the whole CSV every few
+# rows. Later lines win, so a retried ERROR row is simply appended again.
+JOURNAL_SUFFIX = '.journal.jsonl'
+
+
+def journal_path_for(output_file):
+    """Coded_Batch_0_to_1000.csv -> Coded_Batch_0_to_1000.journal.jsonl"""
+    return os.path.splitext(output_file)[0] + JOURNAL_SUFFIX
+
+
+def _jsonable(value):
+    # numpy scalars (StudyID, wait times) come out of DataFrame rows
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+class ResultJournal:
+    """Append-only JSONL journal of per-StudyID results with resume and compaction."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._latest = {}   # key -> (row dict, failed)
+        self._load()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        for line in text.splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A runtime killed mid-append leaves at most one torn last line
+                continue
+            self._latest[entry['key']] = (entry['row'], entry['failed'])
+        if text and not text.endswith("\n"):
+            # Terminate the torn line so the next append starts on a fresh one
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("\n")
+        print(f"📓 Journal {self.path}: {len(self.done_ids())} done, "
+              f"{len(self._latest) - len(self.done_ids())} failed.")
+
+    def record(self, key, row, failed=False):
+        """Commits one result: a single write + fsync of one complete line."""
+        line = json.dumps({'key': key, 'failed': bool(failed), 'row': row}, default=_jsonable) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._latest[key] = (json.loads(line)['row'], bool(failed))
+
+    def keys(self):
+        return list(self._latest)
+
+    def done_ids(self):
+        """Keys whose latest entry succeeded; failed keys are retried on resume."""
+        return {key for key, (_, failed) in self._latest.items() if not failed}
+
+    def rows(self, order=None):
+        """Latest row per key, in `order` when given (keys not in order go last)."""
+        keys = list(self._latest)
+        if order is not None:
+            position = {key: pos for pos, key in enumerate(order)}
+            keys.sort(key=lambda key: position.get(key, len(position)))
+        return [self._latest[key][0] for key in keys]
+
+    def overlay(self, df, columns, key_column='StudyID'):
+        """Writes the journaled `columns` onto df rows matched by key_column (or the index)."""
+        if not self._latest:
+            return df
+        journaled = pd.DataFrame.from_dict({key: row for key, (row, _) in self._latest.items()}, orient='index')
+        keys = df[key_column] if key_column in df.columns else df.index.to_series()
+        for col in columns:
+            if col in journaled.columns:
+                mapped = keys.map(journaled[col])
+                df[col] = mapped.where(keys.isin(journaled.index), df[col])
+        return df
+
+    def compact(self, output_file, order=None):
+        """Materializes the journal as the final CSV (or Parquet, by extension)."""
+        results_df = pd.DataFrame(self.rows(order))
+        if output_file.endswith('.parquet'):
+            write_parquet(results_df, output_file, index=False)
+        else:
+            write_csv(results_df, output_file, index=False)
+        return results_df
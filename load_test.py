@@ -0,0 +1,109 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+# --- CONFIGURATION ---
+# Offline throughput test: runs the real orchestration path (async engine,
+# gateway, limiter, retry policy) against mock_server.py. Scratch state goes to a
+# temp dir so the real response cache and quota file are never touched.
+_SCRATCH = tempfile.mkdtemp(prefix='vr_load_test_')
+os.environ['VR_BACKEND'] = 'mock'
+os.environ.setdefault('VR_MOCK_URL', 'http://127.0.0.1:8765')
+os.environ['VR_RESPONSE_CACHE_DB'] = os.path.join(_SCRATCH, 'responses.sqlite')
+os.environ['VR_RATE_LIMIT_DB'] = os.path.join(_SCRATCH, 'rate_limits.sqlite')
+os.environ['VR_PROMPT_CACHE_REGISTRY'] = os.path.join(_SCRATCH, 'prompt_cache.json')
+os.environ['VR_CACHE_BYPASS'] = '1'   # every level re-sends the same rows
+os.environ.setdefault('VR_TELEMETRY_DIR', os.path.join(_SCRATCH, 'telemetry'))
+
+import rate_limiter  # noqa: E402  (env vars above must be set first)
+from async_engine import code_batch  # noqa: E402
+from mock_server import start_mock_server  # noqa: E402
+from preprocessing_util import MODEL_NAME  # noqa: E402
+from retry_policy import print_retry_report  # noqa: E402
+from telemetry import TELEMETRY, print_telemetry_report  # noqa: E402
+from coding_logic_34 import (client, SYSTEM_PROMPT, COFFEE_REMINDER,  # noqa: E402
+                             CODING_CONFIG, ANSWER_FORMATTER)
+
+SAMPLE_TURNS = [
+    "Patron: Hi, how do I renew a book I checked out last week?",
+    "Librarian: You can renew it from your library account under Checked Out Items.",
+    "Patron: Also, is the main library open on Sunday?",
+    "Librarian: Yes, Sunday hours are noon to 8pm.",
+]
+
+
+def synthetic_records(n):
+    """n distinct (StudyID, transcript) pairs so the response cache never short-circuits."""
+    return [(f"LT{i:06d}", "\n".join(SAMPLE_TURNS) + f"\nPatron: Thanks! (ticket {i})") for i in range(n)]
+
+
+class _TimedModels:
+    """Wraps client.aio.models to record the wall time of each HTTP call."""
+
+    def __init__(self, models, latencies):
+        self._models = models
+        self._latencies = latencies
+
+    async def generate_content(self, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self._models.generate_content(**kwargs)
+        finally:
+            self._latencies.append(time.perf_counter() - start)
+
+
+def run_level(records, concurrency):
+    latencies = []
+    real_models = client.aio.models
+    client.aio.models = _TimedModels(real_models, latencies)
+    try:
+        start = time.perf_counter()
+        results = code_batch(records, client, SYSTEM_PROMPT, COFFEE_REMINDER, concurrency=concurrency,
+                             base_config=CODING_CONFIG, answer_formatter=ANSWER_FORMATTER)
+        elapsed = time.perf_counter() - start
+    finally:
+        client.aio.models = real_models
+
+    errors = sum(1 for clean_code, _ in results.values() if str(clean_code).startswith('ERROR'))
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0.0
+    print(f"  concurrency {concurrency:>3}: {len(records) / elapsed:7.1f} rows/s | "
+          f"p50 {statistics.median(ordered) if ordered else 0.0:5.2f}s | p95 {p95:5.2f}s | "
+          f"{len(latencies)} calls | {errors} errors | {elapsed:6.1f}s total")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the coding orchestration against the mock backend.")
+    parser.add_argument('--rows', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--latency-ms', type=float, default=800)
+    parser.add_argument('--jitter-ms', type=float, default=200)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--respect-quota', action='store_true',
+                        help="Keep the RATE_LIMITS quota for MODEL_NAME instead of lifting it.")
+    parser.add_argument('--no-server', action='store_true',
+                        help="Use an already running mock_server.py at VR_MOCK_URL.")
+    args = parser.parse_args()
+
+    server = None
+    if not args.no_server:
+        port = int(os.environ['VR_MOCK_URL'].rsplit(':', 1)[-1])
+        server = start_mock_server(port, args.latency_ms, args.jitter_ms, args.error_rate)
+
+    if not args.respect_quota:
+        # Measure the orchestrator itself, not the published quota
+        rate_limiter._LIMITERS[MODEL_NAME] = rate_limiter.RateLimiter(MODEL_NAME, rpm=1e9, tpm=1e12)
+
+    records = synthetic_records(args.rows)
+    TELEMETRY.start_run('load_test', args.rows * len(args.concurrency))
+    print(f"🏁 Load test: {args.rows} rows against {os.environ['VR_MOCK_URL']}")
+    try:
+        for concurrency in args.concurrency:
+            run_level(records, concurrency)
+    finally:
+        print_retry_report()
+        print_telemetry_report()
+        if server:
+            server.shutdown()
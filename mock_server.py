@@ -0,0 +1,139 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from code_schema import load_code_names
+
+# --- CONFIGURATION ---
+# Local stand-in for the Gemini generateContent endpoint. Answers are
+# deterministic (hash of the prompt) and always use valid codebook names, so the
+# orchestrators can be load-tested on a plain Linux box without a key or quota.
+DEFAULT_PORT = 8765
+DEFAULT_LATENCY_MS = 800
+DEFAULT_JITTER_MS = 200
+DEFAULT_ERROR_RATE = 0.0     # fraction of requests answered with a 429 (exercises retries)
+
+
+def _prompt_text(contents):
+    """Flattens REST contents (string, list of strings, or Content dicts) into one string."""
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return " ".join(str(p.get('text', '')) for p in contents.get('parts', []))
+    if isinstance(contents, list):
+        return " ".join(_prompt_text(c) for c in contents)
+    return str(contents)
+
+
+def pick_codes(text, code_names, max_codes=2):
+    """Deterministic 1..max_codes codebook names for a piece of text."""
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    count = 1 + digest[0] % max_codes
+    return [code_names[digest[i + 1] % len(code_names)] for i in range(count)]
+
+
+def build_answer(contents, config, code_names):
+    """Text of the mock answer in whichever format the request asked for."""
+    text = _prompt_text(contents)
+    schema = (config or {}).get('response_schema') or {}
+    schema_type = str(schema.get('type', '')).upper()
+
+    if schema_type == 'ARRAY':
+        # Packed request: one object per StudyID in the prompt
+        ids = re.findall(r'StudyID: (\S+)', text)
+        items = []
+        for study_id in ids:
+            codes = pick_codes(study_id + text, code_names)
+            is_list = str(schema.get('items', {}).get('properties', {}).get('codes', {}).get('type', '')).upper() == 'ARRAY'
+            items.append({'StudyID': study_id, 'codes': codes if is_list else ", ".join(codes),
+                          'reasoning': 'Mock answer.'})
+        return json.dumps(items)
+
+    codes = list(dict.fromkeys(pick_codes(text, code_names)))
+    if schema_type == 'OBJECT':
+        return json.dumps({'codes': codes, 'reasoning': 'Mock answer.'})
+    return f"{', '.join(codes)} | [Reasoning: Mock answer.]"
+
+
+def make_handler(code_names, latency_ms, jitter_ms, error_rate):
+    class MockGeminiHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass  # keep load tests quiet
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+
+            time.sleep(max(0.0, random.gauss(latency_ms, jitter_ms)) / 1000.0)
+
+            if error_rate and random.random() < error_rate:
+                self._send(429, {'error': {
+                    'code': 429, 'status': 'RESOURCE_EXHAUSTED', 'message': 'Mock quota exceeded.',
+                    'details': [{'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '1s'}],
+                }})
+                return
+
+            prompt = _prompt_text(request.get('contents'))
+            answer = build_answer(request.get('contents'), request.get('config'), code_names)
+            self._send(200, {
+                'candidates': [{
+                    'content': {'role': 'model', 'parts': [
+                        {'text': 'Mock reasoning about the transcript.', 'thought': True},
+                        {'text': answer},
+                    ]},
+                    'finishReason': 'STOP',
+                }],
+                'usageMetadata': {
+                    'promptTokenCount': len(prompt) // 4,
+                    'candidatesTokenCount': len(answer) // 4,
+                    'thoughtsTokenCount': 40,
+                    'totalTokenCount': len(prompt) // 4 + len(answer) // 4 + 40,
+                },
+            })
+
+    return MockGeminiHandler
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256   # the default listen backlog of 5 drops connections at high concurrency
+
+
+def start_mock_server(port=DEFAULT_PORT, latency_ms=DEFAULT_LATENCY_MS, jitter_ms=DEFAULT_JITTER_MS,
+                      error_rate=DEFAULT_ERROR_RATE, codebook='codebook2.json'):
+    """Starts the mock on a background thread and returns the server (call .shutdown() to stop)."""
+    handler = make_handler(load_code_names(codebook), latency_ms, jitter_ms, error_rate)
+    server = _MockHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🧪 Mock Gemini listening on http://127.0.0.1:{port} "
+          f"(latency {latency_ms}±{jitter_ms}ms, error rate {error_rate:.0%})")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline mock of the Gemini generateContent endpoint.")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency-ms', type=float, default=DEFAULT_LATENCY_MS)
+    parser.add_argument('--jitter-ms', type=float, default=DEFAULT_JITTER_MS)
+    parser.add_argument('--error-rate', type=float, default=DEFAULT_ERROR_RATE)
+    parser.add_argument('--codebook', default='codebook2.json')
+    args = parser.parse_args()
+
+    server = start_mock_server(args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.codebook)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import os
+from types import SimpleNamespace
+import httpx
+from google import genai
+from google.genai import errors, types
+
+# --- CONFIGURATION ---
+# VR_BACKEND=gemini (default) -> real google-genai client
+# VR_BACKEND=mock             -> local HTTP mock (see mock_server.py), no key needed
+BACKEND = os.environ.get('VR_BACKEND', 'gemini')
+MOCK_URL = os.environ.get('VR_MOCK_URL', 'http://127.0.0.1:8765')
+MOCK_TIMEOUT = 120.0
+
+
+def get_api_key(secret_name='GEMINI_API_KEY'):
+    """Colab secret when running in Colab, otherwise the environment variable of the same name."""
+    try:
+        from google.colab import userdata
+        return userdata.get(secret_name)
+    except ImportError:
+        return os.environ.get(secret_name)
+
+
+def get_client(secret_name='GEMINI_API_KEY', backend=None):
+    """Returns the client for the configured backend. Both expose client.models / client.aio.models."""
+    backend = backend or BACKEND
+    if backend == 'mock':
+        return MockClient(MOCK_URL)
+    if backend != 'gemini':
+        raise ValueError(f"Unknown VR_BACKEND '{backend}' (expected 'gemini' or 'mock')")
+
+    return genai.Client(
+        api_key=get_api_key(secret_name),
+        # This correctly forces the SDK to use the Developer branch (not Vertex)
+        vertexai=False,
+        # This ensures you're hitting the Beta endpoint for the latest features
+        http_options=types.HttpOptions(api_version='v1beta')
+    )
+
+
+# --- MOCK BACKEND ---
+def _to_rest(value):
+    """Serializes contents/config (dicts or SDK models) into REST-shaped JSON."""
+    if hasattr(value, 'model_dump'):
+        return value.model_dump(exclude_none=True, mode='json')
+    if isinstance(value, dict):
+        return {k: _to_rest(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_rest(v) for v in value]
+    return value
+
+
+def _request_body(model, contents, config):
+    return {'model': model, 'contents': _to_rest(contents), 'config': _to_rest(config or {})}
+
+
+def _to_response(http_response):
+    """Turns the mock's JSON into a real GenerateContentResponse, or raises the SDK's error type."""
+    payload = http_response.json()
+    if http_response.status_code >= 400:
+        if http_response.status_code >= 500:
+            raise errors.ServerError(http_response.status_code, payload, http_response)
+        raise errors.ClientError(http_response.status_code, payload, http_response)
+    return types.GenerateContentResponse.model_validate(payload)
+
+
+class _MockModels:
+    def __init__(self, base_url):
+        self._http = httpx.Client(base_url=base_url, timeout=MOCK_TIMEOUT)
+
+    def generate_content(self, model, contents, config=None):
+        return _to_response(self._http.post(f"/v1beta/models/{model}:generateContent",
+                                            json=_request_body(model, contents, config)))
+
+
+class _MockAsyncModels:
+    def __init__(self, base_url):
+        self._base_url = base_url
+        self._http = None
+        self._loop = None
+
+    async def generate_content(self, model, contents, config=None):
+        # httpx.AsyncClient is bound to one event loop; code_batch may start a fresh loop per batch
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._http = httpx.AsyncClient(base_url=self._base_url, timeout=MOCK_TIMEOUT,
+                                           limits=httpx.Limits(max_connections=None))
+            self._loop = loop
+        response = await self._http.post(f"/v1beta/models/{model}:generateContent",
+                                          json=_request_body(model, contents, config))
+        return _to_response(response)
+
+
+class _MockCaches:
+    """Context caching is a no-op against the mock; names are derived from the prompt."""
+
+    def create(self, model, config):
+        digest = hashlib.sha256(str(config.system_instruction).encode('utf-8')).hexdigest()[:12]
+        return SimpleNamespace(name=f"cachedContents/mock-{digest}")
+
+    def update(self, name, config):
+        return SimpleNamespace(name=name)
+
+    def delete(self, name):
+        return None
+
+
+class MockClient:
+    """Drop-in for genai.Client that talks to mock_server.py."""
+
+    def __init__(self, base_url=MOCK_URL):
+        self.base_url = base_url
+        self.models = _MockModels(base_url)
+        self.aio = SimpleNamespace(models=_MockAsyncModels(base_url))
+        self.caches = _MockCaches()
@@ -0,0 +1,212 @@
+import asyncio
+import json
+from async_engine import run_blocking, record_dead_letter, MAX_IN_FLIGHT
+from shutdown import ShutdownRequested, shutdown_requested
+from gemini_gateway import agenerate_content
+from prompt_cache import prepare_contents, prompt_hash, is_stale_cache_error, inline_after_stale_cache
+from retry_policy import DEFAULT_POLICY
+from response_cache import RESPONSE_CACHE
+from dead_letter import check_blocked, ParseFailure
+from rate_limiter import estimate_tokens
+from preprocessing_util import clean_raw_text, parse_model_response, AI_CONFIG, MODEL_NAME
+
+# --- CONFIGURATION ---
+# Several transcripts share one copy of the (large) system prompt per call.
+PACK_TOKEN_BUDGET = 6000            # estimated transcript tokens per call
+MAX_PACK_SIZE = 20                  # hard cap on transcripts per call
+OUTPUT_TOKENS_PER_TRANSCRIPT = 400  # extra answer room added to max_output_tokens per packed row
+
+PACK_INSTRUCTIONS = """
+### PACKED REQUEST
+Code EACH transcript below independently, as if it were the only one. Do not let one transcript influence another.
+Return a JSON array with exactly one object per transcript: {"StudyID": "<the StudyID given>", "codes": ["Code", "Code"], "reasoning": "Brief justification"}.
+"""
+
+
+def build_pack_schema(code_names=None):
+    """JSON array schema for packed answers; with code_names the codes are an enum list."""
+    if code_names:
+        codes_schema = {'type': 'ARRAY', 'items': {'type': 'STRING', 'enum': list(code_names)}}
+    else:
+        codes_schema = {'type': 'STRING'}
+    return {
+        'type': 'ARRAY',
+        'items': {
+            'type': 'OBJECT',
+            'properties': {
+                'StudyID': {'type': 'STRING'},
+                'codes': codes_schema,
+                'reasoning': {'type': 'STRING'},
+            },
+            'required': ['StudyID', 'codes', 'reasoning'],
+        },
+    }
+
+
+def pack_records(records, token_budget=PACK_TOKEN_BUDGET, max_pack_size=MAX_PACK_SIZE):
+    """
+    Greedily groups (StudyID, cleaned_text) pairs into packs that stay under the
+    token budget. A transcript larger than the budget gets a pack of its own.
+    """
+    packs = []
+    current, current_tokens = [], 0
+
+    for study_id, cleaned in records:
+        tokens = estimate_tokens(cleaned)
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_pack_size):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append((study_id, cleaned))
+        current_tokens += tokens
+
+    if current:
+        packs.append(current)
+    return packs
+
+
+def parse_packed_answer(answer_text, expected_ids):
+    """
+    Validates a packed JSON answer. Returns ({StudyID: clean_code}, missing_ids);
+    clean_code keeps the single-transcript 'Code, Code | [Reasoning: ...]' format.
+    """
+    by_id = {}
+    try:
+        items = json.loads(answer_text)
+    except (json.JSONDecodeError, TypeError):
+        items = []
+
+    expected = {str(study_id): study_id for study_id in expected_ids}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        key = str(item.get('StudyID', '')).strip()
+        codes = item.get('codes', '')
+        if isinstance(codes, list):
+            codes = ", ".join(dict.fromkeys(codes))
+        codes = str(codes).strip()
+        if key in expected and codes:
+            by_id[expected[key]] = f"{codes} | [Reasoning: {str(item.get('reasoning', '')).strip()}]"
+
+    missing = [study_id for study_id in expected_ids if study_id not in by_id]
+    return by_id, missing
+
+
+async def acode_pack(client, system_prompt, pack, semaphore, coffee_reminder="", code_names=None,
+                     policy=DEFAULT_POLICY, cache=RESPONSE_CACHE, failures=None):
+    """
+    Codes one pack in a single call. IDs that come back missing or malformed are
+    re-split in halves and resent; a lone transcript that still fails is an ERROR row.
+    Returns {StudyID: (clean_code, mental_process)}. The final exception of each
+    ERROR row goes into `failures` ({StudyID: exception}) for the dead-letter queue.
+    """
+    failures = {} if failures is None else failures
+    block = "\n\n".join(f"StudyID: {study_id}\nTranscript: {cleaned}" for study_id, cleaned in pack)
+    config = dict(
+        AI_CONFIG,
+        max_output_tokens=AI_CONFIG['max_output_tokens'] + OUTPUT_TOKENS_PER_TRANSCRIPT * len(pack),
+        response_mime_type='application/json',
+        response_schema=build_pack_schema(code_names),
+    )
+    # Blocking cache calls (and their back-off) run in a thread, not on the event loop
+    contents, config = await asyncio.to_thread(prepare_contents, client, system_prompt,
+                                               f"{PACK_INSTRUCTIONS}\n{block}{coffee_reminder}",
+                                               base_config=config)
+
+    try:
+        try:
+            response = await agenerate_content(client, model=MODEL_NAME, contents=contents, config=config,
+                                               policy=policy, semaphore=semaphore, cache=cache, items=len(pack))
+        except ShutdownRequested:
+            raise
+        except Exception as e:
+            if not is_stale_cache_error(e, config):
+                raise
+            contents, config = await asyncio.to_thread(inline_after_stale_cache, system_prompt, contents, config)
+            response = await agenerate_content(client, model=MODEL_NAME, contents=contents, config=config,
+                                               policy=policy, semaphore=semaphore, cache=cache, items=len(pack))
+        check_blocked(response)
+        answer_text, mental_process = parse_model_response(response)
+        # parse_model_response flattens newlines only; the JSON is still intact
+        coded, missing = parse_packed_answer(answer_text, [study_id for study_id, _ in pack])
+    except ShutdownRequested:
+        raise
+    except Exception as e:
+        if len(pack) == 1:
+            failures[pack[0][0]] = e
+            return {pack[0][0]: (f"ERROR | {str(e)[:50]}", "")}
+        coded, missing, mental_process = {}, [study_id for study_id, _ in pack], ""
+
+    results = {study_id: (clean_code, mental_process) for study_id, clean_code in coded.items()}
+
+    if missing:
+        if len(pack) == 1:
+            failures[pack[0][0]] = ParseFailure("Packed answer missing or malformed")
+            results[pack[0][0]] = ("ERROR | Packed answer missing or malformed", mental_process)
+        else:
+            remaining = [item for item in pack if item[0] in set(missing)]
+            half = max(1, len(remaining) // 2)
+            for sub_pack in (remaining[:half], remaining[half:]):
+                if sub_pack:
+                    try:
+                        results.update(await acode_pack(client, system_prompt, sub_pack, semaphore,
+                                                        coffee_reminder, code_names, policy, cache, failures))
+                    except ShutdownRequested:
+                        break   # keep what this pack already coded; the rest stays pending
+
+    return results
+
+
+async def code_batch_packed_async(records, client, system_prompt, coffee_reminder="",
+                                  concurrency=MAX_IN_FLIGHT, on_result=None,
+                                  insufficient_label="Abandoned Chat | Insufficient data",
+                                  token_budget=PACK_TOKEN_BUDGET, code_names=None, precleaned=False,
+                                  dead_letter=None, source='', dead_letter_keys=None,
+                                  policy=DEFAULT_POLICY, cache=RESPONSE_CACHE):
+    """
+    Packed counterpart of async_engine.code_batch_async: same inputs, same
+    {StudyID: (clean_code, mental_process)} result and on_result callback, and
+    the same dead-letter recording for rows that still fail once split down.
+    """
+    semaphore = asyncio.BoundedSemaphore(concurrency)
+    results = {}
+    current_prompt = prompt_hash(MODEL_NAME, system_prompt)
+
+    def record(study_id, clean_code, mental_process):
+        results[study_id] = (clean_code, mental_process)
+        if on_result:
+            on_result(study_id, clean_code, mental_process)
+
+    to_pack = []
+    for study_id, transcript in records:
+        cleaned_input = transcript if precleaned else clean_raw_text(transcript)
+        if len(str(cleaned_input)) < 10:
+            record(study_id, insufficient_label, "")
+        else:
+            to_pack.append((study_id, cleaned_input))
+
+    async def worker(pack):
+        failures = {}
+        try:
+            coded = await acode_pack(client, system_prompt, pack, semaphore, coffee_reminder, code_names,
+                                     policy, cache, failures)
+        except ShutdownRequested:
+            return
+        for study_id, (clean_code, mental_process) in coded.items():
+            if dead_letter is not None:
+                record_dead_letter(dead_letter, study_id, failures.get(study_id), source,
+                                   current_prompt, dead_letter_keys)
+            record(study_id, clean_code, mental_process)
+
+    packs = pack_records(to_pack, token_budget)
+    print(f"📦 {len(to_pack)} transcripts packed into {len(packs)} calls.")
+    await asyncio.gather(*(worker(pack) for pack in packs))
+    if shutdown_requested():
+        raise ShutdownRequested("stopped before every transcript was sent")
+    return results
+
+
+def code_batch_packed(records, client, system_prompt, coffee_reminder="",
+                      concurrency=MAX_IN_FLIGHT, on_result=None, **kwargs):
+    """Blocking entry point, drop-in for async_engine.code_batch."""
+    return run_blocking(code_batch_packed_async(records, client, system_prompt, coffee_reminder,
+                                                concurrency, on_result, **kwargs))
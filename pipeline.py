@@ -0,0 +1,328 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from atomic_io import atomic_write, write_csv, write_json
+from shutdown import ShutdownRequested, graceful_shutdown, shutdown_requested
+
+# --- CONFIGURATION ---
+# One runner for the whole chain instead of separate scripts passing CSVs on
+# Drive. Stages hand each other in-memory Arrow tables. Every stage output is
+# fingerprinted by its inputs plus the stage's code/prompt files, so an edit
+# re-runs only the stages (and, for row stages, only the rows) it affects.
+PIPELINE_DIR = os.environ.get('VR_PIPELINE_DIR', '/content/drive/MyDrive/34BatchNew/pipeline')
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+CODING_CONCURRENCY = 8
+# Rows the code stage still fails after retries (see dead_letter.py for reprocessing)
+DEAD_LETTER_FILE = os.path.join(PIPELINE_DIR, 'dead_letters.jsonl')
+
+
+def fingerprint(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def file_fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def to_arrow(df):
+    """pandas -> Arrow; object columns holding mixed types (e.g. int and str IDs) become strings."""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].map(lambda v: v if v is None or isinstance(v, str) or pd.isna(v) else str(v))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _write_parquet(table, path):
+    with atomic_write(path, 'wb') as f:
+        pq.write_table(table, f)
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    fn receives one DataFrame per name in `inputs`. A whole-table stage returns
+    its output DataFrame. A row stage (row_columns set, single input) returns
+    only the columns it adds, one row per input row; rows whose `row_columns`
+    are unchanged since the last run are taken from the stage's row store
+    instead of being passed to fn.
+
+    `files` are the code/prompt/codebook files (relative to this folder) that
+    define the stage's behaviour; editing any of them invalidates its outputs.
+    `keep_row` (row stages) decides whether a computed row may be stored;
+    ERROR rows are not, so the next run retries them. `settings` are runtime
+    switches (env vars) that change the output without changing any file.
+    """
+
+    def __init__(self, name, fn, inputs, files=(), row_columns=None, keep_row=None, settings=()):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.files = list(files)
+        self.row_columns = row_columns
+        self.keep_row = keep_row
+        self.settings = list(settings)
+
+    def code_version(self):
+        files = [os.path.join(MODULE_DIR, f) for f in self.files]
+        return fingerprint(inspect.getsource(self.fn), self.row_columns, *self.settings,
+                           *(file_fingerprint(f) if os.path.exists(f) else f"missing:{f}" for f in files))
+
+
+class Pipeline:
+    def __init__(self, sources, stages, store_dir=PIPELINE_DIR):
+        self.sources = dict(sources)    # {name: CSV or Parquet path}
+        self.stages = list(stages)      # in dependency order
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(store_dir, 'manifest.json')
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _needed(self, targets):
+        """Names of the stages that `targets` depend on (all stages when targets is None)."""
+        if targets is None:
+            return [stage.name for stage in self.stages]
+        by_name = {stage.name: stage for stage in self.stages}
+        needed, stack = set(), list(targets)
+        while stack:
+            name = stack.pop()
+            if name in by_name and name not in needed:
+                needed.add(name)
+                stack.extend(by_name[name].inputs)
+        return [stage.name for stage in self.stages if stage.name in needed]
+
+    def _read_source(self, path):
+        if path.endswith('.parquet'):
+            return pq.read_table(path)
+        return to_arrow(pd.read_csv(path))
+
+    def _run_rows(self, stage, df, version):
+        """Row-incremental execution: only rows with a new (row content, code version) hash reach fn."""
+        row_fps = pd.util.hash_pandas_object(df[stage.row_columns], index=False).astype(str)
+        row_fps = (version + ':' + row_fps).tolist()
+
+        store_path = os.path.join(self.store_dir, stage.name, 'rows.parquet')
+        stored = pd.read_parquet(store_path) if os.path.exists(store_path) else pd.DataFrame(columns=['_row_fp'])
+        stored = stored.drop_duplicates('_row_fp').set_index('_row_fp')
+
+        new_mask = [fp not in stored.index for fp in row_fps]
+        new_rows = df[new_mask]
+        if len(new_rows):
+            computed = stage.fn(new_rows.reset_index(drop=True)).reset_index(drop=True)
+            if len(computed) != len(new_rows):
+                raise ValueError(f"Row stage '{stage.name}' returned {len(computed)} rows for {len(new_rows)}")
+            computed.index = [fp for fp, is_new in zip(row_fps, new_mask) if is_new]
+            computed = computed[~computed.index.duplicated()]
+            keep = stage.keep_row(computed) if stage.keep_row else pd.Series(True, index=computed.index)
+            stored = pd.concat([stored[~stored.index.isin(computed.index)], computed[keep.values]])
+            lookup = pd.concat([stored, computed[~keep.values]])
+            unkept = int((~keep.values).sum())
+        else:
+            lookup, unkept = stored, 0
+
+        # Keep only this run's rows in the store so it doesn't grow forever
+        current = stored[stored.index.isin(set(row_fps))]
+        _write_parquet(to_arrow(current.rename_axis('_row_fp').reset_index()), store_path)
+
+        added = lookup.loc[row_fps].reset_index(drop=True)
+        out = df.reset_index(drop=True).drop(columns=[c for c in added.columns if c in df.columns])
+        return pd.concat([out, added], axis=1), int(sum(new_mask)), unkept
+
+    def run(self, targets=None, force=()):
+        """
+        Runs the stages `targets` need (all by default) and returns {name: pa.Table}.
+        Stages whose fingerprint is unchanged load their stored output instead.
+        """
+        manifest = self._load_manifest()
+        tables, fps = {}, {}
+        for name, path in self.sources.items():
+            fps[name] = file_fingerprint(path)
+
+        by_name = {stage.name: stage for stage in self.stages}
+        for name in self._needed(targets):
+            stage = by_name[name]
+            version = stage.code_version()
+            fp = fingerprint(stage.name, version, *(fps[i] for i in stage.inputs))
+            output_path = os.path.join(self.store_dir, stage.name, f"{fp}.parquet")
+            fps[name] = fp
+
+            if os.path.exists(output_path) and name not in force:
+                tables[name] = pq.read_table(output_path)
+                print(f"⏭️  {name}: unchanged ({fp}), {tables[name].num_rows} rows from store.")
+                continue
+            if shutdown_requested():
+                raise ShutdownRequested(f"shutting down; stage {name} not started")
+
+            for input_name in stage.inputs:
+                if input_name not in tables:
+                    tables[input_name] = self._read_source(self.sources[input_name])
+            frames = [tables[i].to_pandas() for i in stage.inputs]
+
+            start = time.time()
+            if stage.row_columns:
+                result, recomputed, unkept = self._run_rows(stage, frames[0], version)
+            else:
+                result, recomputed, unkept = stage.fn(*frames), None, 0
+            tables[name] = to_arrow(result.reset_index(drop=True))
+
+            # Stored by fingerprint; the previous output of this stage is dropped. An output
+            # with ERROR rows is not stored, so the next run retries just those rows.
+            previous = manifest.get(name, {}).get('fingerprint')
+            if not unkept:
+                _write_parquet(tables[name], output_path)
+            else:
+                # Downstream stages must not reuse this partial output once the retries succeed
+                fps[name] = fingerprint(fp, 'partial', pd.util.hash_pandas_object(result, index=False).sum())
+            if previous and previous != fp:
+                old_path = os.path.join(self.store_dir, stage.name, f"{previous}.parquet")
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+
+            manifest[name] = {'fingerprint': fp, 'rows': tables[name].num_rows, 'recomputed_rows': recomputed,
+                              'failed_rows': unkept, 'ran_at': time.strftime("%Y-%m-%d %H:%M:%S")}
+            write_json(manifest, self.manifest_path, indent=2)
+            detail = f", {recomputed} rows recomputed" if recomputed is not None else ""
+            print(f"▶️  {name}: ran in {time.time() - start:.1f}s ({fp}), {tables[name].num_rows} rows{detail}.")
+
+        return tables
+
+
+# --- STAGES OF THE TRANSCRIPT PIPELINE ---
+# Script modules are imported inside the stage functions: several of them build
+# an API client at import time, which a stage loaded from the store never needs.
+
+def clean_stage(df):
+    from preprocessing_util import clean_series
+    from compaction import compact_series, COMPACT
+    cleaned = clean_series(df['Transcript'])
+    return pd.DataFrame({'Cleaned_Transcript': compact_series(cleaned) if COMPACT else cleaned})
+
+
+def code_stage(df):
+    from async_engine import code_batch
+    from dead_letter import DeadLetterQueue
+    from preclassify import preclassify_records
+    from coding_logic_34 import client, SYSTEM_PROMPT, COFFEE_REMINDER, CODING_CONFIG, ANSWER_FORMATTER
+
+    # As in run_34k, trivial chats are coded from their raw turns without a call
+    remaining, results = preclassify_records(list(zip(df['StudyID'], df['Transcript'])))
+    cleaned = dict(zip(df['StudyID'], df['Cleaned_Transcript']))
+
+    def record(study_id, clean_code, mental_process):
+        results[study_id] = (clean_code, mental_process)
+
+    try:
+        code_batch([(study_id, cleaned[study_id]) for study_id, _ in remaining], client,
+                   SYSTEM_PROMPT, COFFEE_REMINDER, concurrency=CODING_CONCURRENCY, on_result=record,
+                   dead_letter=DeadLetterQueue(DEAD_LETTER_FILE), source='pipeline:code',
+                   base_config=CODING_CONFIG, answer_formatter=ANSWER_FORMATTER, precleaned=True)
+    except ShutdownRequested:
+        # Rows that finished are returned (and stored); unsent ones are ERROR rows, retried next run
+        print("🛑 code: shutting down, unsent rows are left for the next run.")
+    unsent = ("ERROR | Not sent before shutdown", "")
+    return pd.DataFrame([results.get(study_id, unsent) for study_id in df['StudyID']],
+                        columns=['New_AI_Final_Code', 'AI_Thoughts'])
+
+
+def split_normalize_stage(df):
+    from split_normalize_batch import split_normalize_frame
+    return split_normalize_frame(df)
+
+
+def combine_stage(df):
+    from combine_files import combine_frames
+    return combine_frames([df])
+
+
+def audit_stage(df):
+    from tiered_audit import consensus_audit_frame
+    # consensus_audit_frame splits the raw 'Code | [Reasoning: ...]' answer itself
+    df = df.drop(columns=['New_AI_Final_Code']).assign(Applied_Code_Reasoning=df['New_AI_Final_Code'])
+    return consensus_audit_frame(df)
+
+
+def edge_case_stage(df):
+    from edge_case import triage_frame
+    return triage_frame(df)
+
+
+def verify_stage(df):
+    from verify_code import audit_record
+    return pd.DataFrame([audit_record(row) for _, row in df.iterrows()], columns=[
+        'Applied Code', 'Reasoning for Applied Code', 'Recommended Code Changes',
+        'Reason for Code Changes', 'Final Code'])
+
+
+def _not_error(column):
+    return lambda out: ~out[column].astype(str).str.startswith('ERROR')
+
+
+def build_pipeline(input_file, store_dir=PIPELINE_DIR):
+    from preprocessing_util import redaction_version
+    from compaction import COMPACT
+    stages = [
+        Stage('clean', clean_stage, ['transcripts'],
+              files=['preprocessing_util.py', 'redaction.py', 'compaction.py'],
+              settings=[redaction_version(), f'compact={COMPACT}'],
+              row_columns=['Transcript']),
+        Stage('code', code_stage, ['clean'],
+              files=['coding_logic_34.py', 'preprocessing_util.py', 'code_schema.py', 'codebook2.json',
+                     'preclassify.py', 'turn_taking.py', 'async_engine.py', 'gemini_gateway.py',
+                     'prompt_cache.py'],
+              row_columns=['StudyID', 'Transcript', 'Cleaned_Transcript'], keep_row=_not_error('New_AI_Final_Code')),
+        Stage('split_normalize', split_normalize_stage, ['code'], files=['split_normalize_batch.py'],
+              row_columns=['New_AI_Final_Code']),
+        Stage('combine', combine_stage, ['split_normalize'], files=['combine_files.py']),
+        Stage('audit', audit_stage, ['combine'],
+              files=['tiered_audit.py', 'code_matcher.py', 'codebook2.json', 'codebook.json']),
+        Stage('edge_case', edge_case_stage, ['audit'], files=['edge_case.py']),
+        Stage('verify', verify_stage, ['audit'], files=['verify_code.py', 'codebook_cluster.json'],
+              row_columns=['StudyID', 'Transcript', 'New_AI_Final_Code', 'New_AI_Reasoning', 'AI_Thoughts'],
+              keep_row=_not_error('Final Code')),
+    ]
+    return Pipeline({'transcripts': input_file}, stages, store_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the transcript pipeline incrementally.")
+    parser.add_argument('input', help="Master transcript CSV (or Parquet).")
+    parser.add_argument('--targets', nargs='+', help="Stages to bring up to date (default: all).")
+    parser.add_argument('--force', nargs='+', default=(), help="Stages to re-run even if unchanged.")
+    parser.add_argument('--store', default=PIPELINE_DIR)
+    parser.add_argument('--export', help="Folder to write each target's output as CSV.")
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args.input, args.store)
+    try:
+        # SIGTERM (preemption) or a stop drains in-flight requests; the stage keeps what finished
+        with graceful_shutdown():
+            tables = pipeline.run(args.targets, args.force)
+    except (KeyboardInterrupt, ShutdownRequested):
+        print("\n🛑 Stopped early. Finished rows are in the stage stores; the rest run on the next run.")
+        raise SystemExit(1)
+    if args.export:
+        os.makedirs(args.export, exist_ok=True)
+        for name in args.targets or [stage.name for stage in pipeline.stages]:
+            write_csv(tables[name].to_pandas(), os.path.join(args.export, f"{name}.csv"), index=False)
+        print(f"📁 Exported {len(args.targets or pipeline.stages)} stage outputs to {args.export}")
@@ -0,0 +1,134 @@
+import argparse
+import re
+import pandas as pd
+from atomic_io import write_csv
+from compaction import compact_text
+from preprocessing_util import clean_raw_text
+from turn_taking import parse_turns
+
+# --- CONFIGURATION ---
+# Chats the model would only ever code as 'Abandoned Chat' or 'System Test'
+# are coded here, before any API call, from the speaker turns of the raw
+# transcript. The rules are deliberately narrow: anything they don't fully
+# explain (a question, a link, a name, a librarian message that is more than
+# a greeting) goes to the model as before. Answers use the
+# 'Code | [Reasoning: ...]' format and the thoughts column names the rule.
+ABANDONED = 'Abandoned Chat'
+SYSTEM_TEST = 'System Test'
+
+# Whole-turn greetings, thanks and chat-platform filler; a turn made only of these carries no intent
+PLEASANTRY = (r"hi|hello|hey|hiya|good (?:morning|afternoon|evening)|thanks?(?: you)?(?: so much)?|thx|ok(?:ay)?|"
+              r"bye|goodbye|you'?re welcome|no problem|take care|have a (?:good|great|nice) (?:day|one|night)|"
+              r"are you (?:still )?there|(?:how|what) (?:can|may) (?:i|we) (?:help|assist)(?: you)?(?: with)?(?: today)?|"
+              r"this is ua")
+TEST = r"(?:this is )?(?:just )?(?:a )?(?:test(?:ing)?|training chat|system test)(?: chat| message| only)?"
+_FILLER = r"[\s,.!?:;()\-]*"
+PLEASANTRY_TURN = re.compile(rf"{_FILLER}(?:(?:{PLEASANTRY}){_FILLER})*", re.IGNORECASE)
+TEST_TURN = re.compile(rf"{_FILLER}(?:(?:{PLEASANTRY}|{TEST}){_FILLER})*", re.IGNORECASE)
+HAS_TEST = re.compile(rf"\b(?:{TEST})\b", re.IGNORECASE)
+
+
+def _answer(code, reason, rule):
+    return f"{code} | [Reasoning: {reason} (pre-classifier rule: {rule})]", f"preclassified:{rule}"
+
+
+def _only(pattern, texts):
+    return all(pattern.fullmatch(text) for text in texts)
+
+
+def classify(transcript):
+    """
+    (clean_code, mental_process) for a chat the rules can code locally, else None.
+    `transcript` is the raw text; turns are taken from turn_taking.parse_turns.
+    """
+    turns = parse_turns(transcript)
+    if not turns:
+        # Not in the timestamped turn format: only a bare test message is coded here
+        text = compact_text(clean_raw_text(transcript))
+        if text and HAS_TEST.search(text) and TEST_TURN.fullmatch(text):
+            return _answer(SYSTEM_TEST, "The whole chat is a test message.", 'test_message')
+        return None
+
+    librarian = [compact_text(turn['text']) for turn in turns if turn['speaker'] == 'Librarian']
+    patron = [compact_text(turn['text']) for turn in turns if turn['speaker'] == 'Patron']
+    patron = [text for text in patron if text]
+
+    if not patron:
+        # A librarian who posts a link or discusses a policy makes the chat Active (prompt rule)
+        if not _only(PLEASANTRY_TURN, librarian):
+            return None
+        return _answer(ABANDONED, "No patron message after the librarian greeting.", 'no_patron_turn')
+
+    if _only(TEST_TURN, patron) and any(HAS_TEST.search(text) for text in patron) \
+            and _only(PLEASANTRY_TURN, librarian):
+        return _answer(SYSTEM_TEST, "The patron only sent a test message.", 'test_message')
+
+    if _only(PLEASANTRY_TURN, patron) and _only(PLEASANTRY_TURN, librarian):
+        return _answer(ABANDONED, "Only greetings or thanks were exchanged; no library inquiry.",
+                       'pleasantries_only')
+    return None
+
+
+def preclassify_records(records):
+    """
+    Splits raw (StudyID, transcript) pairs into the ones still to send and
+    {StudyID: (clean_code, mental_process)} for the ones coded locally.
+    """
+    remaining, coded = [], {}
+    for study_id, transcript in records:
+        answer = classify(transcript)
+        if answer:
+            coded[study_id] = answer
+        else:
+            remaining.append((study_id, transcript))
+    if coded:
+        print(f"⚡ Pre-classifier: {len(coded)} of {len(coded) + len(remaining)} chats coded locally.")
+    return remaining, coded
+
+
+def _codes(answer):
+    """Set of code names in a 'Code, Code | [Reasoning: ...]' answer."""
+    return {code.strip() for code in str(answer).split('|')[0].split(',') if code.strip()}
+
+
+def agreement_report(df, code_column='New_AI_Final_Code', transcript_column='Transcript'):
+    """
+    Runs the rules over already-coded rows. Returns (per-rule summary, rows the
+    rules code, with the prior AI code and whether the two agree).
+    """
+    rows = []
+    for study_id, transcript, prior in zip(df['StudyID'], df[transcript_column], df[code_column]):
+        answer = classify(transcript)
+        if answer and not str(prior).startswith('ERROR'):
+            rows.append({'StudyID': study_id, 'Rule': answer[1].split(':', 1)[1],
+                         'Rule_Code': answer[0], 'Prior_Code': prior,
+                         'Agrees': _codes(answer[0]) == _codes(prior)})
+    hits = pd.DataFrame(rows, columns=['StudyID', 'Rule', 'Rule_Code', 'Prior_Code', 'Agrees'])
+    summary = hits.groupby('Rule')['Agrees'].agg(hits='size', agree='sum').reset_index()
+    summary['agree_pct'] = (summary['agree'] / summary['hits'] * 100).round(1)
+    return summary, hits
+
+
+def print_agreement_report(df, summary, hits):
+    print("\nPRE-CLASSIFIER REPORT\n" + "=" * 30)
+    print(f"rows: {len(df):,} | coded by rules: {len(hits):,} ({len(hits) / max(len(df), 1):.1%})")
+    if len(hits):
+        print(f"agreement with prior AI codes: {int(hits['Agrees'].sum()):,}/{len(hits):,} "
+              f"({hits['Agrees'].mean():.1%})")
+        print(summary.to_string(index=False))
+    print("=" * 30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hit rate and agreement of the pre-classifier on coded output.")
+    parser.add_argument('input', help="Coded CSV with StudyID, Transcript and an AI code column.")
+    parser.add_argument('--code-column', default='New_AI_Final_Code')
+    parser.add_argument('--disagreements', help="Write the rows where rule and prior code differ to this CSV.")
+    args = parser.parse_args()
+
+    coded = pd.read_csv(args.input)
+    summary, hits = agreement_report(coded, args.code_column)
+    print_agreement_report(coded, summary, hits)
+    if args.disagreements:
+        write_csv(hits[~hits['Agrees']], args.disagreements, index=False)
+        print(f"📄 Disagreements: {args.disagreements}")
@@ -1,5 +1,14 @@
+import collections
+import functools
+import multiprocessing
+import os
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from redaction import REDACTOR
 
 # --- CONFIGURATION: GEMINI 3 FLASH PREVIEW ---
 # Updated to the specific Gemini 3 Flash model name
@@ -15,11 +24,42 @@ AI_CONFIG = {
     }
 }
 
+# --- QUOTA: requests/minute and input tokens/minute per model ---
+# Match these to the project's tier on the AI Studio quota page.
+# Shared by every caller through rate_limiter.get_limiter().
+RATE_LIMITS = {
+    MODEL_NAME: {"rpm": 1000, "tpm": 1_000_000},
+    "gemini-2.5-flash": {"rpm": 1000, "tpm": 1_000_000},
+    "gemini-2.0-flash-lite": {"rpm": 4000, "tpm": 4_000_000},
+    "default": {"rpm": 60, "tpm": 250_000},
+}
+
+# --- PRICING: USD per 1M tokens (thought tokens bill as output) ---
+# From the Gemini API pricing page; used by telemetry.py for cost per transcript.
+PRICING = {
+    MODEL_NAME: {"input": 0.50, "cached_input": 0.05, "output": 3.00},
+    "gemini-2.5-flash": {"input": 0.30, "cached_input": 0.03, "output": 2.50},
+    "gemini-2.0-flash-lite": {"input": 0.075, "cached_input": 0.01875, "output": 0.30},
+    "default": {"input": 0.50, "cached_input": 0.05, "output": 3.00},
+}
+
 # Pre-compiling regex for performance
 TIME_PATTERN = re.compile(r'\d{2}:\d{2}:\d{2}')
 TAG_PATTERN = re.compile(r'<DATE_TIME>')
 STAFF_ID_PATTERN = re.compile(r'[a-f0-9]{32,}')
 
+# --- PII REDACTION ---
+# Set VR_REDACT_PII=1 to replace emails, phone/card/student numbers, tokened
+# URLs and any VR_REDACTION_LITERALS terms with placeholders (redaction.py) as
+# the last cleaning step. Read from the environment so pool workers agree.
+REDACT_PII = os.environ.get('VR_REDACT_PII', '') not in ('', '0', 'false', 'False')
+
+
+def redaction_version():
+    """Part of every cleaned-text cache key: cleaned text differs with redaction on or off."""
+    return REDACTOR.fingerprint() if REDACT_PII else 'off'
+
+
 def clean_raw_text(text):
     """
     Cleans raw transcript text while preserving 'Semantic Anchors'.
@@ -37,5 +77,116 @@ def clean_raw_text(text):
     # 4. NEW: Normalize whitespace to reduce token count
     # This keeps the context but makes the prompt more efficient
     text = re.sub(r'\s+', ' ', text)
-    
-    return text.strip()
+    text = text.strip()
+
+    # 5. Optional PII redaction (placeholders never add or need whitespace)
+    if REDACT_PII:
+        text = REDACTOR.redact(text)
+    return text
+
+
+# --- BATCH CLEANING ---
+# clean_raw_text() on a whole column at once: the same four rules, in the same
+# order, as Arrow (RE2) kernels over the full array instead of a Python call and
+# four regex passes per row. They stay four ordered passes on purpose: deleting a
+# timestamp can join the whitespace around it, which one combined alternation
+# would collapse differently. RE2's \d and \s are ASCII-only, so both are
+# spelled out to match Python's Unicode classes exactly.
+@functools.lru_cache(maxsize=None)
+def arrow_cleaning_rules():
+    """(RE2 pattern, replacement) pairs mirroring clean_raw_text, in order. Built once, on first use."""
+    whitespace = [f"\\x{{{ord(c):x}}}" for c in map(chr, range(sys.maxunicode + 1)) if c.isspace()]
+    other_whitespace = "".join(w for w in whitespace if w != "\\x{20}")
+    return (
+        (r'\p{Nd}{2}:\p{Nd}{2}:\p{Nd}{2}', ''),     # TIME_PATTERN
+        (r'<DATE_TIME>', ''),                        # TAG_PATTERN
+        (r'[a-f0-9]{32,}', 'STAFF'),                 # STAFF_ID_PATTERN
+        # \s+ -> ' ', but skipping the lone spaces that are already right (most of them)
+        (f'[{"".join(whitespace)}]{{2,}}|[{other_whitespace}]', ' '),
+    )
+
+
+def clean_text_array(values):
+    """
+    clean_raw_text() for a pandas Series, Arrow Array or ChunkedArray; returns
+    the same type (a Series keeps its index). Output is identical row for row,
+    including "" for missing and non-string values.
+    """
+    index = None
+    if isinstance(values, pd.Series):
+        index = values.index
+        if isinstance(values.dtype, pd.StringDtype):
+            # Already string-typed (Arrow-backed in recent pandas): no per-row Python objects
+            values = pa.array(values, from_pandas=True).cast(pa.large_string())
+        else:
+            # Non-strings (NaN, numbers) clean to "" like clean_raw_text; null them first
+            values = pa.array(values.where(values.map(type) == str, None).to_numpy(dtype=object),
+                              type=pa.large_string(), from_pandas=True)
+    elif not pa.types.is_string(values.type) and not pa.types.is_large_string(values.type):
+        values = pa.nulls(len(values), pa.large_string())
+
+    for pattern, replacement in arrow_cleaning_rules():
+        values = pc.replace_substring_regex(values, pattern=pattern, replacement=replacement)
+    # After normalization every whitespace run is a single ' ', so that is all strip() removes
+    values = pc.fill_null(pc.utf8_trim(values, characters=' '), '')
+    if REDACT_PII:
+        # No RE2 equivalent for the lookbehinds; one Python pass per row over the cleaned text
+        values = pa.array([REDACTOR.redact(text) for text in values.to_pylist()], type=pa.large_string())
+
+    if index is not None:
+        cleaned = values.to_pandas()   # same string dtype Series.map(clean_raw_text) gives
+        cleaned.index = index
+        return cleaned
+    return values
+
+
+def clean_series(series, processes=1, chunk_rows=50_000):
+    """
+    clean_text_array() over a whole column, optionally split into chunks
+    across `processes` worker processes (worth it from a few hundred
+    thousand rows; below that the pickling costs more than it saves).
+    """
+    if processes <= 1 or len(series) <= chunk_rows:
+        return clean_text_array(series)
+
+    chunks = [series.iloc[start:start + chunk_rows] for start in range(0, len(series), chunk_rows)]
+    # spawn, not fork: a forked child would inherit Arrow's thread pool and the parent's whole heap
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        results = list(pool.map(_clean_chunk, chunks))
+    # Redaction hits were counted in the workers; add them to this process's report
+    for _, counts in results:
+        REDACTOR.counts.update(counts)
+    return pd.concat([cleaned for cleaned, _ in results])
+
+
+def _clean_chunk(chunk):
+    """clean_series worker: (cleaned chunk, redaction hits in it)."""
+    REDACTOR.counts.clear()
+    return clean_text_array(chunk), collections.Counter(REDACTOR.counts)
+
+def parse_model_response(response):
+    """
+    Splits a Gemini 'Thinking' response into (clean_code, mental_process).
+    Shared by the serial coders and the async engine so every path returns
+    the same contract.
+    """
+    thoughts = []
+    final_answer_parts = []
+
+    if response.candidates and response.candidates[0].content.parts:
+        for part in response.candidates[0].content.parts:
+            if hasattr(part, 'thought') and part.thought:
+                thoughts.append(part.text)
+            elif hasattr(part, 'text') and part.text:
+                final_answer_parts.append(part.text)
+
+    clean_code = " ".join(final_answer_parts).replace("**", "").replace("\n", " ").strip()
+    mental_process = " ".join(thoughts).replace("\n", " ").strip()
+
+    # Fallback if thoughts were embedded in text (v1beta quirk)
+    if not mental_process and "THOUGHT:" in clean_code:
+        parts = clean_code.split("THOUGHT:", 1)
+        clean_code = parts[0].strip()
+        mental_process = parts[1].strip() if len(parts) > 1 else ""
+
+    return clean_code, mental_process
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from google.genai import types
+from preprocessing_util import AI_CONFIG, MODEL_NAME
+from atomic_io import write_json
+from retry_policy import RetryPolicy, RETRYABLE, classify_error
+
+# --- CONFIGURATION ---
+# Upload the static SYSTEM_PROMPT (rules + few-shots + codebook JSON) once as
+# cached content and reference it from every request instead of resending it.
+USE_CONTEXT_CACHE = True
+CACHE_TTL_SECONDS = 3600
+REFRESH_MARGIN_SECONDS = 300    # extend the TTL when less than this is left
+DISPLAY_PREFIX = 'vr-prompt-'
+
+# Small local registry so reruns (and other processes) reuse a live cache.
+# Its entries are checked with caches.get before the first use in a process.
+REGISTRY_PATH = os.environ.get('VR_PROMPT_CACHE_REGISTRY', '/tmp/vr_prompt_cache.json')
+
+# caches.create/update get their own short retry policy (and breaker). A transient
+# failure that outlasts it sends only that request inline; anything else (model
+# without caching support, prompt below the minimum size) turns caching off for the run.
+CACHE_CALL_POLICY = RetryPolicy(max_attempts=3, base_delay=2.0, max_delay=20.0)
+
+_lock = threading.Lock()
+_cache_unavailable = False
+_live = {}
+
+
+def prompt_hash(model, system_prompt):
+    """Fingerprint of the cached prefix; changes whenever the prompt or codebook changes."""
+    return hashlib.sha256(f"{model}\n{system_prompt}".encode('utf-8')).hexdigest()[:16]
+
+
+def _load_registry():
+    if os.path.exists(REGISTRY_PATH):
+        with open(REGISTRY_PATH) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_registry(registry):
+    write_json(registry, REGISTRY_PATH, indent=2)
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def get_cached_prompt(client, system_prompt, model=MODEL_NAME):
+    """
+    Returns the name of a live cached-content entry holding `system_prompt`.
+
+    Creates it on first use and extends its TTL when it is close to expiring.
+    A changed prompt or codebook hashes to a new key, so it gets a fresh cache;
+    the old one simply expires after its TTL.
+    """
+    key = prompt_hash(model, system_prompt)
+
+    with _lock:
+        entry = _live.get(key)
+        if entry is None:
+            entry = _load_registry().get(key)
+            if entry and not _registry_entry_valid(client, key, entry):
+                _forget(key)
+                entry = None
+
+        if entry:
+            expires = datetime.fromisoformat(entry['expire_time'])
+            if expires - _now() > timedelta(seconds=REFRESH_MARGIN_SECONDS):
+                _live[key] = entry
+                return entry['name']
+            if expires > _now():
+                CACHE_CALL_POLICY.call(lambda: client.caches.update(
+                    name=entry['name'],
+                    config=types.UpdateCachedContentConfig(ttl=f"{CACHE_TTL_SECONDS}s")
+                ))
+                entry['expire_time'] = (_now() + timedelta(seconds=CACHE_TTL_SECONDS)).isoformat()
+                _remember(key, entry)
+                return entry['name']
+
+        cache = CACHE_CALL_POLICY.call(lambda: client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_prompt,
+                display_name=f"{DISPLAY_PREFIX}{key}",
+                ttl=f"{CACHE_TTL_SECONDS}s",
+            )
+        ))
+        _remember(key, {
+            'name': cache.name,
+            'model': model,
+            'expire_time': (_now() + timedelta(seconds=CACHE_TTL_SECONDS)).isoformat(),
+        })
+        print(f"🗄️ Cached system prompt as {cache.name} (hash {key})")
+        return cache.name
+
+
+def _registry_entry_valid(client, key, entry):
+    """
+    Whether a registry entry (shared through /tmp, possibly written by another
+    project or key) still names a live cache holding this prompt.
+    """
+    try:
+        cache = client.caches.get(name=entry['name'])
+    except Exception as e:
+        if classify_error(e) in RETRYABLE:
+            return True   # can't tell right now; a stale entry is caught on first use instead
+        return False
+    display_name = getattr(cache, 'display_name', None)
+    return display_name in (None, f"{DISPLAY_PREFIX}{key}") and \
+        str(getattr(cache, 'model', '') or entry['model']).endswith(entry['model'])
+
+
+def _forget(key):
+    _live.pop(key, None)
+    registry = _load_registry()
+    if registry.pop(key, None) is not None:
+        _save_registry(registry)
+
+
+def is_stale_cache_error(exc, config):
+    """True when a request failed because its cached_content is gone or not ours to use."""
+    if not (isinstance(config, dict) and config.get('cached_content')):
+        return False
+    if classify_error(exc) not in ('client', 'auth'):
+        return False
+    message = str(exc).lower()
+    return getattr(exc, 'code', None) in (403, 404) or 'cached content' in message or 'cachedcontent' in message
+
+
+def inline_after_stale_cache(system_prompt, contents, config):
+    """
+    Drops the failed cache from the registry (the next request creates a fresh
+    one) and returns this request's (contents, config) with the prompt inline.
+    """
+    name = config['cached_content']
+    with _lock:
+        for key, entry in list(_live.items()) + list(_load_registry().items()):
+            if entry['name'] == name:
+                _forget(key)
+    print(f"⚠️ Cached prompt {name} is gone or not accessible; resending inline and recreating it.")
+    return f"{system_prompt}\n\n{contents}", {k: v for k, v in config.items() if k != 'cached_content'}
+
+
+def prompt_hash_for_cache(cache_name):
+    """Maps a cached_content name back to the prompt hash it was created for."""
+    for key, entry in list(_live.items()) + list(_load_registry().items()):
+        if entry['name'] == cache_name:
+            return key
+    return cache_name
+
+
+def _remember(key, entry):
+    """Records an entry in memory and in the registry, dropping expired ones."""
+    _live[key] = entry
+    registry = _load_registry()
+    registry[key] = entry
+    registry = {k: v for k, v in registry.items()
+                if datetime.fromisoformat(v['expire_time']) > _now()}
+    _save_registry(registry)
+
+
+def prepare_contents(client, system_prompt, user_text, model=MODEL_NAME, base_config=AI_CONFIG):
+    """
+    Builds (contents, config) for any request that follows the system prompt.
+    With caching on, the prompt is referenced through cached_content and only
+    `user_text` is sent. If the cache can't be created the full prompt is sent
+    inline: for this request only after a transient error, for the rest of the
+    run when the model doesn't support it.
+    """
+    global _cache_unavailable
+
+    if USE_CONTEXT_CACHE and not _cache_unavailable:
+        try:
+            cache_name = get_cached_prompt(client, system_prompt, model)
+            return user_text, dict(base_config, cached_content=cache_name)
+        except Exception as e:
+            if classify_error(e) in RETRYABLE:
+                print(f"⚠️ Context cache busy, sending this prompt inline: {str(e)[:80]}")
+            else:
+                _cache_unavailable = True
+                print(f"⚠️ Context cache unavailable, sending prompt inline: {str(e)[:80]}")
+
+    return f"{system_prompt}\n\n{user_text}", base_config
+
+
+def prepare_request(client, system_prompt, cleaned_input, coffee_reminder="",
+                    model=MODEL_NAME, base_config=AI_CONFIG):
+    """(contents, config) for coding a single cleaned transcript."""
+    return prepare_contents(client, system_prompt, f"Transcript: {cleaned_input}{coffee_reminder}",
+                            model, base_config)
@@ -0,0 +1,127 @@
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+from preprocessing_util import RATE_LIMITS
+
+# --- CONFIGURATION ---
+# SQLite file holding the shared bucket state. Every process that points at the
+# same file draws from the same RPM/TPM budget. Keep it on local disk: SQLite
+# locking is not reliable on the Drive FUSE mount.
+STATE_PATH = os.environ.get('VR_RATE_LIMIT_DB', '/tmp/vr_rate_limits.sqlite')
+
+# Fraction of the published quota we actually spend, so concurrent workers stay
+# just under the limit instead of right on it.
+HEADROOM = 0.9
+
+# Rough chars-per-token ratio for English chat text (used before the call, when
+# we have no usage_metadata yet).
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Cheap pre-call token estimate for a prompt string."""
+    if not text:
+        return 0
+    return math.ceil(len(str(text)) / CHARS_PER_TOKEN)
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter metering requests/minute and tokens/minute for one model.
+
+    Both buckets live in a SQLite table so that threads, asyncio tasks and
+    separate worker processes share one budget. Each acquire refills the buckets
+    from elapsed time and deducts atomically inside a write transaction.
+    """
+
+    def __init__(self, model, rpm, tpm, state_path=STATE_PATH, headroom=HEADROOM):
+        self.model = model
+        self.rpm = max(1.0, rpm * headroom)
+        self.tpm = max(1.0, tpm * headroom)
+        self.state_path = state_path
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.state_path, timeout=30)
+
+    def _try_acquire(self, tokens):
+        """Deducts one request and `tokens` if both fit. Returns seconds to wait (0 = granted)."""
+        # A single prompt bigger than the whole TPM bucket could never fit; cap it.
+        tokens = min(tokens, self.tpm)
+        now = time.time()
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                levels = {}
+                for name, capacity, cost in ((f"{self.model}:rpm", self.rpm, 1),
+                                             (f"{self.model}:tpm", self.tpm, tokens)):
+                    row = conn.execute(
+                        "SELECT tokens, updated FROM buckets WHERE name = ?", (name,)
+                    ).fetchone()
+                    level = capacity if row is None else row[0] + (now - row[1]) * capacity / 60.0
+                    levels[name] = (min(capacity, level), capacity, cost)
+
+                wait = 0.0
+                for level, capacity, cost in levels.values():
+                    if level < cost:
+                        wait = max(wait, (cost - level) * 60.0 / capacity)
+
+                if wait == 0.0:
+                    for name, (level, capacity, cost) in levels.items():
+                        conn.execute(
+                            "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                            (name, level - cost, now)
+                        )
+                conn.execute("COMMIT")
+                return wait
+            except Exception:
+                # BEGIN IMMEDIATE itself may have failed (locked DB); don't mask that error
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+    def acquire(self, tokens=0):
+        """Blocks the calling thread until the request fits under both quotas."""
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """
+        Asyncio twin of acquire(): yields to the event loop while waiting. The
+        SQLite transaction runs in a worker thread, so a busy lock held by
+        another process never stalls the loop.
+        """
+        while True:
+            wait = await asyncio.to_thread(self._try_acquire, tokens)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(wait)
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(model):
+    """Returns the shared limiter for `model`, using RATE_LIMITS (or its 'default' entry)."""
+    with _LIMITERS_LOCK:
+        if model not in _LIMITERS:
+            limits = RATE_LIMITS.get(model, RATE_LIMITS['default'])
+            _LIMITERS[model] = RateLimiter(model, limits['rpm'], limits['tpm'])
+        return _LIMITERS[model]
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter
+
+# --- CONFIGURATION ---
+# PII redaction after clean_raw_text: the patterns below and any literal lists
+# are compiled into a single alternation, so a transcript is scanned once
+# however many kinds of PII we look for, and each kind counts its own hits.
+#
+# Written for the speed of Python's `re`: every pattern starts by consuming a
+# character class (its boundary lookbehind comes after that first character),
+# which lets the engine reject an alternative at a position with one test.
+# Patterns with a TRIGGER substring (EMAIL needs '@') are only compiled into
+# the alternation for rows that contain it. Literal lists are compiled from a
+# character trie, so only prefixes that can still match are followed.
+#
+# Order matters: the first pattern that matches at a position wins (a URL can
+# contain an email address or a long number). Use non-capturing groups only.
+#
+# A number ends at sentence punctuation ("ID 23456789." or "23456789-"), but
+# not where '.', '/' or '-' carries on into more digits (dates, ranges, decimals).
+_NUMBER_END = r'(?!\w|[./-]\d)'
+# YYYYMMDD from 1900-2099, as the 7 digits after a leading '1' or '2' already consumed
+_DATE_TAIL = r'(?:(?<=1)9|(?<=2)0)\d\d(?:0[1-9]|1[0-2])(?:0[1-9]|[12]\d|3[01])'
+
+REDACTION_PATTERNS = {
+    # URLs carrying credentials or session state in the query string
+    'URL_TOKEN': r'https?://[^\s<>"]*?[?&](?:access_token|token|auth|api_?key|key|sid|session(?:id)?|ticket|'
+                 r'code|sig(?:nature)?|password|pw)=[^\s<>"]*',
+    'EMAIL': r'[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}',
+    # Library barcodes (14 digits) and payment cards; ISBN-13s (978/979...) are kept
+    'CARD_NUMBER': r'\d(?<![\w-].)(?:(?!(?<=9)7[89]\d{10}' + _NUMBER_END + r')\d{12,15}|\d{3}(?:[ -]\d{4}){3})'
+                   + _NUMBER_END,
+    # 520-621-3021, (520) 621-3021, +1 520.621.3021, 1-520-621-3021, and a bare NANP 5206213021
+    'PHONE': r'[+(\d](?<![\w+].)(?:(?:(?<=\+)1[ .-]?(?:\(\d{3}\) ?|\d{3}[ .-])|(?<=\()\d{3}\) ?'
+             r'|(?<=1)[ .-](?:\(\d{3}\) ?|\d{3}[ .-])|(?<=\d)\d\d[ .-])\d{3}[ .-]\d{4}'
+             r'|(?<=[2-9])\d\d[2-9]\d{6})' + _NUMBER_END,
+    # Bare 8-digit student IDs, except ones that read as a YYYYMMDD date; adjust to the
+    # institution's ID format
+    'STUDENT_ID': r'\d(?<![\w./-].)(?!' + _DATE_TAIL + _NUMBER_END + r')\d{7}' + _NUMBER_END,
+}
+TRIGGERS = {'URL_TOKEN': '://', 'EMAIL': '@'}
+# Fixed cases for the patterns above; `python redaction.py` checks them
+EXAMPLES = [
+    ("mail jo.smith@arizona.edu today", "mail <EMAIL> today"),
+    ("My student ID is 23456789.", "My student ID is <STUDENT_ID>."),
+    ("id 23456789- thanks", "id <STUDENT_ID>- thanks"),
+    ("date 20240101 and 2024-01-15", "date 20240101 and 2024-01-15"),
+    ("my phone 5206213021", "my phone <PHONE>"),
+    ("call (520) 621-3021, or +1 520.621.3021.", "call <PHONE>, or <PHONE>."),
+    ("card 4111 1111 1111 1111 or 41111111111111", "card <CARD_NUMBER> or <CARD_NUMBER>"),
+    ("ISBN 9780143127741, call no 12345678901", "ISBN 9780143127741, call no 12345678901"),
+    ("range 23456789-23456790", "range 23456789-23456790"),
+    ("see https://x.edu/a?token=abc123 now", "see <URL> now"),
+]
+PLACEHOLDERS = {
+    'URL_TOKEN': '<URL>',
+    'EMAIL': '<EMAIL>',
+    'CARD_NUMBER': '<CARD_NUMBER>',
+    'PHONE': '<PHONE>',
+    'STUDENT_ID': '<STUDENT_ID>',
+}
+
+# Optional literal lists, {"PERSON": ["Jane Doe", ...]}, matched case-insensitively
+# on whole words and replaced by <PERSON>. An env var so spawned pool workers see it too.
+LITERALS_FILE = os.environ.get('VR_REDACTION_LITERALS')
+
+
+def _class_escape(chars):
+    return ''.join('\\' + c if c in '\\]^-[' else c for c in chars)
+
+
+def trie_pattern(terms):
+    """
+    Whole-word, case-insensitive regex for a literal list, built from a
+    character trie (longest term first). It starts with a class of the first
+    characters, then dispatches on that character with a lookbehind.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term.lower():
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        group = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{group})?" if '' in node else group
+
+    if not trie:
+        return None
+    first = _class_escape(''.join(sorted({c for char in trie for c in (char, char.upper())})))
+    dispatch = '|'.join(f"(?<={re.escape(char)}){build(child)}" for char, child in sorted(trie.items()))
+    return f"[{first}](?<!\\w.)(?i:{dispatch})(?!\\w)"
+
+
+def load_literals(path=LITERALS_FILE):
+    if not path:
+        return {}
+    with open(path, 'r') as f:
+        return {label: [term for term in terms if term.strip()] for label, terms in json.load(f).items()}
+
+
+class RedactionEngine:
+    """Single-pass redaction with a hit counter per pattern / literal list."""
+
+    def __init__(self, patterns=REDACTION_PATTERNS, literals=None, placeholders=PLACEHOLDERS, triggers=TRIGGERS):
+        self.patterns, self.placeholders = {}, {}
+        for name, pattern in patterns.items():
+            self.patterns[name] = pattern
+            self.placeholders[name] = placeholders.get(name, f"<{name}>")
+        for label, terms in (literals or {}).items():
+            pattern = trie_pattern(terms)
+            if pattern:
+                self.patterns[f"{label}_LIST"] = pattern
+                self.placeholders[f"{label}_LIST"] = f"<{label}>"
+        self.triggers = {name: trigger for name, trigger in triggers.items() if name in self.patterns}
+        self._compiled = {}
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def _regex(self, active):
+        """The alternation of every pattern whose trigger is in `active` (plus the untriggered ones)."""
+        regex = self._compiled.get(active)
+        if regex is None:
+            # An empty named group closes each alternative, so match.lastgroup names the pattern
+            # without a capturing group in front of the first character
+            branches = [f"(?:{pattern})(?P<{name}>)" for name, pattern in self.patterns.items()
+                        if name not in self.triggers or name in active]
+            regex = re.compile('|'.join(branches)) if branches else None
+            self._compiled[active] = regex
+        return regex
+
+    def fingerprint(self):
+        """Changes whenever a pattern or literal does, so cleaned caches built without it are redone."""
+        source = json.dumps([self.patterns, self.placeholders, self.triggers], sort_keys=True)
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+
+    def redact(self, text):
+        if not text:
+            return text
+        regex = self._regex(frozenset(name for name, trigger in self.triggers.items() if trigger in text))
+        if regex is None:
+            return text
+        hits = Counter()
+
+        def replace(match):
+            hits[match.lastgroup] += 1
+            return self.placeholders[match.lastgroup]
+
+        text = regex.sub(replace, text)
+        if hits:
+            with self._lock:
+                self.counts.update(hits)
+        return text
+
+    def report(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+REDACTOR = RedactionEngine(literals=load_literals())
+
+
+def print_redaction_report(engine=REDACTOR):
+    counts = engine.report()
+    print("\nREDACTION REPORT\n" + "=" * 30)
+    if not counts:
+        print("No PII redacted.")
+    for name, hits in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"{name}: {hits:,} -> {engine.placeholders[name]}")
+    print("=" * 30)
+
+
+def check_examples(engine=None):
+    """EXAMPLES that the engine (default: patterns only, no literal lists) gets wrong, as (text, got, expected)."""
+    engine = engine or RedactionEngine()
+    return [(text, engine.redact(text), expected) for text, expected in EXAMPLES
+            if engine.redact(text) != expected]
+
+
+if __name__ == "__main__":
+    wrong = check_examples()
+    for text, got, expected in wrong:
+        print(f"❌ {text!r}\n   got:      {got!r}\n   expected: {expected!r}")
+    print(f"{'✅' if not wrong else '❌'} {len(EXAMPLES) - len(wrong)}/{len(EXAMPLES)} redaction examples pass.")
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from prompt_cache import prompt_hash_for_cache
+
+# --- CONFIGURATION ---
+# Content-addressed store of finished model calls. A rerun after a crash, or
+# with an unchanged prompt, is answered from here instead of paying again.
+CACHE_PATH = os.environ.get('VR_RESPONSE_CACHE_DB',
+                            os.path.expanduser('~/.cache/vr_transcripts/responses.sqlite'))
+MAX_CACHE_BYTES = 512 * 1024 * 1024   # evict least-recently-used rows past this size
+EVICT_TO_FRACTION = 0.9               # ...down to this fraction of the cap
+EVICT_CHECK_EVERY = 200               # writes between size checks
+
+# Set VR_CACHE_BYPASS=1 (or BYPASS = True) to ignore stored answers; fresh
+# answers are still written so the cache stays current.
+BYPASS = os.environ.get('VR_CACHE_BYPASS', '') not in ('', '0', 'false', 'False')
+
+
+def _config_for_key(config):
+    if config is None:
+        return {}
+    if hasattr(config, 'model_dump'):
+        return config.model_dump(exclude_none=True, mode='json')
+    return dict(config)
+
+
+def cache_key(model, contents, config=None):
+    """Hash of model name, generation config and the fully rendered prompt."""
+    config_dict = _config_for_key(config)
+
+    # A cached_content name changes every time the cache is recreated; key on
+    # the prompt it holds instead so the entry survives a cache refresh.
+    if config_dict.get('cached_content'):
+        config_dict['cached_content'] = prompt_hash_for_cache(config_dict['cached_content'])
+
+    payload = json.dumps(
+        {'model': model, 'config': config_dict, 'contents': contents},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _split_response(response):
+    """Pulls (text, thoughts, finish_reason, usage) out of a genai response."""
+    texts, thoughts = [], []
+    finish_reason = None
+
+    if response.candidates:
+        candidate = response.candidates[0]
+        finish_reason = getattr(candidate, 'finish_reason', None)
+        for part in (candidate.content.parts or []) if candidate.content else []:
+            if getattr(part, 'thought', False):
+                thoughts.append(part.text or "")
+            elif getattr(part, 'text', None):
+                texts.append(part.text)
+
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is not None and hasattr(usage, 'model_dump'):
+        usage = usage.model_dump(exclude_none=True, mode='json')
+    elif usage is not None:
+        usage = dict(vars(usage))
+
+    return " ".join(texts), " ".join(thoughts), str(finish_reason) if finish_reason else None, usage or {}
+
+
+def cached_response(text, thoughts, finish_reason, usage):
+    """Rebuilds a response-shaped object that parse_model_response() and .text readers accept."""
+    parts = []
+    if thoughts:
+        parts.append(SimpleNamespace(text=thoughts, thought=True))
+    parts.append(SimpleNamespace(text=text, thought=False))
+
+    usage_fields = {
+        'prompt_token_count': None, 'candidates_token_count': None,
+        'thoughts_token_count': None, 'cached_content_token_count': None, 'total_token_count': None,
+    }
+    usage_fields.update(usage)
+
+    return SimpleNamespace(
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts), finish_reason=finish_reason)],
+        text=text,
+        usage_metadata=SimpleNamespace(**usage_fields),
+        from_cache=True,
+    )
+
+
+class ResponseCache:
+    """SQLite-backed response store with LRU eviction and hit/miss counters."""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evicted': 0, 'bypassed': 0}
+        self._lock = threading.Lock()
+        self._writes_since_check = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, model TEXT, text TEXT, thoughts TEXT,"
+                " finish_reason TEXT, usage TEXT, size INTEGER,"
+                " created REAL, last_access REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _bump(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def get(self, key):
+        if BYPASS:
+            self._bump('bypassed')
+            return None
+
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT text, thoughts, finish_reason, usage FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._bump('misses')
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._bump('hits')
+        text, thoughts, finish_reason, usage = row
+        return cached_response(text, thoughts, finish_reason, json.loads(usage or '{}'))
+
+    def put(self, key, model, response):
+        text, thoughts, finish_reason, usage = _split_response(response)
+        if not text:
+            return  # never cache empty / blocked answers
+
+        size = len(text.encode('utf-8')) + len(thoughts.encode('utf-8'))
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, text, thoughts, finish_reason, json.dumps(usage), size, now, now)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._bump('writes')
+        with self._lock:
+            self._writes_since_check += 1
+            check = self._writes_since_check >= EVICT_CHECK_EVERY
+            if check:
+                self._writes_since_check = 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Drops least-recently-used rows until the store is under its size cap."""
+        conn = self._connect()
+        try:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            target = self.max_bytes * EVICT_TO_FRACTION
+            removed = 0
+            for key, size in conn.execute(
+                    "SELECT key, size FROM responses ORDER BY last_access").fetchall():
+                if total <= target:
+                    break
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.stats['evicted'] += removed
+        return removed
+
+    def report(self):
+        conn = self._connect()
+        try:
+            rows, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        finally:
+            conn.close()
+
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        stats['stored_rows'] = rows
+        stats['stored_mb'] = round(total / (1024 * 1024), 2)
+        return stats
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+def print_cache_report(cache=RESPONSE_CACHE):
+    print("\nRESPONSE CACHE REPORT\n" + "=" * 30)
+    for key, value in cache.report().items():
+        print(f"{key}: {value}")
+    print("=" * 30)
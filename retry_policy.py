@@ -0,0 +1,227 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from google.genai import errors
+from shutdown import ShutdownRequested, shutdown_requested
+
+# --- CONFIGURATION ---
+MAX_ATTEMPTS = 6
+BASE_DELAY = 2.0        # seconds; doubles every attempt before jitter
+MAX_DELAY = 120.0       # cap for a single back-off sleep
+
+# Circuit breaker: pause everyone when the recent error rate spikes
+BREAKER_WINDOW = 50         # most recent calls considered
+BREAKER_MIN_CALLS = 10      # don't judge on a handful of calls
+BREAKER_ERROR_RATE = 0.5    # open when half the window failed
+BREAKER_COOLDOWN = 60.0     # seconds to pause before a probe call
+
+# Error classes that are worth another attempt. 'unknown' (an AttributeError in a
+# formatter, say) is a bug, not a blip; set RETRY_UNKNOWN to retry it anyway.
+RETRYABLE = {'rate_limit', 'server', 'timeout', 'connection'}
+RETRY_UNKNOWN = False
+
+
+def classify_error(exc):
+    """Maps an exception from the google-genai SDK (or its transport) to an error class."""
+    if isinstance(exc, errors.APIError):
+        if exc.code == 429 or exc.status == 'RESOURCE_EXHAUSTED':
+            return 'rate_limit'
+        if exc.code in (408, 504) or exc.status == 'DEADLINE_EXCEEDED':
+            return 'timeout'
+        if isinstance(exc, errors.ServerError):
+            return 'server'
+        if exc.code in (401, 403):
+            return 'auth'
+        return 'client'
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError)) or 'timeout' in type(exc).__name__.lower():
+        return 'timeout'
+    if isinstance(exc, ConnectionError) or type(exc).__name__ in ('ConnectError', 'RemoteProtocolError', 'ReadError'):
+        return 'connection'
+    return 'unknown'
+
+
+def server_retry_delay(exc):
+    """Returns the server-requested wait in seconds (RetryInfo or Retry-After), or None."""
+    details = getattr(exc, 'details', None)
+    if isinstance(details, dict):
+        for item in details.get('error', {}).get('details', []) or []:
+            if isinstance(item, dict) and 'RetryInfo' in str(item.get('@type', '')):
+                match = re.match(r'([\d.]+)s', str(item.get('retryDelay', '')))
+                if match:
+                    return float(match.group(1))
+
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        retry_after = headers.get('retry-after') or headers.get('Retry-After')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                return None
+    return None
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of recent calls. When the error rate over the window
+    passes the threshold the breaker opens and wait_time() tells callers how
+    long to pause; after the cooldown a single probe is let through.
+    """
+
+    def __init__(self, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, cooldown=BREAKER_COOLDOWN):
+        self.outcomes = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.opened_at = None
+        self.times_opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        """Seconds the caller should pause before sending (0 = go ahead)."""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            remaining = self.opened_at + self.cooldown - time.time()
+            if remaining > 0:
+                return remaining
+            if self._probing:
+                # Someone else is already probing; check back shortly
+                return 1.0
+            self._probing = True
+            return 0.0
+
+    def record(self, success):
+        with self._lock:
+            self.outcomes.append(success)
+            if self.opened_at is not None:
+                if self._probing:
+                    self._probing = False
+                    if success:
+                        self.opened_at = None
+                        self.outcomes.clear()
+                    else:
+                        self.opened_at = time.time()
+                return
+
+            if success:
+                return
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.error_rate:
+                self.opened_at = time.time()
+                self.times_opened += 1
+                print(f"🔌 Circuit breaker OPEN: {failures}/{len(self.outcomes)} recent calls failed. "
+                      f"Pausing {self.cooldown:.0f}s.")
+
+    def release_probe(self):
+        """Frees the half-open probe slot when the probe ended without an API outcome (shutdown, budget)."""
+        with self._lock:
+            self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self._probing else 'open'
+
+
+class RetryPolicy:
+    """
+    Retries a callable on transient Gemini errors with exponential back-off and
+    full jitter, honoring server-provided retry delays. Non-retryable errors and
+    the final failure are re-raised unchanged so callers can record them.
+    """
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY,
+                 max_delay=MAX_DELAY, breaker=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def backoff(self, attempt, exc):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        server_delay = server_retry_delay(exc)
+        if server_delay is not None:
+            delay = max(delay, server_delay)
+        return delay
+
+    def _after_failure(self, attempt, exc):
+        """Records the failure; returns the sleep before the next attempt or re-raises."""
+        if isinstance(exc, ShutdownRequested) or shutdown_requested():
+            # No back-off or new attempt while draining; not a health signal either. If this
+            # call was the half-open probe, free the slot so the other callers don't wait forever.
+            self.breaker.release_probe()
+            raise exc
+        error_class = classify_error(exc)
+        self._count(error_class)
+        self.breaker.record(False)
+
+        retryable = error_class in RETRYABLE or (RETRY_UNKNOWN and error_class == 'unknown')
+        if not retryable or attempt + 1 >= self.max_attempts:
+            self._count('gave_up')
+            raise exc
+
+        self._count('retries')
+        return self.backoff(attempt, exc)
+
+    def call(self, fn):
+        for attempt in range(self.max_attempts):
+            pause = self.breaker.wait_time()
+            while pause > 0:
+                time.sleep(pause)
+                pause = self.breaker.wait_time()
+            try:
+                result = fn()
+            except Exception as e:
+                time.sleep(self._after_failure(attempt, e))
+                continue
+            self.breaker.record(True)
+            self._count('success')
+            return result
+
+    async def acall(self, coro_fn):
+        for attempt in range(self.max_attempts):
+            pause = self.breaker.wait_time()
+            while pause > 0:
+                await asyncio.sleep(pause)
+                pause = self.breaker.wait_time()
+            try:
+                result = await coro_fn()
+            except Exception as e:
+                await asyncio.sleep(self._after_failure(attempt, e))
+                continue
+            self.breaker.record(True)
+            self._count('success')
+            return result
+
+    def stats(self):
+        """Per-error-class counters plus breaker state, for throughput diagnosis."""
+        with self._lock:
+            stats = dict(self.counters)
+        stats['breaker_state'] = self.breaker.state
+        stats['breaker_opened'] = self.breaker.times_opened
+        return stats
+
+
+# Process-wide policy shared by every gateway call
+DEFAULT_POLICY = RetryPolicy()
+
+
+def print_retry_report(policy=DEFAULT_POLICY):
+    print("\nRETRY REPORT\n" + "=" * 30)
+    for key, value in sorted(policy.stats().items()):
+        print(f"{key}: {value}")
+    print("=" * 30)
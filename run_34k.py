@@ -1,4 +1,3 @@
-import pandas as pd
 import time
 import os
 import sys
@@ -14,92 +13,203 @@ if MODULES_FULL_PATH not in sys.path:
     sys.path.append(MODULES_FULL_PATH)
 
 # 3. Import Custom Functions
-from coding_logic_34 import code_transcript, SYSTEM_PROMPT
-from preprocessing_util import clean_raw_text
+from coding_logic_34 import client, SYSTEM_PROMPT, COFFEE_REMINDER, CODING_CONFIG, ANSWER_FORMATTER, CODE_NAMES
+from preprocessing_util import REDACT_PII
+from async_engine import code_batch
+from packing import code_batch_packed
+from dedup import collapse_duplicates, members_by_representative, provenance_label
+from retry_policy import print_retry_report, DEFAULT_POLICY
+from response_cache import print_cache_report, RESPONSE_CACHE
+from telemetry import TELEMETRY, print_telemetry_report
+from journal import ResultJournal, journal_path_for
+from shard_queue import ShardQueue, shard_output_file, print_queue_status, default_worker_id
+from transcript_store import ingest, load_study_ids, load_slice, csv_order
+from corpus import corpus_path_for, cleaned_records
+from compaction import compact_records, COMPACT
+from preclassify import preclassify_records
+from dead_letter import DeadLetterQueue, print_dead_letter_report, REPROCESS_CONCURRENCY, REPROCESS_POLICY
+from shutdown import ShutdownRequested, graceful_shutdown
+from budget import GOVERNOR, print_budget_report
+from redaction import print_redaction_report
 
 # --- CONFIGURATION ---
 INPUT_FILE = '/content/drive/MyDrive/34BatchNew/UATranscripts_All.csv'
-
-# Set your batch parameters
+# Cleaned text comes from the preprocessed corpus (`python corpus.py INPUT_FILE`); rows it
+# lacks, or whose raw text changed since it was built, are cleaned on the fly
+CORPUS_FILE = corpus_path_for(INPUT_FILE)
+
+# Shard queue: workers claim deterministic StudyID shards instead of hand-picked row slices.
+# Run the same notebook in several runtimes to drain the queue in parallel.
+USE_SHARD_QUEUE = True
+QUEUE_DB = '/content/drive/MyDrive/34BatchNew/shard_queue.sqlite'
+SHARD_SIZE = 1000
+SHARD_OUTPUT_DIR = '/content/drive/MyDrive/34BatchNew'
+WORKER_ID = default_worker_id()
+
+# Manual slice (only used when USE_SHARD_QUEUE = False); rows are counted in CSV order
 BATCH_SIZE = 10
 START_ROW = 0
-SAVE_INTERVAL = 5
+CONCURRENCY = 8   # Requests in flight at once (replaces the 1.5s serial breather)
+PACKED = False    # True = several transcripts per call, answers keyed by StudyID
+PRECLASSIFY = True   # Code trivial chats (no patron turn, greetings only, test messages) without a call
+# Compaction (compaction.py) follows VR_COMPACT, like batch mode and the pipeline's clean stage
+DEDUP = True      # Send one representative per duplicate group, fan codes back out
+NEAR_DUP_THRESHOLD = 0.9   # MinHash similarity for near-duplicates; None = exact only
+
+# Dead-letter queue: rows that fail after retries, with the full exception and error class.
+# Set REPROCESS_CLASSES (e.g. ['rate_limit', 'timeout', 'safety', 'parse']) to retry only those
+# rows, at REPROCESS_CONCURRENCY with the slower REPROCESS_POLICY, instead of running new shards.
+DEAD_LETTER_FILE = '/content/drive/MyDrive/34BatchNew/dead_letters.jsonl'
+REPROCESS_CLASSES = None
+# Hard spend caps for this run (None = no cap); see budget.py
+BUDGET = dict(max_cost_usd=None, max_tokens=None, max_thought_tokens=None)
 
 # --- DYNAMIC OUTPUT FILE (The Overwrite Shield) ---
 # This creates a unique filename like: Coded_Batch_0_to_1000.csv
 OUTPUT_FILE = f'/content/drive/MyDrive/34BatchNew/Coded_Batch_{START_ROW}_to_{START_ROW + BATCH_SIZE}.csv'
 
-def run_batch_process():
-    print(f"🚀 Starting Batch: Rows {START_ROW} to {START_ROW + BATCH_SIZE}")
-    print(f"📁 Output will be saved to: {OUTPUT_FILE}")
+def code_rows(df, output_file, dead_letter, concurrency=CONCURRENCY, policy=DEFAULT_POLICY, cache=RESPONSE_CACHE,
+              store=None):
+    """
+    Codes one slice/shard of the master CSV into output_file (journaled, resumable).
+    Pass the transcript `store` when df is only part of the file (a reprocess pass),
+    so the output keeps every journaled row in CSV order.
+    """
+    print(f"📁 Output will be saved to: {output_file}")
+    journal = ResultJournal(journal_path_for(output_file))
+    rows_by_id = {row['StudyID']: row for _, row in df.iterrows()}
+
+    # 2. Code the batch concurrently; rows are recorded as they finish
+    def record_row(study_id, ai_output, thoughts, provenance):
+        row = rows_by_id[study_id]
+        failed = ai_output.startswith("ERROR")
+
+        journal.record(study_id, {
+            'StudyID': study_id,
+            'Transcript': row['Transcript'],
+            'New_AI_Final_Code': ai_output,
+            'AI_Thoughts': thoughts,
+            'Timestamp': row['Timestamp'],
+            'Referrer': row['Referrer'],
+            'Wait Time (seconds)': row['Wait Time (seconds)'],
+            'Duration (seconds)"': row['Duration (seconds)'],
+            'Processed_At': None if failed else time.strftime("%Y-%m-%d %H:%M:%S"),
+            'Dedup_Provenance': provenance
+        }, failed=failed)
+
+        if failed:
+            print(f"⚠️ Error on StudyID {study_id}: {ai_output}")
+        else:
+            print(f"✅ Processed StudyID {study_id}...")
+
+    # Resume: StudyIDs already journaled successfully are not sent again
+    done = journal.done_ids()
+    records = [(study_id, transcript) for study_id, transcript in zip(df['StudyID'], df['Transcript'])
+               if study_id not in done]
+    if done:
+        print(f"📓 Resuming: {len(done)} rows already coded, {len(records)} to go.")
+    if PRECLASSIFY:
+        records, local = preclassify_records(records)
+        for study_id, (ai_output, thoughts) in local.items():
+            record_row(study_id, ai_output, thoughts, 'preclassified')
+    records = cleaned_records(records, CORPUS_FILE)
+    if COMPACT:
+        records = compact_records(records)
+    if DEDUP:
+        records, provenance = collapse_duplicates(records, NEAR_DUP_THRESHOLD, precleaned=True)
+    else:
+        provenance = {study_id: (study_id, 'representative') for study_id, _ in records}
+    groups = members_by_representative(provenance)
+
+    # A representative's answer is fanned out to every member of its group
+    def record_result(study_id, ai_output, thoughts):
+        for member_id, kind in groups[study_id]:
+            record_row(member_id, ai_output, thoughts, provenance_label(study_id, kind))
+
+    # ...and so is its dead-letter entry, so a reprocess pass picks up the whole group
+    def group_ids(study_id):
+        return [member_id for member_id, _ in groups[study_id]]
 
-    # 1. Load the specific slice
     try:
-        if START_ROW == 0:
-            df = pd.read_csv(INPUT_FILE, nrows=BATCH_SIZE)
-        else:
-            df = pd.read_csv(INPUT_FILE, skiprows=range(1, START_ROW + 1), nrows=BATCH_SIZE)
-    except Exception as e:
-        print(f"❌ Error loading file: {e}")
-        return
-
-    results = []
-
-    # 2. Loop through the batch
-    for index, row in df.iterrows():
-        study_id = row['StudyID']
-        transcript_text = row['Transcript']
-        timestamp = row['Timestamp']
-        referrer = row['Referrer']
-        wait_time = row['Wait Time (seconds)']
-        duration = row['Duration (seconds)']
-
-        try:
-            # The API Call
-            ai_output, thoughts = code_transcript(transcript_text)
-
-            results.append({
-                'StudyID': study_id,
-                'Transcript': transcript_text,
-                'New_AI_Final_Code': ai_output,
-                'AI_Thoughts': thoughts,
-                'Timestamp': timestamp,
-                'Referrer': referrer,
-                'Wait Time (seconds)': wait_time,
-                'Duration (seconds)"': duration,
-                'Processed_At': time.strftime("%Y-%m-%d %H:%M:%S")
-            })
+        # Spend is also tallied per output file, so the budget report can name the costly shards
+        with GOVERNOR.scope(os.path.basename(output_file), len(records)):
+            if PACKED:
+                code_batch_packed(records, client, SYSTEM_PROMPT, COFFEE_REMINDER,
+                                  concurrency=concurrency, on_result=record_result, code_names=CODE_NAMES,
+                                  dead_letter=dead_letter, source=output_file, dead_letter_keys=group_ids,
+                                  policy=policy, cache=cache, precleaned=True)
+            else:
+                code_batch(records, client, SYSTEM_PROMPT, COFFEE_REMINDER,
+                           concurrency=concurrency, on_result=record_result,
+                           dead_letter=dead_letter, source=output_file, dead_letter_keys=group_ids,
+                           base_config=CODING_CONFIG, answer_formatter=ANSWER_FORMATTER,
+                           policy=policy, cache=cache, precleaned=True)
+    finally:
+        # 3. Final Save: compact the journal into the output, in input (CSV) order.
+        # Also runs on a stop, so the output always reflects everything journaled so far.
+        order = df['StudyID'].tolist() if store is None else csv_order(store, journal.keys())
+        results_df = journal.compact(output_file, order=order)
+        print(f"🏁 {len(results_df)} rows saved to: {output_file}")
+
+
+def reprocess_dead_letters(dead_letter, classes):
+    """Re-codes only the dead-lettered rows of the given error classes, file by file."""
+    entries = dead_letter.failed(classes)
+    print(f"♻️ Reprocessing {len(entries)} dead-lettered rows ({', '.join(classes)}).")
+    store = ingest(INPUT_FILE)
+    TELEMETRY.start_run('run_34k reprocess', len(entries))
+    GOVERNOR.start_run(len(entries), **BUDGET)
+    for source in sorted({entry['source'] for entry in entries}):
+        df = load_study_ids(store, dead_letter.failed_ids(classes, source))
+        # Fresh answers: a cached parse failure would just come back again
+        code_rows(df, source, dead_letter, concurrency=REPROCESS_CONCURRENCY, policy=REPROCESS_POLICY, cache=None,
+                  store=store)
 
-            print(f"✅ Processed StudyID {study_id}...")
 
-        except Exception as api_error:
-            print(f"⚠️ Error on StudyID {study_id}: {api_error}")
-            results.append({
-                'StudyID': study_id,
-                'Transcript': transcript_text,
-                'New_AI_Final_Code': "ERROR",
-                'AI_Thoughts': str(api_error),
-                'Timestamp': timestamp, # Will be None as initialized above
-                'Referrer': referrer,   # Will be None as initialized above
-                'Wait Time (seconds)': wait_time, # Will be None as initialized above
-                'Duration (seconds)"': duration, # Will be None as initialized above
-                'Processed_At': None
-            })
-
-        # --- THE CHECKPOINT SAVE (FIXED) ---
-        # Runs every 50 rows. ALIGNED with the 'try' block.
-        if (index + 1) % SAVE_INTERVAL == 0:
-            checkpoint_df = pd.DataFrame(results)
-            checkpoint_df.to_csv(OUTPUT_FILE, index=False)
-            print(f"💾 CHECKPOINT SAVED at row {index + 1}!")
-
-        # The Politeness Breather
-        time.sleep(1.5)
-
-    # 3. Final Save
-    results_df = pd.DataFrame(results)
-    results_df.to_csv(OUTPUT_FILE, index=False)
-    print(f"🏁 Batch Complete! {len(results)} rows saved to: {OUTPUT_FILE}")
+def run_batch_process():
+    dead_letter = DeadLetterQueue(DEAD_LETTER_FILE)
+    try:
+        # SIGTERM (preemption) or a stop drains in-flight requests; unsent rows resume next run
+        with graceful_shutdown():
+            if REPROCESS_CLASSES:
+                reprocess_dead_letters(dead_letter, REPROCESS_CLASSES)
+            elif USE_SHARD_QUEUE:
+                queue = ShardQueue(QUEUE_DB)
+                counts = queue.plan(INPUT_FILE, SHARD_SIZE)
+                queued = (counts['pending'] + counts['leased']) * SHARD_SIZE
+                TELEMETRY.start_run('run_34k shard queue', queued)
+                GOVERNOR.start_run(queued, **BUDGET)
+                store = ingest(INPUT_FILE)   # one-time Parquet copy; reused while the CSV is unchanged
+                while (shard := queue.claim(WORKER_ID)) is not None:
+                    print(f"🚀 Worker {WORKER_ID} claimed shard {shard['shard_no']}: "
+                          f"StudyID {shard['first_id']} to {shard['last_id']} (attempt {shard['attempt']})")
+                    df = load_study_ids(store, shard['study_ids'])
+                    with queue.hold(shard):
+                        code_rows(df, shard_output_file(SHARD_OUTPUT_DIR, shard), dead_letter)
+                print_queue_status(queue)
+            else:
+                print(f"🚀 Starting Batch: Rows {START_ROW} to {START_ROW + BATCH_SIZE}")
+
+                # 1. Load the specific slice (reads only the Parquet row groups it overlaps)
+                try:
+                    df = load_slice(ingest(INPUT_FILE), START_ROW, BATCH_SIZE)
+                except Exception as e:
+                    print(f"❌ Error loading file: {e}")
+                    return
+                TELEMETRY.start_run(OUTPUT_FILE, len(df))
+                GOVERNOR.start_run(len(df), **BUDGET)
+                code_rows(df, OUTPUT_FILE, dead_letter)
+    except (KeyboardInterrupt, ShutdownRequested):
+        print("\n🛑 Stopped early. Journaled rows are kept; the rest resume on the next run.")
+
+    print_retry_report()
+    print_cache_report()
+    print_telemetry_report()
+    print_dead_letter_report(dead_letter)
+    print_budget_report()
+    if REDACT_PII:
+        print_redaction_report()
+
 
 # 4. RUN
 run_batch_process()
@@ -1,4 +1,3 @@
-import pandas as pd
 import time
 import os
 import sys
@@ -20,71 +19,116 @@ if MODULES_FULL_PATH not in sys.path:
 import coding_logic_34
 importlib.reload(coding_logic_34)
 from coding_logic_34 import code_transcript_with_verify
+from shard_queue import ShardQueue, shard_output_file, print_queue_status, default_worker_id
+from transcript_store import ingest, load_study_ids, load_slice
+from journal import ResultJournal, journal_path_for
+from shutdown import ShutdownRequested, graceful_shutdown, shutdown_requested
+from budget import GOVERNOR, print_budget_report
 
 # --- CONFIGURATION ---
 # Point this to your new 50-transcript subset
 INPUT_FILE = '/content/drive/MyDrive/34Batch/atomic_subset.csv' 
 
-BATCH_SIZE = 50   # Atomic runs can handle larger batches safely
+# Shard queue: deterministic StudyID shards claimed by lease (see shard_queue.py)
+USE_SHARD_QUEUE = True
+QUEUE_DB = '/content/drive/MyDrive/34Batch/audit_shard_queue.sqlite'
+SHARD_SIZE = 50   # Atomic runs can handle larger batches safely
+WORKER_ID = default_worker_id()
+
+# Manual slice (only used when USE_SHARD_QUEUE = False); rows are counted in CSV order
+BATCH_SIZE = 50
 START_ROW = 0     
-SAVE_INTERVAL = 5
+# Hard spend caps for this run (None = no cap); see budget.py
+BUDGET = dict(max_cost_usd=None, max_tokens=None, max_thought_tokens=None)
 
 OUTPUT_FILE = f'/content/drive/MyDrive/34Batch/Atomic_Audit_{START_ROW}_to_{START_ROW + BATCH_SIZE}.csv'
 
-def run_atomic_audit():
-    print(f"🚀 Starting All-in-One Atomic Audit: Rows {START_ROW} to {START_ROW + BATCH_SIZE}")
-    print(f"📁 Saving to: {OUTPUT_FILE}")
-    
-    # 1. Load the slice
-    try:
-        df = pd.read_csv(INPUT_FILE, skiprows=range(1, START_ROW + 1), nrows=BATCH_SIZE)
-    except Exception as e:
-        print(f"❌ Error loading file: {e}")
-        return
+def audit_rows(df, output_file):
+    """Audits one slice/shard into output_file (journaled, resumable)."""
+    print(f"📁 Saving to: {output_file}")
+    journal = ResultJournal(journal_path_for(output_file))
 
-    results = []
+    # Resume: StudyIDs already journaled successfully are not audited (or paid for) again
+    done = journal.done_ids()
+    todo = sum(1 for study_id in df['StudyID'] if study_id not in done)
+    if todo < len(df):
+        print(f"📓 Resuming: {len(df) - todo} rows already audited, {todo} to go.")
 
-    # 2. Loop through transcripts
-    for index, row in df.iterrows():
-        study_id = row['StudyID']
-        transcript_text = row['OriginalTranscript'] 
+    # 2. Loop through transcripts; each result is committed to the journal as it finishes
+    try:
+        for index, row in df.iterrows():
+            if shutdown_requested():
+                break
+            study_id = row['StudyID']
+            if study_id in done:
+                continue
+            transcript_text = row['OriginalTranscript'] 
         
-        try:
-            # CALLING THE CONSOLIDATED BRAIN
-            # This handles Initial Coding -> Verification -> Optional Revision
-            final_code, audit_note, thoughts = code_transcript_with_verify(transcript_text)
+            try:
+                # CALLING THE CONSOLIDATED BRAIN
+                # This handles Initial Coding -> Verification -> Optional Revision
+                final_code, audit_note, thoughts = code_transcript_with_verify(transcript_text)
             
-            results.append({
-                'StudyID': study_id,
-                'OriginalTranscript': transcript_text, 
-                'Final_Code': final_code,
-                'Audit_Note': audit_note, # Tells you if it passed first try or was revised
-                'AI_Thoughts': thoughts,
-                'Processed_At': time.strftime("%Y-%m-%d %H:%M:%S")
-            })
+                journal.record(study_id, {
+                    'StudyID': study_id,
+                    'OriginalTranscript': transcript_text, 
+                    'Final_Code': final_code,
+                    'Audit_Note': audit_note, # Tells you if it passed first try or was revised
+                    'AI_Thoughts': thoughts,
+                    'Processed_At': time.strftime("%Y-%m-%d %H:%M:%S")
+                })
             
-            status_icon = "✅" if audit_note == "PASS" else "⚠️"
-            print(f"{status_icon} Processed {study_id} (Audit: {audit_note[:30]}...)")
+                status_icon = "✅" if audit_note == "PASS" else "⚠️"
+                print(f"{status_icon} Processed {study_id} (Audit: {audit_note[:30]}...)")
 
-        except Exception as e:
-            print(f"❌ Critical Failure on {study_id}: {e}")
-            results.append({
-                'StudyID': study_id, 
-                'Final_Code': "ERROR", 
-                'Audit_Note': str(e),
-                'AI_Thoughts': "Check API/Script Logic"
-            })
+            except ShutdownRequested:
+                break   # never sent; left for the next run
+            except Exception as e:
+                print(f"❌ Critical Failure on {study_id}: {e}")
+                journal.record(study_id, {
+                    'StudyID': study_id, 
+                    'Final_Code': "ERROR", 
+                    'Audit_Note': str(e),
+                    'AI_Thoughts': "Check API/Script Logic"
+                }, failed=True)
+    finally:
+        # 3. Final Save: compact the journal in input order (also after a stop)
+        results_df = journal.compact(output_file, order=df['StudyID'].tolist())
+    if shutdown_requested():
+        raise ShutdownRequested(f"stopped after {len(results_df)} of {len(df)} rows")
+    print(f"🏁 Audit Complete! {len(results_df)} rows saved.")
 
-        # --- THE CHECKPOINT SAVE ---
-        if (index + 1) % SAVE_INTERVAL == 0:
-            pd.DataFrame(results).to_csv(OUTPUT_FILE, index=False)
-            print(f"💾 Checkpoint saved at row {index + 1}")
+def run_atomic_audit():
+    if USE_SHARD_QUEUE:
+        queue = ShardQueue(QUEUE_DB)
+        counts = queue.plan(INPUT_FILE, SHARD_SIZE)
+        GOVERNOR.start_run((counts['pending'] + counts['leased']) * SHARD_SIZE, **BUDGET)
+        store = ingest(INPUT_FILE)   # one-time Parquet copy; reused while the CSV is unchanged
+        while (shard := queue.claim(WORKER_ID)) is not None:
+            print(f"🚀 Starting All-in-One Atomic Audit: shard {shard['shard_no']} "
+                  f"(StudyID {shard['first_id']} to {shard['last_id']})")
+            df = load_study_ids(store, shard['study_ids'])
+            output_file = shard_output_file(os.path.dirname(INPUT_FILE), shard, prefix='Atomic_Audit')
+            with queue.hold(shard), GOVERNOR.scope(os.path.basename(output_file), len(df)):
+                audit_rows(df, output_file)
+        print_queue_status(queue)
+        return
 
-        time.sleep(2) # Keeping the API happy
+    print(f"🚀 Starting All-in-One Atomic Audit: Rows {START_ROW} to {START_ROW + BATCH_SIZE}")
 
-    # 3. Final Save
-    pd.DataFrame(results).to_csv(OUTPUT_FILE, index=False)
-    print(f"🏁 Audit Complete! {len(results)} rows saved.")
+    # 1. Load the slice
+    try:
+        df = load_slice(ingest(INPUT_FILE), START_ROW, BATCH_SIZE)
+    except Exception as e:
+        print(f"❌ Error loading file: {e}")
+        return
+    GOVERNOR.start_run(len(df), **BUDGET)
+    audit_rows(df, OUTPUT_FILE)
 
-# 4. RUN
-run_atomic_audit()
+# 4. RUN (SIGTERM/SIGINT finish the current transcript, save and stop)
+try:
+    with graceful_shutdown():
+        run_atomic_audit()
+except (KeyboardInterrupt, ShutdownRequested):
+    print("\n🛑 Stopped early. Finished transcripts are journaled; the shard resumes where it stopped.")
+print_budget_report()
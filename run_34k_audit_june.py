@@ -15,6 +15,8 @@ MODULES_FULL_PATH = os.path.join('/content/drive/MyDrive', DRIVE_MODULES_FOLDER)
 if MODULES_FULL_PATH not in sys.path:
     sys.path.insert(0, MODULES_FULL_PATH)
 
+from atomic_io import write_csv
+
 # --- CONFIGURATION ---
 # Point this to your new 50-transcript subset
 INPUT_FILE = '/content/drive/MyDrive/TestJune/JuneAtomic.csv'
@@ -70,7 +72,7 @@ def run_atomic_audit():
         # Runs every 50 rows. ALIGNED with the 'try' block.
         if (index + 1) % SAVE_INTERVAL == 0:
             checkpoint_df = pd.DataFrame(results)
-            checkpoint_df.to_csv(OUTPUT_FILE, index=False)
+            write_csv(checkpoint_df, OUTPUT_FILE, index=False)
             print(f"💾 CHECKPOINT SAVED at row {index + 1}!")
 
         # The Politeness Breather
@@ -78,7 +80,7 @@ def run_atomic_audit():
 
     # 3. Final Save
     results_df = pd.DataFrame(results)
-    results_df.to_csv(OUTPUT_FILE, index=False)
+    write_csv(results_df, OUTPUT_FILE, index=False)
     print(f"🏁 Batch Complete! {len(results)} rows saved to: {OUTPUT_FILE}")
 
 # 4. RUN
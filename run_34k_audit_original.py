@@ -16,6 +16,7 @@ if MODULES_FULL_PATH not in sys.path:
 # 3. Import Custom Functions
 from coding_logic_34 import code_transcript, SYSTEM_PROMPT
 from preprocessing_util import clean_raw_text
+from atomic_io import write_csv
 
 # --- CONFIGURATION ---
 INPUT_FILE = '/content/drive/MyDrive/34Batch/MasterList_Final.csv'
@@ -78,7 +79,7 @@ def run_batch_process():
         # Runs every 50 rows. ALIGNED with the 'try' block.
         if (index + 1) % SAVE_INTERVAL == 0:
             checkpoint_df = pd.DataFrame(results)
-            checkpoint_df.to_csv(OUTPUT_FILE, index=False)
+            write_csv(checkpoint_df, OUTPUT_FILE, index=False)
             print(f"💾 CHECKPOINT SAVED at row {index + 1}!")
 
         # The Politeness Breather
@@ -86,7 +87,7 @@ def run_batch_process():
 
     # 3. Final Save
     results_df = pd.DataFrame(results)
-    results_df.to_csv(OUTPUT_FILE, index=False)
+    write_csv(results_df, OUTPUT_FILE, index=False)
     print(f"🏁 Batch Complete! {len(results)} rows saved to: {OUTPUT_FILE}")
 
 # 4. RUN
@@ -0,0 +1,322 @@
+import argparse
+import hashlib
+import heapq
+import math
+import os
+import random
+import sqlite3
+import pandas as pd
+from async_engine import MAX_IN_FLIGHT
+from atomic_io import write_json
+from compaction import compact_records, COMPACT
+from corpus import corpus_path_for, cleaned_records, load_corpus
+from dedup import collapse_duplicates, NEAR_DUP_THRESHOLD
+from packing import pack_records, PACK_INSTRUCTIONS, PACK_TOKEN_BUDGET, MAX_PACK_SIZE
+from preclassify import preclassify_records
+from preprocessing_util import clean_series, MODEL_NAME, PRICING, RATE_LIMITS
+from prompt_cache import USE_CONTEXT_CACHE
+from rate_limiter import CHARS_PER_TOKEN, HEADROOM, estimate_tokens
+from telemetry import TELEMETRY_DIR, load_calls, latest_run_id
+
+# --- CONFIGURATION ---
+# Dry run of a full corpus pass: counts the prompt tokens of the real
+# SYSTEM_PROMPT and every cleaned transcript, then replays the calls against
+# the RPM/TPM limits and concurrency to project wall time, cost and a shard /
+# packing plan. Nothing is sent to generate_content.
+TOKEN_COUNT_DB = os.environ.get('VR_TOKEN_COUNT_DB',
+                                os.path.expanduser('~/.cache/vr_transcripts/token_counts.sqlite'))
+# Transcripts counted by the count_tokens endpoint; the rest are scaled by the
+# sample's chars per token (None = count every transcript, one call each, cached)
+COUNT_SAMPLE = 300
+
+# Answer size and latency of one single-transcript call. Taken from the latest
+# run's telemetry when there is one; these are the fallbacks.
+DEFAULT_OUTPUT_TOKENS = 120
+DEFAULT_THOUGHT_TOKENS = 700
+DEFAULT_LATENCY_SECONDS = 6.0
+GENERATED_TOKENS_PER_SECOND = 150   # a packed call takes longer the more it has to write
+
+WORKER_OPTIONS = (1, 2, 4, 8)   # runtimes draining the shard queue against one API quota
+NEAR_BEST = 1.1                 # fewest workers within 10% of the best wall time
+TARGET_SHARD_MINUTES = 20       # suggested shard size = what one worker codes in this long
+MIN_TRANSCRIPT_CHARS = 10       # shorter transcripts are labelled insufficient without a call
+
+
+class TokenCounter:
+    """
+    Prompt token counts from the count_tokens endpoint, cached in SQLite so a
+    re-plan after a prompt edit only counts what changed. Without a client (or
+    once the endpoint fails) it falls back to the chars/token estimate.
+    """
+
+    def __init__(self, client=None, model=MODEL_NAME, path=TOKEN_COUNT_DB):
+        self.client = client
+        self.model = model
+        self.api_calls = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counts (key TEXT PRIMARY KEY, tokens INTEGER NOT NULL)")
+
+    @property
+    def exact(self):
+        return self.client is not None
+
+    def count(self, text):
+        key = hashlib.sha256(f"{self.model}\n{text}".encode('utf-8')).hexdigest()[:32]
+        row = self._conn.execute("SELECT tokens FROM counts WHERE key = ?", (key,)).fetchone()
+        if row:
+            return row[0]
+        if self.client is None:
+            return estimate_tokens(text)
+        try:
+            tokens = self.client.models.count_tokens(model=self.model, contents=text).total_tokens
+        except Exception as e:
+            print(f"⚠️ count_tokens unavailable, using the offline estimate: {str(e)[:80]}")
+            self.client = None
+            return estimate_tokens(text)
+        self.api_calls += 1
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO counts (key, tokens) VALUES (?, ?)", (key, tokens))
+        return tokens
+
+
+def count_transcripts(texts, counter, sample=COUNT_SAMPLE):
+    """
+    Tokens per text: counted for a random sample (all of them if sample is None),
+    the rest scaled by the sample's chars per token. Returns (tokens, chars_per_token).
+    """
+    if not counter.exact:
+        return [estimate_tokens(text) for text in texts], CHARS_PER_TOKEN
+    picked = range(len(texts)) if sample is None or sample >= len(texts) \
+        else random.Random(0).sample(range(len(texts)), sample)
+    counted = {i: counter.count(texts[i]) for i in picked}
+    chars_per_token = sum(len(texts[i]) for i in counted) / max(sum(counted.values()), 1) or CHARS_PER_TOKEN
+    tokens = [counted[i] if i in counted else math.ceil(len(text) / chars_per_token)
+              for i, text in enumerate(texts)]
+    return tokens, chars_per_token
+
+
+def usage_profile(run_id=None, directory=TELEMETRY_DIR):
+    """Output/thought tokens and latency of a single-transcript call, from telemetry or the defaults."""
+    run_id = run_id or latest_run_id(directory)
+    calls = load_calls(directory, run_id) if run_id else pd.DataFrame()
+    if not calls.empty:
+        calls = calls[~calls['from_cache'] & calls['error_class'].isna() & (calls['items'] == 1)]
+    if calls.empty:
+        return {'output_tokens': DEFAULT_OUTPUT_TOKENS, 'thought_tokens': DEFAULT_THOUGHT_TOKENS,
+                'latency_s': DEFAULT_LATENCY_SECONDS, 'source': 'defaults'}
+    return {'output_tokens': float(calls['candidates_tokens'].median()),
+            'thought_tokens': float(calls['thoughts_tokens'].median()),
+            'latency_s': float(calls['latency_s'].median()),
+            # Runs recorded before wait_s existed timed the queue waits into latency_s too
+            'source': f"telemetry run {run_id} ({len(calls)} calls)"
+                      + ("" if 'wait_s' in calls and calls['wait_s'].notna().any() else ", latency includes waits")}
+
+
+def load_cleaned(input_file, compact=False, preclassify=False):
+    """
+    (StudyID, cleaned transcript) pairs from the corpus (corpus.py), or cleaned
+    from the CSV. `preclassify` drops the chats the pre-classifier codes without
+    a call and `compact` compacts the rest, as run_34k does with its PRECLASSIFY
+    and VR_COMPACT settings, so the counts match what would be sent.
+    """
+    if preclassify:
+        df = pd.read_csv(input_file, usecols=['StudyID', 'Transcript'])
+        records, _ = preclassify_records(list(zip(df['StudyID'], df['Transcript'])))
+        records = cleaned_records(records, corpus_path_for(input_file))
+    else:
+        corpus = load_corpus(corpus_path_for(input_file), columns=['StudyID', 'Cleaned_Transcript'])
+        if corpus is not None:
+            print(f"📚 Using the cleaned corpus {corpus_path_for(input_file)}")
+            records = list(zip(corpus['StudyID'].to_pylist(), corpus['Cleaned_Transcript'].to_pylist()))
+        else:
+            df = pd.read_csv(input_file, usecols=['StudyID', 'Transcript'])
+            records = list(zip(df['StudyID'], clean_series(df['Transcript']).tolist()))
+    return compact_records(records) if compact else records
+
+
+def build_requests(records, tokens, wrappers, profile, packed,
+                   pack_token_budget=PACK_TOKEN_BUDGET, max_pack_size=MAX_PACK_SIZE):
+    """
+    One dict per generate_content call: transcripts, prompt tokens (excluding the
+    system prompt), tokens the local limiter is charged, generated tokens and latency.
+    `wrappers` holds the token and char size of the text around the transcripts.
+    """
+    generated = profile['output_tokens'] + profile['thought_tokens']
+    by_id = {study_id: (cleaned, count) for (study_id, cleaned), count in zip(records, tokens)}
+    groups = pack_records(records, pack_token_budget, max_pack_size) if packed else [[r] for r in records]
+
+    call = wrappers['pack' if packed else 'single']
+    row = wrappers['row'] if packed else {'tokens': 0, 'chars': 0}
+    requests = []
+    for group in groups:
+        n = len(group)
+        chars = call['chars'] + row['chars'] * n + sum(len(by_id[i][0]) for i, _ in group)
+        requests.append({
+            'items': n,
+            'prompt_tokens': call['tokens'] + row['tokens'] * n + sum(by_id[i][1] for i, _ in group),
+            # The gateway charges the limiter its own chars/token estimate of the contents it sends
+            'limiter_tokens': math.ceil((chars + wrappers['inline']['chars']) / CHARS_PER_TOKEN),
+            'generated_tokens': generated * n,
+            'latency_s': profile['latency_s'] + generated * (n - 1) / GENERATED_TOKENS_PER_SECOND,
+        })
+    return requests
+
+
+def simulate(requests, concurrency, rpm, tpm, headroom=HEADROOM):
+    """
+    Replays the calls in order through `concurrency` slots and the same token
+    buckets as RateLimiter (shared by every worker). Returns the wall time in seconds.
+    """
+    rpm, tpm = max(1.0, rpm * headroom), max(1.0, tpm * headroom)
+    slots = [0.0] * concurrency
+    request_level, token_level, updated = rpm, tpm, 0.0
+    finish = 0.0
+
+    for request in requests:
+        now = max(heapq.heappop(slots), updated)
+        tokens = min(request['limiter_tokens'], tpm)
+        elapsed = now - updated
+        request_level = min(rpm, request_level + elapsed * rpm / 60.0)
+        token_level = min(tpm, token_level + elapsed * tpm / 60.0)
+        wait = max(0.0, (1 - request_level) * 60.0 / rpm, (tokens - token_level) * 60.0 / tpm)
+        now += wait
+        request_level = min(rpm, request_level + wait * rpm / 60.0) - 1
+        token_level = min(tpm, token_level + wait * tpm / 60.0) - tokens
+        updated = now
+        done = now + request['latency_s']
+        heapq.heappush(slots, done)
+        finish = max(finish, done)
+    return finish
+
+
+def bound_by(requests, concurrency, rpm, tpm, headroom=HEADROOM):
+    """Which of RPM, TPM or concurrency sets the lower bound on wall time."""
+    floors = {
+        'rpm': len(requests) / (rpm * headroom) * 60.0,
+        'tpm': sum(r['limiter_tokens'] for r in requests) / (tpm * headroom) * 60.0,
+        'concurrency': sum(r['latency_s'] for r in requests) / concurrency,
+    }
+    return max(floors, key=floors.get)
+
+
+def run_cost(requests, system_tokens, model=MODEL_NAME, context_cache=USE_CONTEXT_CACHE):
+    """USD for the pass: the system prompt at the cached rate when it is a cached context."""
+    price = PRICING.get(model, PRICING['default'])
+    system_rate = price['cached_input'] if context_cache else price['input']
+    calls = len(requests)
+    return (calls * system_tokens * system_rate
+            + sum(r['prompt_tokens'] for r in requests) * price['input']
+            + sum(r['generated_tokens'] for r in requests) * price['output']) / 1e6
+
+
+def plan_run(records, tokens, wrappers, system_tokens, profile, concurrency=MAX_IN_FLIGHT,
+             model=MODEL_NAME, workers=WORKER_OPTIONS):
+    """Simulates single and packed calls for each worker count. Returns (plans DataFrame, suggestion)."""
+    limits = RATE_LIMITS.get(model, RATE_LIMITS['default'])
+    rows = []
+    for packed in (False, True):
+        requests = build_requests(records, tokens, wrappers, profile, packed)
+        cost = run_cost(requests, system_tokens, model)
+        for n_workers in workers:
+            slots = concurrency * n_workers
+            wall_s = simulate(requests, slots, limits['rpm'], limits['tpm'])
+            rows.append({'mode': 'packed' if packed else 'single', 'workers': n_workers, 'calls': len(requests),
+                         'wall_h': round(wall_s / 3600, 2), 'cost_usd': round(cost, 2),
+                         'bound_by': bound_by(requests, slots, limits['rpm'], limits['tpm'])})
+    plans = pd.DataFrame(rows)
+
+    # Per mode, the fewest workers that get close to that mode's best time; then the cheaper mode
+    candidates = []
+    for _, mode_plans in plans.groupby('mode'):
+        best = mode_plans['wall_h'].min()
+        candidates.append(mode_plans[mode_plans['wall_h'] <= best * NEAR_BEST].iloc[0])
+    pick = min(candidates, key=lambda plan: (plan['cost_usd'], plan['wall_h']))
+
+    per_worker_per_min = len(records) / max(pick['wall_h'] * 60, 1e-9) / pick['workers']
+    shard_size = max(100, int(round(per_worker_per_min * TARGET_SHARD_MINUTES, -2)))
+    suggestion = {'packed': pick['mode'] == 'packed', 'workers': int(pick['workers']),
+                  'concurrency_per_worker': concurrency, 'shard_size': shard_size,
+                  'shards': math.ceil(len(records) / shard_size),
+                  'wall_h': float(pick['wall_h']), 'cost_usd': float(pick['cost_usd'])}
+    return plans, suggestion
+
+
+def wrapper_sizes(counter, system_prompt, coffee_reminder=""):
+    """Token and char size of the prompt text around the transcripts (counted once)."""
+    single = f"Transcript: {coffee_reminder}"
+    pack = f"{PACK_INSTRUCTIONS}\n{coffee_reminder}"
+    row = "StudyID: 000000\nTranscript: \n\n"
+    inline = "" if USE_CONTEXT_CACHE else f"{system_prompt}\n\n"
+    return {
+        'single': {'tokens': counter.count(single), 'chars': len(single)},
+        'pack': {'tokens': counter.count(pack), 'chars': len(pack)},
+        'row': {'tokens': counter.count(row), 'chars': len(row)},
+        'inline': {'tokens': counter.count(inline) if inline else 0, 'chars': len(inline)},
+    }
+
+
+def print_plan(records, tokens, system_tokens, chars_per_token, counter, profile, plans, suggestion, skipped):
+    series = pd.Series(tokens)
+    print(f"\nRUN PLAN ({len(records):,} transcripts to send, model {MODEL_NAME})\n" + "=" * 30)
+    print(f"skipped: {skipped}")
+    print(f"token counts: {'count_tokens' if counter.exact else 'offline estimate'} "
+          f"({chars_per_token:.2f} chars/token, {counter.api_calls} new API counts)")
+    print(f"system prompt: {system_tokens:,} tokens ({'cached context' if USE_CONTEXT_CACHE else 'inline'})")
+    print(f"transcript tokens: total {int(series.sum()):,} | p50 {series.quantile(0.5):,.0f} "
+          f"| p95 {series.quantile(0.95):,.0f} | max {int(series.max()):,}")
+    print(f"per call: {profile['output_tokens']:.0f} output + {profile['thought_tokens']:.0f} thought tokens, "
+          f"{profile['latency_s']:.1f}s ({profile['source']})")
+    limits = RATE_LIMITS.get(MODEL_NAME, RATE_LIMITS['default'])
+    print(f"limits: {limits['rpm']:,} RPM / {limits['tpm']:,} TPM at {HEADROOM:.0%} headroom, "
+          f"{suggestion['concurrency_per_worker']} in flight per worker")
+    print(plans.to_string(index=False))
+    print(f"SUGGESTED: {'PACKED = True' if suggestion['packed'] else 'PACKED = False'}, "
+          f"{suggestion['workers']} worker(s), SHARD_SIZE = {suggestion['shard_size']:,} "
+          f"({suggestion['shards']} shards) -> ~{suggestion['wall_h']:.2f} h, ~${suggestion['cost_usd']:,.2f}")
+    if suggestion['packed']:
+        print("(packed calls change the prompt; check agreement with single calls on a sample first)")
+    print("=" * 30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Project tokens, wall time and cost of a full coding pass.")
+    parser.add_argument('input', help="Master CSV (its corpus.parquet is used when built).")
+    parser.add_argument('--offline', action='store_true', help="Estimate tokens locally instead of count_tokens.")
+    parser.add_argument('--sample', type=int, default=COUNT_SAMPLE,
+                        help="Transcripts counted by the API (0 = all of them).")
+    parser.add_argument('--concurrency', type=int, default=MAX_IN_FLIGHT, help="Requests in flight per worker.")
+    parser.add_argument('--near-dup', type=float, default=None,
+                        help=f"MinHash dedup threshold (run_34k uses {NEAR_DUP_THRESHOLD}); default: exact only.")
+    parser.add_argument('--no-dedup', action='store_true')
+    parser.add_argument('--compact', action='store_true',
+                        help="Count compacted text (always on when VR_COMPACT is set).")
+    parser.add_argument('--no-preclassify', action='store_true',
+                        help="Count the chats the pre-classifier codes locally too (run_34k PRECLASSIFY = False).")
+    parser.add_argument('--telemetry-run', help="Run id to take output tokens and latency from.")
+    parser.add_argument('--json', help="Also write the plan to this JSON file.")
+    args = parser.parse_args()
+
+    from coding_logic_34 import client, SYSTEM_PROMPT, COFFEE_REMINDER
+
+    records = load_cleaned(args.input, compact=args.compact or COMPACT, preclassify=not args.no_preclassify)
+    total = len(records)
+    if not args.no_dedup:
+        records, _ = collapse_duplicates(records, args.near_dup, precleaned=True)
+    deduped = total - len(records)
+    records = [(study_id, cleaned) for study_id, cleaned in records
+               if len(str(cleaned)) >= MIN_TRANSCRIPT_CHARS]
+    skipped = f"{deduped:,} duplicates, {total - deduped - len(records):,} too short to code"
+
+    counter = TokenCounter(None if args.offline else client)
+    system_tokens = counter.count(SYSTEM_PROMPT)
+    wrappers = wrapper_sizes(counter, SYSTEM_PROMPT, COFFEE_REMINDER)
+    tokens, chars_per_token = count_transcripts([cleaned for _, cleaned in records], counter, args.sample or None)
+
+    profile = usage_profile(args.telemetry_run)
+    plans, suggestion = plan_run(records, tokens, wrappers, system_tokens, profile, args.concurrency)
+    print_plan(records, tokens, system_tokens, chars_per_token, counter, profile, plans, suggestion, skipped)
+    if args.json:
+        write_json({'suggestion': suggestion, 'plans': plans.to_dict('records'), 'profile': profile,
+                    'system_tokens': system_tokens, 'transcript_tokens': int(sum(tokens))},
+                   args.json, indent=2)
@@ -0,0 +1,196 @@
+import argparse
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import pandas as pd
+
+# --- CONFIGURATION ---
+# Replaces hand-edited START_ROW/BATCH_SIZE slices. The master CSV is split once
+# into deterministic shards by sorted StudyID; workers claim shards through an
+# expiring lease, so several processes or notebook runtimes can drain one queue.
+# The queue file has to be visible to every worker (e.g. on the Drive folder).
+SHARD_SIZE = 1000
+LEASE_SECONDS = 30 * 60      # a worker that dies loses its shard after this long
+HEARTBEAT_SECONDS = 5 * 60   # how often a live worker extends its lease
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardQueue:
+    """SQLite-backed shard plan with lease-based claiming."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS plan (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shards ("
+                " shard_no INTEGER PRIMARY KEY, first_id TEXT, last_id TEXT, study_ids TEXT NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'pending', owner TEXT, lease_expires REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0, finished_at REAL)"
+            )
+
+    def _connect(self):
+        # Rollback journal rather than WAL: WAL needs shared memory, which network mounts don't offer
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def plan(self, input_file, shard_size=SHARD_SIZE, id_column='StudyID'):
+        """
+        Splits input_file into shards of `shard_size` StudyIDs (sorted, so every
+        worker computes the same plan). Re-planning the same input is a no-op;
+        re-planning with a different input or shard size is refused.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            existing = dict(conn.execute("SELECT key, value FROM plan").fetchall())
+            wanted = {'input_file': input_file, 'shard_size': str(shard_size)}
+            if existing:
+                conn.execute("ROLLBACK")
+                if existing != wanted:
+                    raise ValueError(f"Queue {self.db_path} was planned for {existing}, not {wanted}")
+                return self.status()
+
+            ids = pd.read_csv(input_file, usecols=[id_column])[id_column].dropna().drop_duplicates()
+            ids = ids.sort_values(kind='stable').tolist()
+            rows = []
+            for shard_no, start in enumerate(range(0, len(ids), shard_size)):
+                chunk = ids[start:start + shard_size]
+                rows.append((shard_no, str(chunk[0]), str(chunk[-1]), json.dumps(chunk, default=str)))
+
+            conn.executemany("INSERT INTO shards (shard_no, first_id, last_id, study_ids) VALUES (?, ?, ?, ?)", rows)
+            conn.executemany("INSERT INTO plan (key, value) VALUES (?, ?)", wanted.items())
+            conn.execute("COMMIT")
+            print(f"🗺️ Planned {len(rows)} shards of up to {shard_size} StudyIDs from {input_file}.")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return self.status()
+
+    def claim(self, worker_id=None, lease_seconds=LEASE_SECONDS):
+        """Leases the lowest pending (or lease-expired) shard. Returns a dict, or None when drained."""
+        worker_id = worker_id or default_worker_id()
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT shard_no, first_id, last_id, study_ids, attempts FROM shards"
+                " WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)"
+                " ORDER BY shard_no LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE shards SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1"
+                " WHERE shard_no = ?", (worker_id, now + lease_seconds, row[0])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        shard_no, first_id, last_id, study_ids, attempts = row
+        return {'shard_no': shard_no, 'first_id': first_id, 'last_id': last_id,
+                'study_ids': json.loads(study_ids), 'owner': worker_id, 'attempt': attempts + 1}
+
+    def _update_owned(self, shard, sql, params=()):
+        """Runs an UPDATE only if `shard` is still leased by its owner. Returns True if it was."""
+        with contextlib.closing(self._connect()) as conn:
+            cursor = conn.execute(sql + " WHERE shard_no = ? AND owner = ? AND status = 'leased'",
+                                  (*params, shard['shard_no'], shard['owner']))
+            return cursor.rowcount == 1
+
+    def renew(self, shard, lease_seconds=LEASE_SECONDS):
+        return self._update_owned(shard, "UPDATE shards SET lease_expires = ?", (time.time() + lease_seconds,))
+
+    def complete(self, shard):
+        return self._update_owned(shard, "UPDATE shards SET status = 'done', lease_expires = NULL, finished_at = ?",
+                                  (time.time(),))
+
+    def release(self, shard):
+        """Gives a shard back to the queue (e.g. after a crash in the worker)."""
+        return self._update_owned(shard, "UPDATE shards SET status = 'pending', owner = NULL, lease_expires = NULL")
+
+    @contextlib.contextmanager
+    def hold(self, shard, lease_seconds=LEASE_SECONDS, heartbeat_seconds=HEARTBEAT_SECONDS):
+        """
+        Keeps the lease alive while the block runs; marks the shard done on
+        success and releases it on error.
+        """
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(heartbeat_seconds):
+                if not self.renew(shard, lease_seconds):
+                    print(f"⚠️ Lost the lease on shard {shard['shard_no']}; another worker may take it over.")
+                    return
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            yield shard
+        except BaseException:
+            stop.set()
+            self.release(shard)
+            raise
+        else:
+            stop.set()
+            self.complete(shard)
+        finally:
+            thread.join(timeout=1)
+
+    def status(self):
+        """{'done': n, 'leased': n, 'pending': n}; expired leases count as pending."""
+        counts = {'done': 0, 'leased': 0, 'pending': 0}
+        with contextlib.closing(self._connect()) as conn:
+            for status, expired, n in conn.execute(
+                    "SELECT status, status = 'leased' AND lease_expires < ?, COUNT(*) FROM shards GROUP BY 1, 2",
+                    (time.time(),)):
+                counts['pending' if expired else status] += n
+        return counts
+
+
+def shard_output_file(output_dir, shard, prefix='Coded_Shard'):
+    """One output file per shard, named by shard number and StudyID range."""
+    return os.path.join(output_dir, f"{prefix}_{shard['shard_no']:04d}_{shard['first_id']}_to_{shard['last_id']}.csv")
+
+
+def print_queue_status(queue):
+    counts = queue.status()
+    total = sum(counts.values())
+    print("\nSHARD QUEUE")
+    print("=" * 30)
+    for state in ('done', 'leased', 'pending'):
+        print(f"{state}: {counts[state]}")
+    print(f"total: {total} ({counts['done'] / max(total, 1) * 100:.1f}% done)")
+    print("=" * 30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan or inspect the shard queue.")
+    parser.add_argument('command', choices=['plan', 'status'])
+    parser.add_argument('--db', required=True, help="Queue file shared by all workers.")
+    parser.add_argument('--input', help="Master CSV (plan only).")
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    args = parser.parse_args()
+
+    queue = ShardQueue(args.db)
+    if args.command == 'plan':
+        if not args.input:
+            parser.error("plan needs --input")
+        queue.plan(args.input, args.shard_size)
+    print_queue_status(queue)
@@ -0,0 +1,64 @@
+import contextlib
+import signal
+import threading
+import time
+
+# --- CONFIGURATION ---
+# Preemption (SIGTERM) or Ctrl-C/the notebook stop button (SIGINT) no longer
+# kills a batch mid-flight. The first signal stops new requests from leaving
+# the gateway while requests already in flight get DRAIN_SECONDS to come back
+# and be journaled; after that (or on a second signal) KeyboardInterrupt is
+# raised so the usual finally blocks write the output.
+DRAIN_SECONDS = 60
+
+SHUTDOWN = threading.Event()
+
+
+class ShutdownRequested(Exception):
+    """Raised instead of sending a new request once a shutdown has started."""
+
+
+def shutdown_requested():
+    return SHUTDOWN.is_set()
+
+
+@contextlib.contextmanager
+def graceful_shutdown(drain_seconds=DRAIN_SECONDS, signals=(signal.SIGTERM, signal.SIGINT)):
+    """
+    Installs the drain-then-interrupt handlers for the duration of the block
+    and restores the previous ones afterwards. Handlers can only be installed
+    from the main thread; elsewhere the block runs unchanged.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    timer = None
+    deadline = None
+
+    def handler(signum, frame):
+        nonlocal timer, deadline
+        if deadline is None:
+            deadline = time.monotonic() + drain_seconds
+            SHUTDOWN.set()
+            print(f"\n🛑 {signal.Signals(signum).name}: no new requests; waiting up to {drain_seconds}s "
+                  f"for in-flight ones (signal again to stop now).")
+            # A real signal (not just interrupt_main) so a main thread blocked in select/join wakes up
+            main_thread_id = threading.main_thread().ident
+            timer = threading.Timer(drain_seconds, signal.pthread_kill, (main_thread_id, signum))
+            timer.daemon = True
+            timer.start()
+            return
+        if time.monotonic() >= deadline:
+            raise KeyboardInterrupt(f"drain deadline of {drain_seconds}s passed")
+        raise KeyboardInterrupt("second signal")
+
+    previous = {signum: signal.signal(signum, handler) for signum in signals}
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.cancel()
+        for signum, old in previous.items():
+            signal.signal(signum, old)
+        SHUTDOWN.clear()
@@ -1,5 +1,6 @@
 import pandas as pd
 import os
+from atomic_io import write_csv
 
 # 1. Setup paths
 # Since we are working with your combined data, use your Master Output path
@@ -28,7 +29,7 @@ target_columns = [
 final_df = campus_df[[col for col in target_columns if col in campus_df.columns]]
 
 # 5. Save to a new CSV for Gem processing
-final_df.to_csv(output_file, index=False)
+write_csv(final_df, output_file, index=False)
 
 print(f"✅ Success! Found {len(final_df)} transcripts matching 'Campus Services'.")
 print(f"📂 File saved for your Gem at: {output_file}")
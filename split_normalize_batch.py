@@ -1,20 +1,7 @@
 import pandas as pd
 import os
 import sys
-from google.colab import drive
-
-# 1. Mount Drive
-drive.mount('/content/drive')
-
-# 2. Setup Pathing
-DRIVE_MODULES_FOLDER = 'AZ_Only'
-MODULES_FULL_PATH = os.path.join('/content/drive/MyDrive', DRIVE_MODULES_FOLDER)
-if MODULES_FULL_PATH not in sys.path:
-    sys.path.append(MODULES_FULL_PATH)
-
-# Load your batch file
-INPUT_FILE = '/content/drive/MyDrive/AZ_Only/Coded_AZ_Batch_100_to_300.csv'
-df = pd.read_csv(INPUT_FILE)
+from atomic_io import write_csv
 
 def split_and_normalize(row):
     raw_content = str(row['New_AI_Final_Code'])
@@ -38,17 +25,36 @@ def split_and_normalize(row):
 
     return codes, reasoning
 
-# Apply the function to create the two new columns
-df[['AI_Final_Code', 'AI_Reasoning']] = df.apply(
-    lambda x: pd.Series(split_and_normalize(x)), axis=1
-)
+def split_normalize_frame(df):
+    """Returns the AI_Final_Code / AI_Reasoning columns for a coded batch DataFrame."""
+    split = df.apply(lambda x: pd.Series(split_and_normalize(x), index=['AI_Final_Code', 'AI_Reasoning']), axis=1)
+
+    # Optional: Normalize the codes by ensuring consistent spacing after commas
+    split['AI_Final_Code'] = split['AI_Final_Code'].str.replace(', ', ',').str.replace(',', ', ')
+    return split
+
+if __name__ == "__main__":
+    from google.colab import drive
+
+    # 1. Mount Drive
+    drive.mount('/content/drive')
+
+    # 2. Setup Pathing
+    DRIVE_MODULES_FOLDER = 'AZ_Only'
+    MODULES_FULL_PATH = os.path.join('/content/drive/MyDrive', DRIVE_MODULES_FOLDER)
+    if MODULES_FULL_PATH not in sys.path:
+        sys.path.append(MODULES_FULL_PATH)
+
+    # Load your batch file
+    INPUT_FILE = '/content/drive/MyDrive/AZ_Only/Coded_AZ_Batch_100_to_300.csv'
+    df = pd.read_csv(INPUT_FILE)
 
-# Optional: Normalize the codes by ensuring consistent spacing after commas
-df['AI_Final_Code'] = df['AI_Final_Code'].str.replace(', ', ',').str.replace(',', ', ')
+    # Apply the function to create the two new columns
+    df[['AI_Final_Code', 'AI_Reasoning']] = split_normalize_frame(df)
 
-# Save the cleaned file
-output_path = '/content/drive/MyDrive/AZ_Only/Cleaned/Cleaned_AZ_Batch_100_to_300.csv'
-df.to_csv(output_path, index=False)
+    # Save the cleaned file
+    output_path = '/content/drive/MyDrive/AZ_Only/Cleaned/Cleaned_AZ_Batch_100_to_300.csv'
+    write_csv(df, output_path, index=False)
 
-print(f"✅ Processing complete. {len(df)} rows split and normalized.")
-print(f"📁 File saved to: {output_path}")
+    print(f"✅ Processing complete. {len(df)} rows split and normalized.")
+    print(f"📁 File saved to: {output_path}")
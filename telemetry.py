@@ -0,0 +1,177 @@
+import argparse
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+import pandas as pd
+from preprocessing_util import PRICING
+from atomic_io import write_json, write_parquet
+
+# --- CONFIGURATION ---
+# Every gateway call appends one record (HTTP latency, time waited before it,
+# token counts, finish reason, retries, model) to an in-memory buffer that is flushed as small Parquet part
+# files. `python telemetry.py summary` reads them while a batch is still running.
+TELEMETRY_DIR = os.environ.get('VR_TELEMETRY_DIR', os.path.expanduser('~/.cache/vr_transcripts/telemetry'))
+FLUSH_EVERY = 50          # records
+FLUSH_SECONDS = 30        # ...or this long since the last flush, whichever comes first
+RUN_ID = os.environ.get('VR_RUN_ID') or time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+
+
+def _usage(response, name):
+    usage = getattr(response, 'usage_metadata', None)
+    return getattr(usage, name, None) or 0
+
+
+def _finish_reason(response):
+    candidates = getattr(response, 'candidates', None) or []
+    reason = getattr(candidates[0], 'finish_reason', None) if candidates else None
+    return None if reason is None else str(getattr(reason, 'name', reason))
+
+
+class Telemetry:
+    """Buffered per-call telemetry sink writing Parquet parts under `directory`."""
+
+    def __init__(self, directory=TELEMETRY_DIR, run_id=RUN_ID):
+        self.directory = directory
+        self.run_id = run_id
+        self._buffer = []
+        self._parts = 0
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.flush)
+
+    def start_run(self, label, total_items):
+        """Declares how many transcripts this run expects, for the live ETA."""
+        write_json({'run_id': self.run_id, 'label': label, 'total_items': int(total_items), 'started': time.time()},
+                   os.path.join(self.directory, f"run-{self.run_id}.json"))
+
+    def record(self, model, latency, response=None, attempts=1, error_class=None, items=1, wait=0.0):
+        row = {
+            'run_id': self.run_id,
+            'ts': time.time(),
+            'model': model,
+            'latency_s': round(latency, 4),
+            'wait_s': round(wait, 4),
+            'attempts': attempts,
+            'retries': max(0, attempts - 1),
+            'items': items,
+            'from_cache': bool(getattr(response, 'from_cache', False)),
+            'prompt_tokens': _usage(response, 'prompt_token_count'),
+            'cached_tokens': _usage(response, 'cached_content_token_count'),
+            'candidates_tokens': _usage(response, 'candidates_token_count'),
+            'thoughts_tokens': _usage(response, 'thoughts_token_count'),
+            'finish_reason': _finish_reason(response) if response is not None else None,
+            'error_class': error_class,
+        }
+        with self._lock:
+            self._buffer.append(row)
+            due = len(self._buffer) >= FLUSH_EVERY or time.time() - self._last_flush >= FLUSH_SECONDS
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.time()
+            if not rows:
+                return
+            self._parts += 1
+            part = self._parts
+        path = os.path.join(self.directory, f"calls-{self.run_id}-{os.getpid()}-{part:05d}.parquet")
+        write_parquet(pd.DataFrame(rows), path, index=False)
+
+
+TELEMETRY = Telemetry()
+
+
+def load_calls(directory=TELEMETRY_DIR, run_id=None):
+    paths = sorted(glob.glob(os.path.join(directory, f"calls-{run_id or '*'}-*.parquet")))
+    if not paths:
+        return pd.DataFrame()
+    return pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+
+
+def call_cost(calls):
+    """USD per call row: uncached input + cached input + (candidates + thoughts) output."""
+    prices = calls['model'].map(lambda m: PRICING.get(m, PRICING['default']))
+    uncached = (calls['prompt_tokens'] - calls['cached_tokens']).clip(lower=0)
+    return (uncached * prices.str['input'] + calls['cached_tokens'] * prices.str['cached_input']
+            + (calls['candidates_tokens'] + calls['thoughts_tokens']) * prices.str['output']) / 1e6
+
+
+def summarize(calls, run_meta=None):
+    """Latency percentiles, tokens and cost per transcript, errors, and ETA for one run."""
+    live = calls[~calls['from_cache'] & calls['error_class'].isna()]
+    ok = calls[calls['error_class'].isna()]
+    transcripts = max(int(ok['items'].sum()), 1)
+    cost = call_cost(live).sum()
+
+    summary = {
+        'calls': len(calls),
+        'cache_hits': int(calls['from_cache'].sum()),
+        'failed_calls': int(calls['error_class'].notna().sum()),
+        'transcripts_done': int(ok['items'].sum()),
+        'latency_p50_s': round(float(live['latency_s'].quantile(0.5)), 2) if len(live) else None,
+        'latency_p95_s': round(float(live['latency_s'].quantile(0.95)), 2) if len(live) else None,
+        # Limiter, concurrency slot, pacing and back-off before the call (older runs lack it)
+        'wait_p95_s': round(float(live['wait_s'].quantile(0.95)), 2)
+        if len(live) and 'wait_s' in live and live['wait_s'].notna().any() else None,
+        'retries': int(calls['retries'].sum()),
+        'prompt_tokens_per_transcript': round(live['prompt_tokens'].sum() / transcripts, 1),
+        'thought_tokens_per_transcript': round(live['thoughts_tokens'].sum() / transcripts, 1),
+        'output_tokens_per_transcript': round(live['candidates_tokens'].sum() / transcripts, 1),
+        'cost_usd': round(float(cost), 4),
+        'cost_per_1k_transcripts_usd': round(float(cost) / transcripts * 1000, 2),
+        'finish_reasons': live['finish_reason'].value_counts().to_dict(),
+        'errors': calls['error_class'].value_counts().to_dict(),
+    }
+
+    if run_meta:
+        remaining = run_meta['total_items'] - summary['transcripts_done']
+        # Throughput over the last 10 minutes tracks the current rate, not the warm-up
+        recent = ok[ok['ts'] >= ok['ts'].max() - 600] if len(ok) else ok
+        span = (recent['ts'].max() - recent['ts'].min()) if len(recent) > 1 else 0
+        rate = recent['items'].sum() / span if span > 0 else None
+        summary['total_transcripts'] = run_meta['total_items']
+        summary['rate_per_min'] = round(rate * 60, 1) if rate else None
+        summary['eta_min'] = round(remaining / rate / 60, 1) if rate and remaining > 0 else 0.0
+    return summary
+
+
+def latest_run_id(directory=TELEMETRY_DIR):
+    """Run id of the most recently written run file or call part."""
+    paths = glob.glob(os.path.join(directory, 'run-*.json')) + glob.glob(os.path.join(directory, 'calls-*.parquet'))
+    if not paths:
+        return None
+    name = os.path.basename(max(paths, key=os.path.getmtime))
+    if name.startswith('run-'):
+        return name[len('run-'):-len('.json')]
+    return name[len('calls-'):].rsplit('-', 2)[0]   # calls-<run_id>-<pid>-<part>.parquet
+
+
+def print_telemetry_report(run_id=None, directory=TELEMETRY_DIR):
+    TELEMETRY.flush()
+    run_id = run_id or TELEMETRY.run_id
+    calls = load_calls(directory, run_id)
+    print(f"\nTELEMETRY REPORT (run {run_id})\n" + "=" * 30)
+    if calls.empty:
+        print("No calls recorded.")
+    else:
+        meta_path = os.path.join(directory, f"run-{run_id}.json")
+        meta = json.load(open(meta_path)) if os.path.exists(meta_path) else None
+        for key, value in summarize(calls, meta).items():
+            print(f"{key}: {value}")
+    print("=" * 30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize gateway call telemetry.")
+    parser.add_argument('command', choices=['summary'])
+    parser.add_argument('--run', help="Run id (default: the most recently started run).")
+    parser.add_argument('--dir', default=TELEMETRY_DIR)
+    args = parser.parse_args()
+    print_telemetry_report(args.run or latest_run_id(args.dir), args.dir)
@@ -0,0 +1,89 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from atomic_io import atomic_write
+
+# --- CONFIGURATION ---
+# One-time ingest of the master CSV into a Parquet copy sorted by StudyID. Row
+# group min/max statistics let a loader read only the groups that hold the
+# requested StudyIDs, so batch 30 costs the same as batch 1 (read_csv with
+# skiprows has to parse everything before the slice, multi-line transcripts and all).
+# Each row keeps its position in the CSV, so positional START_ROW slices (and the
+# Coded_Batch_{START}_to_{END} files named after them) mean what they always did.
+ROW_GROUP_SIZE = 1000   # matches shard_queue.SHARD_SIZE, so a shard is ~one row group
+ID_COLUMN = 'StudyID'
+POSITION_COLUMN = '_csv_row'
+
+
+def parquet_path_for(input_file):
+    """UATranscripts_All.csv -> UATranscripts_All.parquet"""
+    return os.path.splitext(input_file)[0] + '.parquet'
+
+
+def ingest(input_file, parquet_path=None, row_group_size=ROW_GROUP_SIZE, id_column=ID_COLUMN):
+    """
+    Writes the StudyID-sorted Parquet copy of input_file. Skipped when the copy
+    is already newer than the CSV. Returns the Parquet path.
+    """
+    parquet_path = parquet_path or parquet_path_for(input_file)
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(input_file) \
+            and POSITION_COLUMN in pq.ParquetFile(parquet_path).schema_arrow.names:
+        return parquet_path
+
+    df = pd.read_csv(input_file)
+    df[POSITION_COLUMN] = np.arange(len(df), dtype='int64')
+    df = df.sort_values(id_column, kind='stable').reset_index(drop=True)
+    with atomic_write(parquet_path, 'wb') as f:
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), f, row_group_size=row_group_size)
+    print(f"📚 Ingested {len(df)} rows from {input_file} into {parquet_path} "
+          f"({pq.ParquetFile(parquet_path).num_row_groups} row groups).")
+    return parquet_path
+
+
+def _without_position(df):
+    return df.drop(columns=[POSITION_COLUMN], errors='ignore')
+
+
+def load_study_ids(parquet_path, study_ids, id_column=ID_COLUMN):
+    """Rows for an explicit StudyID list (e.g. a claimed shard), in StudyID order."""
+    return _without_position(pd.read_parquet(parquet_path, filters=[(id_column, 'in', list(study_ids))]))
+
+
+def csv_order(parquet_path, study_ids, id_column=ID_COLUMN):
+    """The given StudyIDs in CSV row order (IDs the store lacks are dropped)."""
+    study_ids = list(study_ids)
+    if not study_ids:
+        return []
+    table = pq.read_table(parquet_path, columns=[id_column, POSITION_COLUMN],
+                          filters=[(id_column, 'in', study_ids)])
+    return table.sort_by(POSITION_COLUMN)[id_column].to_pylist()
+
+
+def load_id_range(parquet_path, first_id, last_id, id_column=ID_COLUMN):
+    """Rows with first_id <= StudyID <= last_id."""
+    return _without_position(pd.read_parquet(parquet_path,
+                                             filters=[(id_column, '>=', first_id), (id_column, '<=', last_id)]))
+
+
+def load_slice(parquet_path, start_row, n_rows):
+    """
+    Positional slice in CSV row order; the drop-in for read_csv(skiprows=..., nrows=...).
+    Reads the position column, then only the row groups holding the slice's rows.
+    """
+    parquet_file = pq.ParquetFile(parquet_path)
+    positions = parquet_file.read(columns=[POSITION_COLUMN])[POSITION_COLUMN].to_numpy()
+    wanted = (positions >= start_row) & (positions < start_row + n_rows)
+    bounds = np.cumsum([0] + [parquet_file.metadata.row_group(i).num_rows
+                              for i in range(parquet_file.num_row_groups)])
+    groups = [i for i in range(parquet_file.num_row_groups) if wanted[bounds[i]:bounds[i + 1]].any()]
+
+    if not groups:
+        return _without_position(parquet_file.schema_arrow.empty_table().to_pandas())
+    table = parquet_file.read_row_groups(groups)
+    in_slice = pc.and_(pc.greater_equal(table[POSITION_COLUMN], start_row),
+                       pc.less(table[POSITION_COLUMN], start_row + n_rows))
+    table = table.filter(in_slice).sort_by(POSITION_COLUMN)
+    return _without_position(table.to_pandas())
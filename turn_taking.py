@@ -2,24 +2,30 @@ import pandas as pd
 import re
 from datetime import datetime
 
-def analyze_ua_conversation(transcript_text):
-    # 1. Define the regex pattern for UA transcripts: [Time] - [Speaker] : [Text]
-    # This captures the Time, Speaker, and Message
-    pattern = r"(\d{2}:\d{2}:\d{2}) - (.*?) : (.*?)(?=\n\d{2}:\d{2}:\d{2} - |$)"
-    
+# UA transcripts: [Time] - [Speaker] : [Text], one turn per timestamped line
+TURN_PATTERN = re.compile(r"(\d{2}:\d{2}:\d{2}) - (.*?) : (.*?)(?=\n\d{2}:\d{2}:\d{2} - |$)", re.DOTALL)
+
+def parse_turns(transcript_text):
+    """
+    Splits a raw UA transcript into turns: timestamp, speaker ('Librarian' or
+    'Patron'), text and word_count. Returns [] when the text isn't in that format.
+    """
+    if not isinstance(transcript_text, str):
+        return []
+
     turns = []
-    matches = re.findall(pattern, transcript_text, re.DOTALL)
-    
-    for match in matches:
-        timestamp_str, speaker, text = match
+    for timestamp_str, speaker, text in TURN_PATTERN.findall(transcript_text):
         turns.append({
             'timestamp': datetime.strptime(timestamp_str, '%H:%M:%S'),
             'speaker': 'Librarian' if 'UA' in speaker else 'Patron',
             'text': text.strip(),
             'word_count': len(text.split())
         })
-    
-    df = pd.DataFrame(turns)
+    return turns
+
+def analyze_ua_conversation(transcript_text):
+    # 1. One row per [Time] - [Speaker] : [Text] turn
+    df = pd.DataFrame(parse_turns(transcript_text))
     
     if df.empty:
         return "No turns detected. Check transcript format."
@@ -64,8 +70,9 @@ ua_sample = """17:18:38 - UA : Hi - this is UA. <br />
 17:22:39 - UA : You're welcome, take care.<br />
 17:22:51 - [REDACTED NAME] : take care."""
 
-stats, detailed_df = analyze_ua_conversation(ua_sample)
+if __name__ == "__main__":
+    stats, detailed_df = analyze_ua_conversation(ua_sample)
 
-print("--- UA SERVICE RHYTHM REPORT ---")
-for key, value in stats.items():
-    print(f"{key}: {value}")
+    print("--- UA SERVICE RHYTHM REPORT ---")
+    for key, value in stats.items():
+        print(f"{key}: {value}")
@@ -1,18 +1,16 @@
 import json
 import os
-import time
 import pandas as pd
-from google import genai
 from google.genai import types
-from google.colab import userdata
+from gemini_gateway import generate_content
+from model_backend import get_client
 from preprocessing_util import clean_raw_text, AI_CONFIG, MODEL_NAME
+from atomic_io import write_csv
+from shutdown import ShutdownRequested, graceful_shutdown, shutdown_requested
+from budget import GOVERNOR, print_budget_report
 
 # --- INITIALIZATION ---
-client = genai.Client(
-    api_key=userdata.get('GEMINI_API_KEY'),
-    vertexai=False,
-    http_options=types.HttpOptions(api_version='v1beta')
-)
+client = get_client()
 
 with open('codebook_cluster.json', 'r') as f:
     CODEBOOK_DICT = json.load(f)
@@ -49,7 +47,8 @@ def audit_record(row):
     *NOTE for 'Final Resolved Code': If there are no changes, output the exact 'Current Codes Assigned'. If you recommended changes, output what the complete, clean final list of codes should look like after applying your recommendations.*
     """
     try:
-        response = client.models.generate_content(
+        response = generate_content(
+            client,
             model="gemini-2.5-flash",
             contents=user_content,
             config=types.GenerateContentConfig(
@@ -65,15 +64,20 @@ def audit_record(row):
         if len(fields) < 5:
             fields.extend(["N/A"] * (5 - len(fields)))
         return fields[:5]
-        
+
+    except ShutdownRequested:
+        raise
     except Exception as e:
         print(f"Error processing StudyID {row.get('StudyID')}: {e}")
         # Fallback fields matching the format to preserve the CSV row layout
         return ["API Error", "API Error Interruption", "ERROR", str(e), "ERROR"]
 
 
-def run_batch_audit(input_csv_path, output_csv_path, max_rows=None, save_interval=None, start_row=0):
-    """Reads input CSV, handles slicing offsets, and outputs a flat CSV report."""
+def run_batch_audit(input_csv_path, output_csv_path, max_rows=None, save_interval=None, start_row=0, budget=None):
+    """
+    Reads input CSV, handles slicing offsets, and outputs a flat CSV report.
+    `budget` holds the hard spend caps passed to budget.GOVERNOR.start_run().
+    """
     df = pd.read_csv(input_csv_path)
     
     # Apply starting row offset if picking up from a partial run
@@ -87,6 +91,7 @@ def run_batch_audit(input_csv_path, output_csv_path, max_rows=None, save_interva
     audit_results = []
     total_records = len(df)
     print(f"Starting audit loop for {total_records} records...")
+    GOVERNOR.start_run(total_records, **(budget or {}))
 
     # Modular internal helper to save progress dynamically without data corruption
     def save_progress_to_csv(results, path):
@@ -100,29 +105,31 @@ def run_batch_audit(input_csv_path, output_csv_path, max_rows=None, save_interva
             '[Reason for Code Changes]',
             '[Final Code]'
         ])
-        temp_df.to_csv(path, index=False)
+        write_csv(temp_df, path, index=False)
 
     try:
-        for idx, row in df.iterrows():
-            print(f"Auditing index {idx + 1}/{total_records} (StudyID: {row.get('StudyID')})")
-
-            # Get the flat 4-field list from the model
-            ai_output = audit_record(row)
-            
-            # Combine the row's StudyID with the 4 fields from the model
-            row_result = [str(row.get('StudyID', 'N/A'))] + ai_output
-            audit_results.append(row_result)
-
-            # Checkpoint Save logic
-            if save_interval and (idx + 1) % save_interval == 0:
-                save_progress_to_csv(audit_results, output_csv_path)
-                progress = ((idx + 1) / total_records) * 100
-                print(f"💾 Checkpoint Saved. Total Progress: {progress:.1f}%")
-
-            # Active wait to respect API rate limits
-            time.sleep(1.5)
-
-    except KeyboardInterrupt:
+        # SIGTERM/SIGINT let the current request finish, then stop at the next row
+        with graceful_shutdown():
+            for idx, row in df.iterrows():
+                if shutdown_requested():
+                    print(f"🛑 Stopping before index {idx + 1}/{total_records}.")
+                    break
+                print(f"Auditing index {idx + 1}/{total_records} (StudyID: {row.get('StudyID')})")
+
+                # Get the flat 4-field list from the model
+                ai_output = audit_record(row)
+
+                # Combine the row's StudyID with the 4 fields from the model
+                row_result = [str(row.get('StudyID', 'N/A'))] + ai_output
+                audit_results.append(row_result)
+
+                # Checkpoint Save logic
+                if save_interval and (idx + 1) % save_interval == 0:
+                    save_progress_to_csv(audit_results, output_csv_path)
+                    progress = ((idx + 1) / total_records) * 100
+                    print(f"💾 Checkpoint Saved. Total Progress: {progress:.1f}%")
+
+    except (KeyboardInterrupt, ShutdownRequested):
         print("\n🛑 Manual stop detected during processing. Saving current progress...")
         if audit_results:
             save_progress_to_csv(audit_results, output_csv_path)
@@ -135,6 +142,7 @@ def run_batch_audit(input_csv_path, output_csv_path, max_rows=None, save_interva
         print(f"Audit completed successfully! Saved to: {output_csv_path}")
     else:
         print("No records processed or saved.")
+    print_budget_report()
 
 
 # --- Execution Entry Point ---
@@ -145,6 +153,7 @@ if __name__ == "__main__":
     START_ROW = 0      # Set to skip rows (e.g., set to 500 to pick up after the 500th row)
     SAVE_INTERVAL = 5  # Saves your spreadsheet every 5 records
     MAX_ROWS = 20      # Set to None to run the complete file
+    BUDGET = dict(max_cost_usd=None, max_tokens=None, max_thought_tokens=None)   # None = no cap
 
     try:
         run_batch_audit(
@@ -152,7 +161,8 @@ if __name__ == "__main__":
             output_csv_path=OUTPUT_FILE, 
             max_rows=MAX_ROWS, 
             save_interval=SAVE_INTERVAL,
-            start_row=START_ROW
+            start_row=START_ROW,
+            budget=BUDGET
         )
     except Exception as e:
         print(f"An error occurred during batch audit: {e}")